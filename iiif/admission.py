@@ -0,0 +1,135 @@
+"""Cost-based admission control for image requests.
+
+A request for the full resolution PNG of a very large image costs
+thousands of times more to derive than a 512 pixel tile. The cost of
+each image request is estimated with request_cost() from the image
+dimensions alone, before the image is read: the number of pixels in
+the region that must be decoded plus the number of output pixels
+weighted by the cost of encoding the output format.
+
+IIIFAdmission admits requests against a per-process budget of cost
+units. Cheap requests are always admitted immediately so that tile
+requests stay fast. Other requests are admitted while the total cost of
+requests being derived is within the budget, otherwise they queue for
+up to max_wait seconds and are then rejected with a 503 Service
+Unavailable error with a Retry-After header. A request that costs more
+than the whole budget is admitted only when no other costed request is
+in progress.
+"""
+
+import math
+import threading
+import time
+
+from .error import IIIFError
+
+# Relative cost of encoding one output pixel in each format, compared
+# with decoding one source pixel
+FORMAT_COSTS = {'jpg': 1.0, 'png': 4.0, 'webp': 4.0, 'gif': 2.0,
+                'tif': 1.0, 'jp2': 8.0, 'pdf': 2.0}
+
+
+def request_cost(request, width, height):
+    """Estimated cost in megapixel units of request for image width x height.
+
+    The request must already have been parsed. The cost is the number
+    of source pixels in the region plus the number of output pixels
+    times the format cost from FORMAT_COSTS, divided by 1e6. Will raise
+    an IIIFError if the request is not valid for the image size.
+    """
+    # Import here to avoid circular import
+    from .manipulator import IIIFManipulator
+    m = IIIFManipulator(api_version=request.api_version)
+    m.request = request
+    (m.width, m.height) = (width, height)
+    (x, y, rw, rh) = m.region_to_apply()
+    if (x is None):
+        (rw, rh) = (width, height)
+    (m.width, m.height) = (rw, rh)
+    (sw, sh) = m.size_to_apply()
+    if (sw is None):
+        (sw, sh) = (rw, rh)
+    format_cost = FORMAT_COSTS.get(request.format, 1.0)
+    return (rw * rh + sw * sh * format_cost) / 1000000.0
+
+
+class IIIFAdmission(object):
+    """Admit requests against a budget of cost units."""
+
+    def __init__(self, budget, max_wait=10.0, cheap_cost=1.0):
+        """Initialize IIIFAdmission object.
+
+        Arguments:
+        budget -- total cost of requests in progress, in the megapixel
+            units of request_cost()
+
+        Keyword arguments:
+        max_wait -- maximum time in seconds that a request queues for
+            admission before being rejected (default 10)
+        cheap_cost -- requests with cost up to this are always admitted
+            (default 1.0, a 512x512 tile costs under 0.5)
+        """
+        self.budget = budget
+        self.max_wait = max_wait
+        self.cheap_cost = cheap_cost
+        self.in_use = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    @property
+    def retry_after(self):
+        """Seconds for Retry-After header of rejections, at least 1."""
+        return max(1, int(math.ceil(self.max_wait)))
+
+    def acquire(self, cost):
+        """Admit request with cost, return charge to pass to release().
+
+        Waits for up to self.max_wait seconds if the budget is used up.
+        Raises IIIFError with code 503 and a Retry-After header if the
+        request cannot be admitted in that time.
+        """
+        if (cost <= self.cheap_cost):
+            with self._cond:
+                self.admitted += 1
+            return 0.0
+        charge = min(cost, self.budget)
+        deadline = time.time() + self.max_wait
+        with self._cond:
+            waited = False
+            while (self.in_use > 0.0 and self.in_use + charge > self.budget):
+                remaining = deadline - time.time()
+                if (remaining <= 0.0):
+                    self.rejected += 1
+                    raise IIIFError(code=503,
+                                    text="Server busy, request with cost %.1f not admitted." % (cost),
+                                    headers={'Retry-After': str(self.retry_after)})
+                if (not waited):
+                    self.queued += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self.in_use += charge
+            self.admitted += 1
+        return charge
+
+    def release(self, charge):
+        """Release charge from acquire() and wake waiting requests."""
+        if (charge > 0.0):
+            with self._cond:
+                self.in_use = max(0.0, self.in_use - charge)
+                self._cond.notify_all()
+
+    def run(self, cost, fn):
+        """Return result of fn() called once request with cost is admitted."""
+        charge = self.acquire(cost)
+        try:
+            return fn()
+        finally:
+            self.release(charge)
+
+    def stats(self):
+        """Return dict of admission statistics."""
+        with self._cond:
+            return {'in_use': self.in_use, 'admitted': self.admitted,
+                    'queued': self.queued, 'rejected': self.rejected}
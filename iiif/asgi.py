@@ -0,0 +1,379 @@
+"""Asyncio server for IIIF Image API handlers.
+
+IIIFASGIApp is an ASGI application that serves the same IIIF Image API
+handlers as the Flask application set up with add_handler() in
+iiif.flask_utils, reusing IIIFHandler, IIIFRequest, IIIFInfo and the
+manipulators. Requests are routed on the event loop. Work that reads
+or derives images, including reading the image size for the ETag of a
+conditional request, is run in a fixed size pool of threads so that a
+slow request does not hold up others, and responses are sent in chunks so
+that slow clients do not hold a thread. Thus many concurrent keep-alive
+connections are served with a small number of threads.
+
+IIIFASGIApp may be run with any ASGI server, or with the simple
+HTTP/1.1 server provided by serve(). Auth is not supported because the
+IIIFAuth implementations depend on Flask, so adding a handler with auth
+is an error rather than serving its images without access control.
+
+Requires Python 3.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import logging
+from urllib.parse import quote as urlquote, unquote, urljoin
+from wsgiref.headers import Headers
+
+from .error import IIIFError
+from .flask_utils import (IIIFHandler, setup_handler, top_level_index_page,
+                          prefix_index_page)
+from .manipulator import timer
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+
+class IIIFASGIHandler(IIIFHandler):
+    """IIIFHandler for a request received by IIIFASGIApp.
+
+    Responses are (status, headers, body) tuples instead of Flask
+    response objects.
+    """
+
+    def __init__(self, prefix, identifier, config, klass, headers):
+        """Initialize IIIFASGIHandler.
+
+        Positional parameters as for IIIFHandler except that there is
+        no auth and headers is a wsgiref.headers.Headers object with
+        the request headers.
+        """
+        self._request_headers = headers
+        super(IIIFASGIHandler, self).__init__(prefix, identifier, config, klass, None)
+
+    @property
+    def request_headers(self):
+        """Headers of the current request."""
+        return self._request_headers
+
+    def make_response(self, content, code=200, headers=None):
+        """Response tuple (status, headers, body) with local headers added."""
+        if headers:
+            for header in headers:
+                self.headers[header] = headers[header]
+        if (not isinstance(content, bytes)):
+            content = content.encode('utf-8')
+        return (code, dict(self.headers), content)
+
+    def file_response(self, file, mime_type):
+        """Response with contents of file, then cleanup manipulator."""
+        with open(file, 'rb') as fh:
+            data = fh.read()
+        self.manipulator.cleanup()
+        return self.make_response(data, headers={'Content-Type': mime_type})
+
+
+def text_response(status, text, headers=None):
+    """Response tuple for plain text and status, with optional headers."""
+    h = {'Access-control-allow-origin': '*',
+         'Content-Type': 'text/plain'}
+    h.update(headers or {})
+    return (status, h, text.encode('utf-8'))
+
+
+def html_response(html):
+    """Response tuple for HTML page."""
+    return (200, {'Content-Type': 'text/html; charset=utf-8'}, html.encode('utf-8'))
+
+
+class IIIFASGIApp(object):
+    """ASGI application serving IIIF Image API handlers."""
+
+    chunk_size = 65536
+
+    def __init__(self, config=None, workers=4):
+        """Initialize IIIFASGIApp.
+
+        Arguments:
+        config -- configuration used for the top-level index page (which
+            uses config.host and config.prefixes) or None for no index
+            page
+        workers -- number of threads used to read and derive images
+        """
+        self.config = config
+        self.workers = workers
+        self.handlers = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.logger = logging.getLogger(__name__)
+
+    def add_handler(self, config):
+        """Add a single IIIF Image API handler.
+
+        Arguments:
+        config -- configuration object as for add_handler() in
+            iiif.flask_utils, auth_type must be 'none'. Sets
+            config.in_memory so that images are derived into
+            memory buffers where supported
+
+        Returns True on success, nothing otherwise. Raises ValueError
+        if config.auth_type is not 'none'.
+        """
+        if (config.auth_type is not None and config.auth_type != 'none'):
+            raise ValueError("Auth type %s for %s is not supported by the ASGI server, "
+                             "use the Flask server for handlers with auth" %
+                             (config.auth_type, config.prefix))
+        setup = setup_handler(config)
+        if (setup is None):
+            return
+        config.in_memory = True
+        base = urljoin('/', config.prefix + '/')  # ensure has trailing slash
+        self.handlers[base] = (config, setup[0])
+        self.logger.warning("Installing %s IIIFManipulator at %s v%s (ASGI)" %
+                            (config.klass_name, base, config.api_version))
+        return True
+
+    def close(self):
+        """Shut down worker threads after current work is complete."""
+        self.executor.shutdown(wait=True)
+
+    async def __call__(self, scope, receive, send):
+        """ASGI application interface for lifespan and http scopes."""
+        if (scope['type'] == 'lifespan'):
+            while True:
+                message = await receive()
+                if (message['type'] == 'lifespan.startup'):
+                    await send({'type': 'lifespan.startup.complete'})
+                elif (message['type'] == 'lifespan.shutdown'):
+                    self.close()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        elif (scope['type'] == 'http'):
+            response = await self.response(scope)
+            await self.send_response(send, response, head=(scope['method'] == 'HEAD'))
+
+    def find_handler(self, path):
+        """Find handler for path.
+
+        Returns (config, klass, rest) where rest is the part of path
+        after the handler prefix and slash, or None if there is no
+        handler.
+        """
+        for (base, (config, klass)) in self.handlers.items():
+            if (path.startswith(base)):
+                return (config, klass, path[len(base):])
+            elif (path == base[:-1]):
+                return (config, klass, '')
+        return None
+
+    async def response(self, scope):
+        """Response tuple (status, headers, body) for HTTP request in scope."""
+        path = scope['path']
+        method = scope['method']
+        if (method not in ('GET', 'HEAD', 'OPTIONS')):
+            return text_response(405, "Method not allowed\n",
+                                 {'Allow': 'GET, HEAD, OPTIONS'})
+        if (path == '/' and self.config is not None):
+            return html_response(top_level_index_page(self.config))
+        metrics = IIIFHandler.metrics
+        if (path == '/metrics' and metrics is not None):
+            text = await asyncio.get_event_loop().run_in_executor(self.executor, metrics.render)
+            return (200, {'Content-Type': METRICS_CONTENT_TYPE}, text.encode('utf-8'))
+        found = self.find_handler(path)
+        if (found is None):
+            return text_response(404, "Not found\n")
+        (config, klass, rest) = found
+        if (rest == ''):
+            return html_response(prefix_index_page(config))
+        (identifier, slash, image_path) = rest.partition('/')
+        if (identifier == ''):
+            return text_response(404, "Not found\n")
+        if (image_path == ''):
+            client_base = urljoin('/', config.client_prefix + '/')
+            return text_response(303, "See info.json\n",
+                                 {'Location': client_base + urlquote(identifier) + '/info.json'})
+        if (method == 'OPTIONS'):
+            if (image_path != 'info.json'):
+                return text_response(405, "Method not allowed\n", {'Allow': 'GET, HEAD'})
+            return (200, {'Access-Control-Allow-Origin': '*',
+                          'Access-Control-Allow-Methods': 'GET,OPTIONS',
+                          'Access-Control-Allow-Headers': 'Origin, Accept, Accept-Encoding, Authorization'},
+                    b'')
+        if (metrics is None):
+            return await self.handler_response(scope, config, klass, identifier, image_path)
+        # record info and image requests in metrics
+        request_type = ('info' if (image_path == 'info.json') else 'image')
+        metrics.request_started(config.client_prefix)
+        start = timer()
+        response = (500, {}, b'')
+        try:
+            response = await self.handler_response(scope, config, klass, identifier, image_path)
+        finally:
+            metrics.request_finished(config.client_prefix, request_type, response[0],
+                                     len(response[2]), timer() - start)
+        return response
+
+    async def handler_response(self, scope, config, klass, identifier, image_path):
+        """Response tuple for info or image request with handler config."""
+        headers = Headers([(k.decode('latin-1'), v.decode('latin-1'))
+                           for (k, v) in scope.get('headers', [])])
+        handler = IIIFASGIHandler(config.client_prefix, identifier, config, klass, headers)
+        loop = asyncio.get_event_loop()
+        try:
+            if (image_path == 'info.json'):
+                return await loop.run_in_executor(self.executor,
+                                                  handler.image_information_response)
+            return await loop.run_in_executor(self.executor,
+                                              handler.image_request_response, image_path)
+        except IIIFError as e:
+            return handler.error_response(e)
+        except Exception as e:
+            self.logger.exception("Unexpected error for %s: %s" % (scope['path'], str(e)))
+            return text_response(500, "Internal Server Error\n")
+
+    async def send_response(self, send, response, head=False):
+        """Send response tuple in chunks of up to self.chunk_size bytes.
+
+        The body is not sent if head is True.
+        """
+        (status, headers, body) = response
+        headers = dict(headers)
+        headers['Content-Length'] = str(len(body))
+        if ('Content-Type' not in headers and len(body) > 0):
+            headers['Content-Type'] = 'text/html; charset=utf-8'
+        await send({'type': 'http.response.start',
+                    'status': status,
+                    'headers': [(k.lower().encode('latin-1'), str(v).encode('latin-1'))
+                                for (k, v) in headers.items()]})
+        if (head):
+            body = b''
+        offset = 0
+        while True:
+            chunk = body[offset:offset + self.chunk_size]
+            offset += len(chunk)
+            await send({'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': offset < len(body)})
+            if (offset >= len(body)):
+                break
+
+
+async def serve_connection(app, reader, writer, timeout=60):
+    """Serve HTTP/1.1 requests on one connection with ASGI app.
+
+    Handles a sequence of requests on a keep-alive connection until
+    the client closes it, asks for it to be closed, or does not send a
+    request within timeout seconds. Any request body is read and
+    ignored.
+    """
+    server = writer.get_extra_info('sockname')
+    client = writer.get_extra_info('peername')
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError, ConnectionError):
+                break
+            lines = head.decode('latin-1').split('\r\n')
+            try:
+                (method, target, version) = lines[0].split(' ')
+            except ValueError:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            headers = []
+            for line in lines[1:]:
+                (name, colon, value) = line.partition(':')
+                if (colon):
+                    headers.append((name.strip().lower().encode('latin-1'),
+                                    value.strip().encode('latin-1')))
+            h = dict(headers)
+            connection = h.get(b'connection', b'').lower()
+            if (version == 'HTTP/1.0'):
+                keep_alive = (connection == b'keep-alive')
+            else:
+                keep_alive = (connection != b'close')
+            if (b'transfer-encoding' in h):
+                keep_alive = False
+            elif (b'content-length' in h):
+                await reader.readexactly(int(h[b'content-length']))
+            (path, question, query) = target.partition('?')
+            scope = {'type': 'http',
+                     'asgi': {'version': '3.0', 'spec_version': '2.1'},
+                     'http_version': version[5:],
+                     'method': method.upper(),
+                     'scheme': 'http',
+                     'path': unquote(path),
+                     'raw_path': path.encode('latin-1'),
+                     'query_string': query.encode('latin-1'),
+                     'root_path': '',
+                     'headers': headers,
+                     'server': tuple(server[:2]),
+                     'client': tuple(client[:2])}
+            state = {'keep_alive': keep_alive, 'started': False}
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if (message['type'] == 'http.response.start'):
+                    status = message['status']
+                    try:
+                        reason = HTTPStatus(status).phrase
+                    except ValueError:
+                        reason = ''
+                    lines = ['HTTP/1.1 %d %s' % (status, reason)]
+                    names = set()
+                    for (name, value) in message.get('headers', []):
+                        names.add(name.lower())
+                        lines.append('%s: %s' % (name.decode('latin-1'), value.decode('latin-1')))
+                    if (b'content-length' not in names):
+                        # end of response is only shown by closing
+                        state['keep_alive'] = False
+                    if (not state['keep_alive']):
+                        lines.append('Connection: close')
+                    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+                    state['started'] = True
+                elif (message['type'] == 'http.response.body'):
+                    writer.write(message.get('body', b''))
+                    await writer.drain()
+
+            try:
+                await app(scope, receive, send)
+            except Exception as e:
+                logging.getLogger(__name__).exception("Unexpected error: %s" % (str(e)))
+                if (not state['started']):
+                    writer.write(b'HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            if (not state['keep_alive']):
+                break
+    finally:
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+async def start_server(app, host='localhost', port=8000, timeout=60):
+    """Start HTTP/1.1 server for ASGI app, return asyncio.Server object.
+
+    See serve_connection() for timeout.
+    """
+    async def connection(reader, writer):
+        await serve_connection(app, reader, writer, timeout)
+    return await asyncio.start_server(connection, host, port)
+
+
+def serve(app, host='localhost', port=8000):
+    """Serve ASGI app on host and port until interrupted."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(start_server(app, host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        if (hasattr(app, 'close')):
+            app.close()
+        loop.close()
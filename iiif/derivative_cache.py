@@ -0,0 +1,179 @@
+"""Disk cache of derived images for the Flask server.
+
+Stores the encoded output of IIIFManipulator.derive() in files under
+a cache directory so that repeat requests for the same image, typically
+tiles of a popular image requested by many viewers, can be served
+without repeating the region/size/rotation/quality/format pipeline.
+
+Entries are keyed by a hash of the source file path, modification time
+and size, and request parameters that determine the output (the
+request URL path, API version and manipulator). Each entry is a file
+with the MIME type on the first line followed by the image data. Files
+are written to a temporary name and then renamed so that readers
+(including other processes sharing the cache directory) never see a
+partial entry. The total size of the cache is limited by removing the
+least recently used entries, the modification time of an entry file is
+updated on each hit to keep track of use.
+"""
+
+import hashlib
+import logging
+import os
+import os.path
+import tempfile
+import threading
+
+
+def derivative_key(srcfile, *params):
+    """Key for derivative of srcfile with params.
+
+    The key is a hex string SHA1 hash of the absolute path,
+    modification time and size of srcfile along with all the
+    additional string params. Will raise an OSError if srcfile
+    does not exist.
+    """
+    st = os.stat(srcfile)
+    parts = [os.path.abspath(srcfile), repr(st.st_mtime), str(st.st_size)]
+    parts.extend(params)
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class IIIFDerivativeCache(object):
+    """Disk cache of derived images with a limit on total size."""
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        """Initialize IIIFDerivativeCache object.
+
+        Arguments:
+        cache_dir -- directory for cache files, created if necessary
+
+        Keyword arguments:
+        max_bytes -- limit on the total size of cache files (default 1GB)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        if (not os.path.isdir(self.cache_dir)):
+            os.makedirs(self.cache_dir)
+        self.bytes = sum(size for (mtime, size, path) in self._entries())
+
+    def key(self, srcfile, *params):
+        """Cache key for derivative of srcfile with params.
+
+        See derivative_key() which this method calls.
+        """
+        return derivative_key(srcfile, *params)
+
+    def path(self, key):
+        """Path of cache file for key."""
+        return os.path.join(self.cache_dir, key[0:2], key)
+
+    def get(self, key):
+        """Return (data, mime_type) for key, or None if not in cache."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fh:
+                mime_type = fh.readline().rstrip(b'\n').decode('utf-8')
+                data = fh.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return (data, mime_type)
+
+    def put(self, key, data, mime_type):
+        """Add data with mime_type to the cache under key.
+
+        Will evict least recently used entries if the cache size
+        exceeds self.max_bytes. Data larger than self.max_bytes will
+        not be cached.
+
+        Returns True if the data was added, False otherwise.
+        """
+        if (len(data) > self.max_bytes):
+            return False
+        path = self.path(key)
+        dirname = os.path.dirname(path)
+        if (not os.path.isdir(dirname)):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # May have been created by another thread or process
+                pass
+        (fd, tmpfile) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(mime_type.encode('utf-8') + b'\n')
+                fh.write(data)
+            # size of any entry being replaced
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.rename(tmpfile, path)
+        except Exception as e:
+            self.logger.warning("Failed to write cache file %s: %s" % (path, str(e)))
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+            return False
+        with self._lock:
+            self.stores += 1
+            self.bytes += len(data) + len(mime_type) + 1 - replaced
+            over = (self.bytes > self.max_bytes)
+        if (over):
+            self.evict()
+        return True
+
+    def evict(self):
+        """Remove least recently used entries to reduce size of cache.
+
+        Removes entries until the total size is below 90% of
+        self.max_bytes so that each eviction scan of the cache
+        directory makes room for a number of new entries.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for (mtime, size, path) in entries)
+        target = self.max_bytes * 0.9
+        for (mtime, size, path) in entries:
+            if (total <= target):
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # May have been removed by another thread or process
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+        with self._lock:
+            self.bytes = total
+
+    def stats(self):
+        """Return dict of cache statistics."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'stores': self.stores, 'evictions': self.evictions,
+                    'bytes': self.bytes}
+
+    def _entries(self):
+        # Generate (mtime, size, path) for each cache file
+        for (dirpath, dirnames, filenames) in os.walk(self.cache_dir):
+            for filename in filenames:
+                if (filename.endswith('.tmp') or filename.endswith('.lock')):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield (st.st_mtime, st.st_size, path)
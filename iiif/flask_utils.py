@@ -6,10 +6,13 @@ requested and is thus very slow.
 Simeon Warner - 2014--2020
 """
 
-from flask import Flask, request, make_response, redirect, abort, send_file, url_for, send_from_directory
+from flask import Flask, request, make_response, redirect, abort, send_file, url_for, send_from_directory, g
 
 import base64
 import configargparse
+import copy
+from email.utils import formatdate, parsedate_tz, mktime_tz
+import hashlib
 import json
 import logging
 import os
@@ -25,9 +28,12 @@ except ImportError:  # pragma: no cover # python2
     from urllib import quote as urlquote
     from urllib2 import parse_keqv_list, parse_http_list
 
+from iiif.admission import request_cost
+from iiif.derivative_cache import derivative_key
 from iiif.error import IIIFError
 from iiif.request import IIIFRequest, IIIFRequestPathError, IIIFRequestBaseURI
 from iiif.info import IIIFInfo
+from iiif.manipulator import timer
 
 
 class Config(object):
@@ -74,9 +80,12 @@ def identifiers(config):
 
     Arguments:
         config - configuration object in which:
-            config.klass_name - 'gen' if a generator function
+            config.klass_name - 'gen' if a generator function, 'static'
+                for pregenerated static files
             config.generator_dir - directory for generator code
             config.image_dir - directory for images
+            config.static_fallback - True if images are also derived
+                from config.image_dir for 'static'
 
     Returns:
         ids - a list of ids
@@ -90,12 +99,17 @@ def identifiers(config):
             if (ext == '.py' and
                     os.path.isfile(os.path.join(config.generator_dir, generator))):
                 ids.append(gid)
-    else:
-        for image_file in os.listdir(config.image_dir):
-            (iid, ext) = os.path.splitext(image_file)
-            if (ext in ['.jpg', '.png', '.tif'] and
-                    os.path.isfile(os.path.join(config.image_dir, image_file))):
-                ids.append(iid)
+        return ids
+    if (config.klass_name == 'static'):
+        from iiif.manipulator_static import IIIFManipulatorStatic
+        ids = IIIFManipulatorStatic(**config.manipulator_args).identifiers()
+        if (not getattr(config, 'static_fallback', False)):
+            return ids
+    for image_file in os.listdir(config.image_dir):
+        (iid, ext) = os.path.splitext(image_file)
+        if (ext in ['.jpg', '.png', '.tif'] and iid not in ids and
+                os.path.isfile(os.path.join(config.image_dir, image_file))):
+            ids.append(iid)
     return ids
 
 
@@ -194,7 +208,20 @@ def osd_page_handler(config=None, identifier=None, prefix=None, **args):
 
 
 class IIIFHandler(object):
-    """IIIFHandler class."""
+    """IIIFHandler class.
+
+    The class attribute admission is a process-wide IIIFAdmission
+    object used to limit the total cost of image requests being
+    derived, or None for no limit. The class attribute timing_sink is
+    a process-wide callable, such as a bound method, that is called as
+    timing_sink(klass_name, timings) with the stage timings of each
+    image request, or None. The class attribute metrics is the
+    process-wide IIIFMetrics object if metrics are enabled, or None.
+    """
+
+    admission = None
+    timing_sink = None
+    metrics = None
 
     def __init__(self, prefix, identifier, config, klass, auth):
         """Initialize IIIFHandler setting key configurations.
@@ -214,11 +241,19 @@ class IIIFHandler(object):
         self.auth = auth
         self.degraded = False
         self.logger = logging.getLogger('IIIFHandler')
+        self.server_timing = getattr(config, 'server_timing', False)
+        self.timing = (self.server_timing or self.timing_sink is not None)
+        self.timings = []
+        self.source_dimensions = None
+        self.canonical = None
         #
         # Create objects to process request
         self.iiif = IIIFRequest(api_version=self.api_version,
                                 identifier=self.identifier)
-        self.manipulator = klass(api_version=self.api_version)
+        self.manipulator = klass(api_version=self.api_version,
+                                 in_memory=getattr(config, 'in_memory', False),
+                                 timing=self.timing,
+                                 **getattr(config, 'manipulator_args', {}))
         #
         # Set up auth object with locations if not already done
         if (self.auth and not self.auth.login_uri):
@@ -236,6 +271,11 @@ class IIIFHandler(object):
         """Server and prefix from config."""
         return(host_port_prefix(self.config.scheme, self.config.host, self.config.port, self.prefix))
 
+    @property
+    def request_headers(self):
+        """Headers of the current request."""
+        return request.headers
+
     @property
     def json_mime_type(self):
         """Return the MIME type for a JSON response.
@@ -245,14 +285,19 @@ class IIIFHandler(object):
         http://iiif.io/api/image/2.1/#information-request
         """
         mime_type = "application/json"
-        if (self.api_version >= '1.1' and 'Accept' in request.headers):
-            mime_type = do_conneg(request.headers['Accept'], [
+        if (self.api_version >= '1.1' and 'Accept' in self.request_headers):
+            mime_type = do_conneg(self.request_headers['Accept'], [
                                   'application/ld+json']) or mime_type
         return mime_type
 
     @property
     def file(self):
-        """Filename property for the source image for the current identifier."""
+        """Filename property for the source image for the current identifier.
+
+        For the static manipulator a source image is used only if there
+        is a fallback manipulator, otherwise the static_source() of the
+        manipulator.
+        """
         file = None
         if (self.config.klass_name == 'gen'):
             for ext in ['.py']:
@@ -260,12 +305,16 @@ class IIIFHandler(object):
                     self.config.generator_dir, self.identifier + ext)
                 if (os.path.isfile(file)):
                     return file
-        else:
+        elif (self.config.klass_name != 'static' or self.manipulator.fallback is not None):
             for ext in ['.jpg', '.png', '.tif']:
                 file = os.path.join(self.config.image_dir,
                                     self.identifier + ext)
                 if (os.path.isfile(file)):
                     return file
+        if (self.config.klass_name == 'static'):
+            file = self.manipulator.static_source(self.identifier)
+            if (file is not None):
+                return file
         # failed, show list of available identifiers as error
         available = "\n ".join(identifiers(self.config))
         raise IIIFError(code=404, parameter="identifier",
@@ -277,6 +326,36 @@ class IIIFHandler(object):
             self.headers['Link'] = '<' + \
                 self.manipulator.compliance_uri + '>;rel="profile"'
 
+    def stage(self, name, method, *args):
+        """Call method(*args) as stage name of request, return result.
+
+        If self.timing is set then (name, seconds) is appended to
+        self.timings, as for IIIFManipulator.stage().
+        """
+        if (not self.timing):
+            return method(*args)
+        start = timer()
+        try:
+            return method(*args)
+        finally:
+            self.timings.append((name, timer() - start))
+
+    def add_timing_header(self):
+        """Add Server-Timing header and pass timings to timing_sink.
+
+        The timings are those of the stages in this handler followed
+        by those of the manipulator, each given as a duration in
+        milliseconds.
+        """
+        if (not self.timing):
+            return
+        timings = self.timings + self.manipulator.timings
+        if (self.server_timing and len(timings) > 0):
+            self.headers['Server-Timing'] = ', '.join(
+                '%s;dur=%.3f' % (name, secs * 1000.0) for (name, secs) in timings)
+        if (self.timing_sink is not None):
+            self.timing_sink(self.config.klass_name, timings)
+
     def make_response(self, content, code=200, headers=None):
         """Wrapper around Flask.make_response which also adds any local headers."""
         if headers:
@@ -284,6 +363,87 @@ class IIIFHandler(object):
                 self.headers[header] = headers[header]
         return make_response(content, code, self.headers)
 
+    def add_cache_headers(self, file, *params):
+        """Add ETag, Last-Modified and Cache-Control headers for response.
+
+        The strong ETag is a hash of the path, modification time and
+        size of the source file along with the additional string
+        params that determine the response. Last-Modified is the
+        modification time of the source file. Cache-Control is added
+        only if a max-age is configured for this prefix.
+
+        Does not require the image to be opened so that a conditional
+        request can be answered with not_modified() before any decoding.
+        """
+        st = os.stat(file)
+        parts = [os.path.abspath(file), repr(st.st_mtime), str(st.st_size)]
+        parts.extend(params)
+        etag = hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+        self.headers['ETag'] = '"' + etag + '"'
+        self.headers['Last-Modified'] = formatdate(st.st_mtime, usegmt=True)
+        self.last_modified = int(st.st_mtime)
+        max_age = getattr(self.config, 'cache_max_age', None)
+        if (max_age is not None):
+            self.headers['Cache-Control'] = ('private, ' if self.auth else '') + \
+                'max-age=%d' % (max_age)
+
+    def not_modified(self):
+        """Return True if request conditions match the response headers set.
+
+        If-None-Match is checked against the ETag, or if not present
+        If-Modified-Since is checked against the Last-Modified time,
+        see add_cache_headers(). A True value means that a 304 Not
+        Modified response should be sent.
+        """
+        if ('ETag' not in self.headers):
+            return False
+        if ('If-None-Match' in self.request_headers):
+            for etag in self.request_headers['If-None-Match'].split(','):
+                etag = etag.strip()
+                if (etag.startswith('W/')):
+                    etag = etag[2:]
+                if (etag == '*' or etag == self.headers['ETag']):
+                    return True
+            return False
+        if ('If-Modified-Since' in self.request_headers):
+            date = parsedate_tz(self.request_headers['If-Modified-Since'])
+            if (date is not None and self.last_modified <= mktime_tz(date)):
+                return True
+        return False
+
+    def source_size(self):
+        """Get width and height of source image self.manipulator.srcfile.
+
+        Uses the image index if configured, else calls
+        image_dimensions() on the manipulator which reads only what is
+        needed to get the size. The size is then kept for further calls.
+        Sets and returns (width, height) of self.manipulator.
+        """
+        if (self.source_dimensions is None):
+            entry = None
+            image_index = getattr(self.config, 'image_index', None)
+            if (image_index is not None):
+                entry = image_index.get(self.identifier, self.manipulator.srcfile)
+            if (entry is not None):
+                self.source_dimensions = (entry['width'], entry['height'])
+            else:
+                self.source_dimensions = self.manipulator.image_dimensions()
+        (self.manipulator.width, self.manipulator.height) = self.source_dimensions
+        return self.source_dimensions
+
+    def canonical_url(self):
+        """Return url() of the canonical form of the parsed image request.
+
+        Equivalent requests have the same canonical form, see
+        IIIFRequest.canonicalize(), which needs the size of the source
+        image from source_size().
+        """
+        if (self.canonical is None):
+            canonical = copy.copy(self.iiif)
+            canonical.canonicalize(*self.source_size())
+            self.canonical = canonical.url()
+        return self.canonical
+
     def image_information_response(self):
         """Parse image information request and create response."""
         dr = degraded_request(self.identifier)
@@ -294,9 +454,25 @@ class IIIFHandler(object):
             self.identifier = dr
         else:
             self.logger.info("image_information: %s" % (self.identifier))
-        # get size
         self.manipulator.srcfile = self.file
-        self.manipulator.do_first()
+        self.add_cache_headers(self.manipulator.srcfile, 'info', self.api_version,
+                               self.server_and_prefix, self.iiif.identifier,
+                               self.json_mime_type)
+        if (self.not_modified()):
+            return self.make_response('', code=304)
+        if (self.config.klass_name == 'static'):
+            i = self.manipulator.static_info(self.identifier)
+            if (i is not None):
+                # pregenerated info.json, served with local id
+                i.server_and_prefix = self.server_and_prefix
+                i.identifier = self.iiif.identifier
+                if (self.auth):
+                    self.auth.add_services(i)
+                return self.make_response(i.as_json(),
+                                          headers={"Content-Type": self.json_mime_type})
+        # get size
+        self.source_size()
+        self.manipulator.cleanup()
         # most of info.json comes from config, a few things specific to image
         info = {'tile_height': self.config.tile_height,
                 'tile_width': self.config.tile_width,
@@ -326,13 +502,27 @@ class IIIFHandler(object):
 
     def image_request_response(self, path):
         """Parse image request and create response."""
+        response = self.image_request_prepare(path)
+        if (response is None):
+            response = self.image_request_derive()
+        return response
+
+    def image_request_prepare(self, path):
+        """Parse image request and check conditional request headers.
+
+        Does not decode the source image, only its size is needed for
+        the canonical form of the request in the ETag, see
+        canonical_url(). Returns a 304 Not Modified
+        response if appropriate, else None in which case the response
+        is created by image_request_derive().
+        """
         # Parse the request in path
         if (len(path) > 1024):
             raise IIIFError(code=414,
                             text="URI Too Long: Max 1024 chars, got %d\n" % len(path))
         try:
             self.iiif.identifier = self.identifier
-            self.iiif.parse_url(path)
+            self.stage('parse', self.iiif.parse_url, path)
         except IIIFRequestPathError as e:
             # Reraise as IIIFError with code=404 because we can't tell
             # whether there was an encoded slash in the identifier or
@@ -355,35 +545,159 @@ class IIIFHandler(object):
         else:
             # Parsed request OK, attempt to fulfill
             self.logger.info("image_request: %s" % (self.identifier))
-        file = self.file
+        file = self.stage('file', lambda: self.file)
         self.manipulator.srcfile = file
-        self.manipulator.do_first()
         if (self.api_version < '2.0' and
                 self.iiif.format is None and
-                'Accept' in request.headers):
+                'Accept' in self.request_headers):
             # In 1.0 and 1.1 conneg was specified as an alternative to format, see:
             # http://iiif.io/api/image/1.0/#format
             # http://iiif.io/api/image/1.1/#parameters-format
             formats = {'image/jpeg': 'jpg', 'image/tiff': 'tif',
                        'image/png': 'png', 'image/gif': 'gif',
                        'image/jp2': 'jps', 'application/pdf': 'pdf'}
-            accept = do_conneg(request.headers['Accept'], list(formats.keys()))
+            accept = do_conneg(self.request_headers['Accept'], list(formats.keys()))
             # Ignore Accept header if not recognized, should this be an error
             # instead?
             if (accept in formats):
                 self.iiif.format = formats[accept]
-        (outfile, mime_type) = self.manipulator.derive(file, self.iiif)
+        if (self.config.klass_name == 'static'):
+            # pregenerated files have no size without a fallback
+            # manipulator, they are named by the canonical form
+            url = self.iiif.url()
+        else:
+            url = self.canonical_url()
+        self.add_cache_headers(file, self.config.klass_name, self.api_version, url)
+        if (self.not_modified()):
+            self.add_compliance_header()
+            self.add_timing_header()
+            return self.make_response('', code=304)
+        return None
+
+    def image_request_derive(self):
+        """Derive image for request parsed by image_request_prepare() and create response.
+
+        If a derivative cache is configured then the image is served
+        from the cache if present. If single flight coalescing is
+        configured then concurrent requests for the same image share
+        one derivation. Derivations are subject to admission control if
+        self.admission is set, see derive_admitted().
+        """
+        file = self.manipulator.srcfile
+        derivative_cache = getattr(self.config, 'derivative_cache', None)
+        single_flight = getattr(self.config, 'single_flight', None)
+        cache_key = None
+        if (derivative_cache is not None or single_flight is not None):
+            # key on canonical form of request so that equivalent
+            # requests share the same cache entry and derivation
+            cache_key = derivative_key(file, self.config.klass_name,
+                                       self.api_version, self.canonical_url())
+        if (derivative_cache is not None):
+            cached = derivative_cache.get(cache_key)
+            if (cached is not None):
+                self.logger.debug("image_request: derivative cache hit")
+                (data, mime_type) = cached
+                self.manipulator.cleanup()
+                self.add_compliance_header()
+                self.add_timing_header()
+                return self.make_response(data, headers={'Content-Type': mime_type,
+                                                         'Content-Length': str(len(data))})
+        if (single_flight is not None):
+            # another process may have added to the cache while this
+            # one waited for the lock
+            recheck = (derivative_cache is not None and single_flight.locking)
+            (data, mime_type) = single_flight.do(
+                cache_key, lambda: self.derive_admitted(
+                    lambda: self.derive_data(cache_key, recheck)))
+            # followers and cache hits after waiting did not derive
+            self.manipulator.cleanup()
+        else:
+            (outfile, mime_type) = self.derive_admitted(
+                lambda: self.manipulator.derive(file, self.iiif))
+            if (self.manipulator.outbuf is None and derivative_cache is None):
+                self.add_compliance_header()
+                self.add_timing_header()
+                return self.file_response(outfile, mime_type)
+            data = self.derived_data(outfile, mime_type, cache_key)
+        self.add_compliance_header()
+        self.add_timing_header()
+        return self.make_response(data, headers={'Content-Type': mime_type,
+                                                 'Content-Length': str(len(data))})
+
+    def derive_admitted(self, fn):
+        """Return result of fn() to derive image, called once admitted.
+
+        If self.admission is set then the cost of the request is
+        estimated from the source image dimensions and fn is called
+        once the request is admitted. Raises IIIFError with code 503
+        if the request is not admitted, after cleaning up the
+        manipulator. The cost is estimated from the image index or
+        image header without decoding the image, see source_size().
+        Requests for the static manipulator are admitted only if the
+        image is derived by its fallback manipulator, pregenerated
+        files are served without admission.
+        """
+        if (self.admission is None):
+            return fn()
+        if (self.config.klass_name == 'static' and
+                not self.manipulator.uses_fallback(self.iiif)):
+            return fn()
+        try:
+            cost = request_cost(self.iiif, *self.source_size())
+            self.logger.debug("image_request: cost %.2f" % (cost))
+            charge = self.stage('admission', self.admission.acquire, cost)
+        except IIIFError:
+            self.manipulator.cleanup()
+            raise
+        try:
+            return fn()
+        finally:
+            self.admission.release(charge)
+
+    def derive_data(self, cache_key, recheck=False):
+        """Derive image for request and return (data, mime_type).
+
+        If recheck is True then first look in the derivative cache for
+        cache_key and return the cached image if present.
+        """
+        if (recheck):
+            cached = self.config.derivative_cache.get(cache_key)
+            if (cached is not None):
+                self.logger.debug("image_request: derivative cache hit after wait")
+                return cached
+        (outfile, mime_type) = self.manipulator.derive(self.manipulator.srcfile, self.iiif)
+        return (self.derived_data(outfile, mime_type, cache_key), mime_type)
+
+    def derived_data(self, outfile, mime_type, cache_key):
+        """Return data of derived image from buffer or outfile, added to any cache."""
+        if (self.manipulator.outbuf is not None):
+            data = self.manipulator.outbuf.getvalue()
+        else:
+            with open(outfile, 'rb') as fh:
+                data = fh.read()
+        self.manipulator.cleanup()
+        derivative_cache = getattr(self.config, 'derivative_cache', None)
+        if (derivative_cache is not None):
+            derivative_cache.put(cache_key, data, mime_type)
+        return data
+
+    def file_response(self, file, mime_type):
+        """Response to send file with mime_type."""
         # FIXME - find efficient way to serve file with headers
         # could this be the answer: https://stackoverflow.com/questions/31554680/how-to-send-header-in-flask-send-file
         # currently no headers are sent with the file
-        self.add_compliance_header()
-        return self.make_response(send_file(outfile, mimetype=mime_type))
+        return self.make_response(send_file(file, mimetype=mime_type))
 
     def error_response(self, e):
         """Make response for an IIIFError e.
 
-        Also add compliance header.
+        Also add compliance header. The validators and max-age from
+        add_cache_headers() apply only to successful responses so they
+        are removed and the error is marked not to be stored by caches.
         """
+        for header in ('ETag', 'Last-Modified'):
+            self.headers.pop(header, None)
+        self.headers['Cache-Control'] = 'no-store'
         self.add_compliance_header()
         return self.make_response(*e.image_server_response(self.api_version))
 
@@ -575,6 +889,29 @@ def split_comma_argument(comma_sep_str):
     return terms
 
 
+def max_age_for_prefix(max_age, prefix):
+    """Cache-Control max-age in seconds for prefix from a max-age setting.
+
+    The max_age setting is a comma separated list where each term
+    is either prefix=seconds for a specific prefix, or just seconds as
+    the default for all other prefixes, e.g. "3600" or
+    "2.1_pil=86400,600".
+
+    Returns None if there is no setting for prefix.
+    """
+    if (max_age is None):
+        return None
+    default = None
+    for term in split_comma_argument(str(max_age)):
+        if ('=' in term):
+            (term_prefix, seconds) = term.rsplit('=', 1)
+            if (term_prefix.strip('/') == prefix.strip('/')):
+                return int(seconds)
+        else:
+            default = int(term)
+    return default
+
+
 def add_shared_configs(p, base_dir=''):
     """Add configargparser/argparse configs for shared argument.
 
@@ -598,6 +935,20 @@ def add_shared_configs(p, base_dir=''):
           help="Image file directory")
     p.add('--generator-dir', default=os.path.join(base_dir, 'iiif/generators'),
           help="Generator directory for manipulator='gen'")
+    p.add('--generator-workers', type=int, default=0,
+          help="Number of worker processes used to generate images for "
+               "manipulator='gen' (default 0 to generate in the server "
+               "process)")
+    p.add('--static-dir', default=None,
+          help="Directory of files written by iiif_static.py to serve with "
+               "manipulator='static'")
+    p.add('--static-pack', default=None,
+          help="Pack file written by iiif_static.py --pack to serve with "
+               "manipulator='static', used instead of --static-dir")
+    p.add('--static-fallback', action='store_true',
+          help="Derive images that have not been pregenerated from the source "
+               "images in --image-dir with the pil manipulator for "
+               "manipulator='static' (default is 501 Not Implemented)")
     p.add('--tile-height', type=int, default=512,
           help="Tile height")
     p.add('--tile-width', type=int, default=512,
@@ -606,6 +957,51 @@ def add_shared_configs(p, base_dir=''):
           help="Name of file with Google auth client secret")
     p.add('--include-osd', action='store_true',
           help="Include a page with OpenSeadragon for each source")
+    p.add('--in-memory', action='store_true',
+          help="Derive images into memory buffers instead of temporary files "
+               "(pil and gen manipulators)")
+    p.add('--image-cache-size', type=int, default=0,
+          help="Size in MB of cache of decoded source images shared by "
+               "all handlers (pil manipulator, default 0 for no cache)")
+    p.add('--image-index-file', default=None,
+          help="JSON file for index of image dimensions used for image "
+               "information requests, updated from --image-dir at startup "
+               "(default none, not used for gen manipulator)")
+    p.add('--derivative-cache-dir', default=None,
+          help="Directory for disk cache of derived images (default none, "
+               "no cache)")
+    p.add('--derivative-cache-size', type=int, default=1024,
+          help="Size limit in MB for disk cache of derived images")
+    p.add('--coalesce-requests', action='store_true',
+          help="Coalesce concurrent requests for the same image so that the "
+               "image is derived once and shared")
+    p.add('--coalesce-lock', action='store_true',
+          help="With --coalesce-requests, also coalesce requests across server "
+               "processes using lock files in --derivative-cache-dir")
+    p.add('--admission-budget', type=float, default=0.0,
+          help="Limit on total estimated cost of image requests being derived "
+               "in each server process, in megapixels of decoded and encoded "
+               "image (default 0 for no limit)")
+    p.add('--admission-wait', type=float, default=10.0,
+          help="Maximum time in seconds that an image request waits for "
+               "admission before a 503 response with --admission-budget")
+    p.add('--server-timing', action='store_true',
+          help="Add Server-Timing header with the time taken by each stage "
+               "of image requests")
+    p.add('--metrics', action='store_true',
+          help="Provide Prometheus metrics at /metrics")
+    p.add('--metrics-dir', default=None,
+          help="Directory shared by server processes to aggregate --metrics "
+               "over processes (default none, metrics for each process)")
+    p.add('--max-age', default=None,
+          help="Cache-Control max-age in seconds for responses, either a "
+               "number for all prefixes or a comma separated list of "
+               "prefix=seconds and an optional default number")
+    p.add('--asgi', action='store_true',
+          help="Serve with the asyncio server in iiif.asgi instead of Flask, "
+               "handlers with auth are not supported (Python 3 only)")
+    p.add('--asgi-workers', type=int, default=4,
+          help="Number of threads used to read and derive images with --asgi")
     p.add('--access-cookie-lifetime', type=int, default=3600,
           help="Set access cookie lifetime for authenticated access in seconds")
     p.add('--access-token-lifetime', type=int, default=10,
@@ -620,26 +1016,18 @@ def add_shared_configs(p, base_dir=''):
           help="Minimal output only")
 
 
-def add_handler(app, config):
-    """Add a single handler to the app.
-
-    Adds one IIIF Image API handler to app, with config from config.
+def setup_handler(config):
+    """Set up auth, manipulator class and caches for a single handler.
 
     Arguments:
-        app - Flask app
-        config - Configuration object in which:
-            config.prefix - String path prefix for this handler
-            config.client_prefix - String path prefix seen by client (which may be different
-                because of reverse proxy or such
-            config.klass_name - Manipulator class, e.g. 'pil'
-            config.api_version - e.g. '2.1'
-            config.include_osd - True or False to include OSD
-            config.gauth_client_secret_file - filename if auth_type='gauth'
-            config.access_cookie_lifetime - number of seconds
-            config.access_token_lifetime - number of seconds
-            config.auth_type - Auth type string or 'none'
+        config - Configuration object as for add_handler()
 
-    Returns True on success, nothing otherwise.
+    Settings for the manipulator, such as the static files for static,
+    are put in config.manipulator_args as keyword arguments for creating
+    each manipulator instance so that each handler has its own.
+
+    Returns (klass, auth) on success where klass is the IIIFManipulator
+    sub-class and auth is the IIIFAuth object or None, nothing otherwise.
     """
     auth = None
     if (config.auth_type is None or config.auth_type == 'none'):
@@ -669,6 +1057,10 @@ def add_handler(app, config):
     if (config.klass_name == 'pil'):
         from iiif.manipulator_pil import IIIFManipulatorPIL
         klass = IIIFManipulatorPIL
+        cache_size = getattr(config, 'image_cache_size', 0)
+        if (cache_size and klass.image_cache is None):
+            from iiif.image_cache import IIIFImageCache
+            klass.image_cache = IIIFImageCache(max_bytes=cache_size * 1024 * 1024)
     elif (config.klass_name == 'netpbm'):
         from iiif.manipulator_netpbm import IIIFManipulatorNetpbm
         klass = IIIFManipulatorNetpbm
@@ -678,9 +1070,199 @@ def add_handler(app, config):
     elif (config.klass_name == 'gen'):
         from iiif.manipulator_gen import IIIFManipulatorGen
         klass = IIIFManipulatorGen
+        config.manipulator_args = {'workers': getattr(config, 'generator_workers', 0)}
+    elif (config.klass_name == 'static'):
+        from iiif.manipulator_static import IIIFManipulatorStatic
+        klass = IIIFManipulatorStatic
+        static_dir = getattr(config, 'static_dir', None)
+        pack_file = getattr(config, 'static_pack', None)
+        if (not static_dir and not pack_file):
+            logging.error("No static directory or pack for static manipulator, ignoring")
+            return
+        static_pack = None
+        if (pack_file):
+            from iiif.static_pack import IIIFStaticPackReader
+            static_pack = IIIFStaticPackReader(pack_file)
+        fallback_klass = None
+        if (getattr(config, 'static_fallback', False)):
+            from iiif.manipulator_pil import IIIFManipulatorPIL
+            fallback_klass = IIIFManipulatorPIL
+        config.manipulator_args = {'static_dir': static_dir,
+                                   'static_pack': static_pack,
+                                   'fallback_klass': fallback_klass}
     else:
         logging.error("Unknown manipulator type %s, ignoring" % (config.klass_name))
         return
+    index_file = getattr(config, 'image_index_file', None)
+    if (index_file and config.klass_name != 'gen'):
+        from iiif.image_index import IIIFImageIndex, normpath
+        # one index object for each file shared by all handlers, built
+        # once for each image directory
+        config.image_index = IIIFImageIndex.shared(index_file)
+        if (normpath(config.image_dir) not in config.image_index.built_dirs):
+            n = config.image_index.build(config.image_dir)
+            logging.warning("Image index %s has %d images" % (index_file, n))
+    config.cache_max_age = max_age_for_prefix(getattr(config, 'max_age', None),
+                                              config.prefix)
+    cache_dir = getattr(config, 'derivative_cache_dir', None)
+    if (cache_dir and config.klass_name != 'static'):
+        # static files are served directly and need no cache
+        from iiif.derivative_cache import IIIFDerivativeCache
+        config.derivative_cache = IIIFDerivativeCache(
+            cache_dir, max_bytes=config.derivative_cache_size * 1024 * 1024)
+    if (getattr(config, 'coalesce_requests', False) and config.klass_name != 'static'):
+        from iiif.single_flight import IIIFSingleFlight
+        lock_dir = None
+        if (getattr(config, 'coalesce_lock', False) and
+                getattr(config, 'derivative_cache', None) is not None):
+            lock_dir = os.path.join(cache_dir, 'locks')
+        config.single_flight = IIIFSingleFlight(lock_dir=lock_dir)
+    budget = getattr(config, 'admission_budget', 0)
+    if (budget and IIIFHandler.admission is None):
+        from iiif.admission import IIIFAdmission
+        IIIFHandler.admission = IIIFAdmission(
+            budget, max_wait=getattr(config, 'admission_wait', 10.0))
+    if (getattr(config, 'metrics', False)):
+        setup_metrics(config, klass)
+    return (klass, auth)
+
+
+# Process-wide objects (image cache, admission control) that have a
+# collector in IIIFHandler.metrics, so that it is added only once
+_metrics_collected = []
+
+
+def setup_metrics(config, klass):
+    """Set up process-wide metrics and add collectors for handler with config.
+
+    Creates IIIFMetrics object IIIFHandler.metrics if not already done,
+    using config.metrics_dir for multiprocess aggregation, and sets it
+    to receive the stage timings of image requests. Adds collectors for
+    the statistics of the derivative cache and request coalescing of
+    the handler, and for the process-wide image cache and admission
+    control if not already added by another handler.
+    """
+    from iiif.metrics import IIIFMetrics
+    if (IIIFHandler.metrics is None):
+        IIIFHandler.metrics = IIIFMetrics(getattr(config, 'metrics_dir', None))
+        IIIFHandler.timing_sink = IIIFHandler.metrics.observe_stages
+        del _metrics_collected[:]
+    metrics = IIIFHandler.metrics
+    prefix = getattr(config, 'client_prefix', config.prefix)
+    derivative_cache = getattr(config, 'derivative_cache', None)
+    if (derivative_cache is not None):
+        metrics.add_collector(lambda: [
+            ('iiif_derivative_cache_events_total', {'prefix': prefix, 'event': event}, value)
+            for (event, value) in derivative_cache.stats().items() if event != 'bytes'])
+    single_flight = getattr(config, 'single_flight', None)
+    if (single_flight is not None):
+        metrics.add_collector(lambda: [
+            ('iiif_coalesced_requests_total', {'prefix': prefix, 'role': role}, value)
+            for (role, value) in single_flight.stats().items() if role != 'in_flight'])
+    image_cache = getattr(klass, 'image_cache', None)
+    if (image_cache is not None and
+            not any(obj is image_cache for obj in _metrics_collected)):
+        _metrics_collected.append(image_cache)
+        metrics.add_collector(lambda: [
+            ('iiif_image_cache_events_total', {'event': 'hits'}, image_cache.hits),
+            ('iiif_image_cache_events_total', {'event': 'misses'}, image_cache.misses)])
+    admission = IIIFHandler.admission
+    if (admission is not None and
+            not any(obj is admission for obj in _metrics_collected)):
+        _metrics_collected.append(admission)
+        metrics.add_collector(lambda: [
+            ('iiif_admission_events_total', {'event': event}, value)
+            for (event, value) in admission.stats().items() if event != 'in_use'])
+
+
+def metrics_handler():
+    """Handle /metrics request, response in Prometheus text format."""
+    from iiif.metrics import CONTENT_TYPE
+    return make_response(IIIFHandler.metrics.render(), 200,
+                         {'Content-Type': CONTENT_TYPE})
+
+
+# Endpoints of requests included in metrics, and their request types
+METRICS_ENDPOINTS = {'iiif_info_handler': 'info', 'iiif_image_handler': 'image'}
+
+
+def metrics_before_request():
+    """Record start of info or image request in metrics."""
+    if (request.endpoint in METRICS_ENDPOINTS and request.view_args):
+        g.metrics_start = (request.view_args['prefix'],
+                           METRICS_ENDPOINTS[request.endpoint], timer())
+        IIIFHandler.metrics.request_started(g.metrics_start[0])
+
+
+def metrics_after_request(response):
+    """Record end of info or image request with response in metrics."""
+    start = g.pop('metrics_start', None)
+    if (start is not None):
+        (prefix, request_type, t) = start
+        IIIFHandler.metrics.request_finished(prefix, request_type, response.status_code,
+                                             response.content_length or 0, timer() - t)
+    return response
+
+
+def metrics_teardown_request(exc=None):
+    """Record end of info or image request without response as error."""
+    start = g.pop('metrics_start', None)
+    if (start is not None):
+        (prefix, request_type, t) = start
+        IIIFHandler.metrics.request_finished(prefix, request_type, 500, 0, timer() - t)
+
+
+def add_handler(app, config):
+    """Add a single handler to the app.
+
+    Adds one IIIF Image API handler to app, with config from config.
+
+    Arguments:
+        app - Flask app
+        config - Configuration object in which:
+            config.prefix - String path prefix for this handler
+            config.client_prefix - String path prefix seen by client (which may be different
+                because of reverse proxy or such
+            config.klass_name - Manipulator class, e.g. 'pil'
+            config.api_version - e.g. '2.1'
+            config.include_osd - True or False to include OSD
+            config.gauth_client_secret_file - filename if auth_type='gauth'
+            config.access_cookie_lifetime - number of seconds
+            config.access_token_lifetime - number of seconds
+            config.auth_type - Auth type string or 'none'
+            config.image_index_file - JSON image index file or None
+            config.derivative_cache_dir - derivative cache directory or None
+            config.derivative_cache_size - derivative cache size limit in MB
+            config.coalesce_requests - True to coalesce concurrent identical
+                image requests
+            config.coalesce_lock - True to also coalesce across processes
+                with lock files in derivative_cache_dir
+            config.admission_budget - limit on total cost of image requests
+                being derived in this process, 0 for no limit
+            config.admission_wait - seconds to wait for admission
+            config.server_timing - True to add Server-Timing header to
+                image responses
+            config.metrics - True to provide metrics at /metrics
+            config.metrics_dir - directory to aggregate metrics over
+                processes or None
+            config.max_age - Cache-Control max-age setting, see max_age_for_prefix()
+            config.generator_workers - number of worker processes for gen
+            config.static_dir - directory of static files for static
+            config.static_pack - pack file of static files for static
+            config.static_fallback - True to use pil manipulator for
+                requests without a static file for static
+
+    Returns True on success, nothing otherwise.
+    """
+    setup = setup_handler(config)
+    if (setup is None):
+        return
+    (klass, auth) = setup
+    if (IIIFHandler.metrics is not None and 'metrics_handler' not in app.view_functions):
+        app.add_url_rule('/metrics', 'metrics_handler', metrics_handler)
+        app.before_request(metrics_before_request)
+        app.after_request(metrics_after_request)
+        app.teardown_request(metrics_teardown_request)
     base = urljoin('/', config.prefix + '/')  # ensure has trailing slash
     client_base = urljoin('/', config.client_prefix + '/')  # ensure has trailing slash
     logging.warning("Installing %s IIIFManipulator at %s v%s %s" %
@@ -5,6 +5,15 @@ square also a repeat, and so on. Each sucessive level is colored
 more and more red
 """
 
+from bisect import bisect_left
+
+from PIL import Image, ImageDraw
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 
 def _num(x, y):
     """PRIVATE function to return cell number in 3x3 square, 1..9."""
@@ -53,3 +62,82 @@ class PixelGen(object):
             return (red, 0, 0)
         else:
             return None
+
+    def pixels(self, ix, iy):
+        """Return colors for arrays of pixel coordinates.
+
+        Vectorized equivalent of pixel() using numpy: ix and iy are
+        integer arrays of the same shape, returns a uint8 array of
+        that shape plus a last dimension of 3 RGB values. Pixels for
+        which pixel() would return None are the background color.
+        """
+        rgb = np.empty(ix.shape + (3,), dtype=np.uint8)
+        rgb[...] = self.background_color
+        (x, y) = (ix, iy)
+        active = np.ones(ix.shape, dtype=bool)
+        size = self.sz
+        red = 0
+        while (size > 3):
+            divisor = size // 3
+            n = _num(x // divisor, y // divisor)
+            on = active & (n != 5) & (n % 2 == 1)
+            rgb[on] = (red, 0, 0)
+            active &= (n == 5)
+            if (not active.any()):
+                return rgb
+            (x, y) = (x % divisor, y % divisor)
+            size = divisor
+            red = min(red + 25, 255)
+        on = active & (_num(x, y) % 2 == 1)
+        rgb[on] = (red, 0, 0)
+        return rgb
+
+    def render(self, xs, ys):
+        """Render image for the grid of pixels with columns xs and rows ys.
+
+        Walks the 3x3 subdivision once for the whole grid, see
+        render_cell(), so that each solid cell is filled with a single
+        rectangle. The result is the same as calling pixel() for each
+        output pixel.
+
+        Returns a PIL Image.
+        """
+        xs = [int(x) for x in xs]
+        ys = [int(y) for y in ys]
+        image = Image.new('RGB', (len(xs), len(ys)), self.background_color)
+        self.render_cell(image, ImageDraw.Draw(image), xs, ys, 0, 0, self.sz, 0)
+        return image
+
+    def render_cell(self, image, draw, xs, ys, x0, y0, size, red):
+        """Render output pixels in cell of given size at x0, y0.
+
+        The output pixels are those with columns xs and rows ys (both
+        in increasing order) that fall in the cell. If the cell is
+        covered by a few output pixels or less in either direction
+        then pixel() is called for each, otherwise solid sub-cells
+        are filled and the middle sub-cell rendered recursively.
+        """
+        (i0, i1) = (bisect_left(xs, x0), bisect_left(xs, x0 + size))
+        (j0, j1) = (bisect_left(ys, y0), bisect_left(ys, y0 + size))
+        if (i0 == i1 or j0 == j1):
+            return
+        if (size <= 3 or i1 - i0 < 3 or j1 - j0 < 3):
+            for j in range(j0, j1):
+                for i in range(i0, i1):
+                    color = self.pixel(xs[i] - x0, ys[j] - y0, size, red)
+                    if (color is not None):
+                        image.putpixel((i, j), color)
+            return
+        divisor = size // 3
+        for b in range(0, 3):
+            for a in range(0, 3):
+                n = _num(a, b)
+                (cx, cy) = (x0 + a * divisor, y0 + b * divisor)
+                if (n == 5):
+                    self.render_cell(image, draw, xs, ys, cx, cy,
+                                     divisor, min(red + 25, 255))
+                elif (n % 2):
+                    (ci0, ci1) = (bisect_left(xs, cx), bisect_left(xs, cx + divisor))
+                    (cj0, cj1) = (bisect_left(ys, cy), bisect_left(ys, cy + divisor))
+                    if (ci0 < ci1 and cj0 < cj1):
+                        draw.rectangle([ci0, cj0, ci1 - 1, cj1 - 1], fill=(red, 0, 0))
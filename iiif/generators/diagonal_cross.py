@@ -1,5 +1,10 @@
 """Image generator for fractal diagonal cross."""
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 
 def _not_diagonal(x, y):
     """PRIVATE function to return element in 3x3 square is diagonal.
@@ -40,3 +45,26 @@ class PixelGen(object):
         if (_not_diagonal(x // divisor, y // divisor)):
             return None
         return self.pixel(x % divisor, y % divisor, divisor)
+
+    def pixels(self, ix, iy):
+        """Return colors for arrays of pixel coordinates.
+
+        Vectorized equivalent of pixel() using numpy: ix and iy are
+        integer arrays of the same shape, returns a uint8 array of
+        that shape plus a last dimension of 3 RGB values. Pixels for
+        which pixel() would return None are the background color.
+        """
+        rgb = np.empty(ix.shape + (3,), dtype=np.uint8)
+        rgb[...] = self.background_color
+        (x, y) = (ix, iy)
+        active = np.ones(ix.shape, dtype=bool)
+        size = self.sz
+        while (size > 3):
+            divisor = size // 3
+            active &= (_not_diagonal(x // divisor, y // divisor) == 0)
+            if (not active.any()):
+                return rgb
+            (x, y) = (x % divisor, y % divisor)
+            size = divisor
+        rgb[active & (_not_diagonal(x, y) == 0)] = (0, 0, 0)
+        return rgb
@@ -5,6 +5,13 @@ Ref: <http://www.karlsims.com/julia.html>
 
 import cmath
 
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 
 class PixelGen(object):
     """Pixel generation classfor Mandlebrot set."""
@@ -21,6 +28,8 @@ class PixelGen(object):
         self.shade_factor = int(255 / (self.max_iter + 1))
         # Default constanc
         self.c = complex(0, 0)
+        # Size in pixels below which render() doesn't trace boundaries
+        self.min_trace = 32
 
     @property
     def size(self):
@@ -52,15 +61,46 @@ class PixelGen(object):
             red = 255
         return (red, 50, 100)
 
+    def in_main_bulbs(self, z):
+        """Return True if z is in the main cardioid or period-2 bulb.
+
+        Points in these regions are in the Mandlebrot set so will
+        never escape. The test is valid only when the iteration
+        constant c is equal to z, which is always the case for the
+        Mandlebrot set, and also for a Julia set point z=c because
+        that is on the orbit of 0.
+        """
+        x = z.real - 0.25
+        q = x * x + z.imag * z.imag
+        return (q * (q + x) <= 0.25 * z.imag * z.imag or
+                (z.real + 1.0) ** 2 + z.imag * z.imag <= 0.0625)
+
     def mpixel(self, z, n=0):
-        """Iteration in Mandlebrot coordinate z."""
-        z = z * z + self.c
-        if (abs(z) > 2.0):
-            return self.color(n)
-        n += 1
-        if (n > self.max_iter):
+        """Iteration in Mandlebrot coordinate z.
+
+        Iterates z = z * z + self.c until abs(z) > 2, giving
+        self.color(n) after n iterations, or until more than
+        self.max_iter iterations have been done, giving None. A point
+        that is in the main cardioid or period-2 bulb, or whose orbit
+        returns exactly to an earlier value (checked against values
+        saved at powers of 2 iterations) will never escape so None
+        is returned early.
+        """
+        c = self.c
+        if (n == 0 and z == c and self.in_main_bulbs(z)):
             return None
-        return self.mpixel(z, n)
+        saved = z
+        while True:
+            z = z * z + c
+            if (abs(z) > 2.0):
+                return self.color(n)
+            n += 1
+            if (n > self.max_iter):
+                return None
+            if (z == saved):
+                return None
+            if (n & (n - 1) == 0):
+                saved = z
 
     def pixel(self, ix, iy):
         """Return color for a pixel.
@@ -74,3 +114,140 @@ class PixelGen(object):
         z = complex(x, y)
         self.set_c(z)
         return self.mpixel(z)
+
+    def escapes(self, ix, iy):
+        """Return number of iterations to escape for arrays of pixel coordinates.
+
+        Vectorized equivalent of mpixel() using numpy: ix and iy are
+        integer arrays of the same shape, returns an integer array of
+        that shape with the n for which mpixel() would return
+        self.color(n), or -1 where it would return None. All points
+        are iterated together, points are dropped from further
+        iterations when they escape, are in the main cardioid or
+        period-2 bulb, or their orbit repeats.
+        """
+        x = (ix - self.xoffset + 0.5) / self.scale
+        y = (iy - self.yoffset + 0.5) / self.scale
+        z = (x + 1j * y).ravel()
+        self.set_c(z)
+        c = np.broadcast_to(self.c, z.shape)
+        escaped = np.full(z.shape, -1, dtype=np.int64)
+        # see in_main_bulbs()
+        xq = z.real - 0.25
+        q = xq * xq + z.imag * z.imag
+        bulbs = (c == z) & ((q * (q + xq) <= 0.25 * z.imag * z.imag) |
+                            ((z.real + 1.0) ** 2 + z.imag * z.imag <= 0.0625))
+        keep = ~bulbs
+        points = np.arange(z.size)[keep]
+        (z, c) = (z[keep], c[keep])
+        saved = z
+        for n in range(self.max_iter + 1):
+            z = z * z + c
+            esc = np.abs(z) > 2.0
+            escaped[points[esc]] = n
+            keep = ~esc & (z != saved)
+            (points, z, c, saved) = (points[keep], z[keep], c[keep], saved[keep])
+            if (points.size == 0):
+                break
+            if ((n + 1) & n == 0):
+                saved = z
+        return escaped.reshape(ix.shape)
+
+    def colors(self, escaped):
+        """Return RGB uint8 array for array of escape iterations.
+
+        Colors are as from self.color(n) for points that escaped after
+        n iterations and the background color for -1.
+        """
+        rgb = np.empty(escaped.shape + (3,), dtype=np.uint8)
+        rgb[...] = self.background_color
+        out = (escaped >= 0)
+        rgb[out, 0] = np.minimum(escaped[out] * self.shade_factor, 255)
+        rgb[out, 1] = 50
+        rgb[out, 2] = 100
+        return rgb
+
+    def pixels(self, ix, iy):
+        """Return colors for arrays of pixel coordinates.
+
+        Vectorized equivalent of pixel() using numpy: ix and iy are
+        integer arrays of the same shape, returns a uint8 array of
+        that shape plus a last dimension of 3 RGB values. Pixels for
+        which pixel() would return None are the background color.
+        """
+        return self.colors(self.escapes(ix, iy))
+
+    def render(self, xs, ys):
+        """Render image for the grid of pixels with columns xs and rows ys.
+
+        Uses rectangle boundary tracing (Mariani-Silver): the number of
+        iterations to escape is calculated for the boundary of a
+        rectangle of the output image and if that is the same all
+        round then the rectangle is filled without calculating the
+        interior, otherwise the rectangle is split in two and each
+        part considered in turn. Rectangles of no more than
+        self.min_trace pixels across are calculated in full.
+
+        This relies on the set being connected and without holes, when
+        a rectangle with a uniform boundary can only enclose points
+        with a different number of iterations if it encloses the
+        whole set. Rectangles containing the origin, which is in the
+        set, are thus not filled unless they are inside the set. For
+        a Julia set that is not connected (the orbit of 0 escapes)
+        there is no boundary tracing. The result is the same as
+        pixels() except possibly for features smaller than the
+        output pixel spacing.
+
+        Returns a PIL Image, or None if numpy is not available.
+        """
+        if (np is None):
+            return None
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        (w, h) = (len(xs), len(ys))
+        self.set_c(complex(0, 0))
+        if (self.mpixel(complex(0, 0)) is not None):
+            (iy, ix) = np.meshgrid(ys, xs, indexing='ij')
+            return Image.fromarray(self.pixels(ix, iy))
+        # image coordinates of the origin
+        (ox, oy) = (self.xoffset - 0.5, self.yoffset - 0.5)
+        escaped = np.full((h, w), -2, dtype=np.int64)
+
+        # Rectangles are considered a level of subdivision at a time so
+        # that all the pixels needed are calculated in one call
+        rects = [(0, 0, w, h)]
+        while (rects):
+            (rows, cols, bounds) = ([], [], [])
+            for (x0, y0, x1, y1) in rects:
+                if (x1 - x0 <= self.min_trace or y1 - y0 <= self.min_trace):
+                    (r, c) = np.mgrid[y0:y1, x0:x1]
+                    rows.append(r.ravel())
+                    cols.append(c.ravel())
+                    continue
+                across = np.arange(x0, x1)
+                down = np.arange(y0 + 1, y1 - 1)
+                rows.extend((np.full(x1 - x0, y0), np.full(x1 - x0, y1 - 1),
+                             down, down))
+                cols.extend((across, across, np.full(len(down), x0),
+                             np.full(len(down), x1 - 1)))
+                bounds.append((x0, y0, x1, y1))
+            (rows, cols) = (np.concatenate(rows), np.concatenate(cols))
+            todo = (escaped[rows, cols] == -2)
+            (rows, cols) = (rows[todo], cols[todo])
+            escaped[rows, cols] = self.escapes(xs[cols], ys[rows])
+            rects = []
+            for (x0, y0, x1, y1) in bounds:
+                boundary = np.concatenate((escaped[y0, x0:x1], escaped[y1 - 1, x0:x1],
+                                           escaped[y0:y1, x0], escaped[y0:y1, x1 - 1]))
+                n = boundary[0]
+                if ((boundary == n).all() and
+                        (n == -1 or not (xs[x0] <= ox <= xs[x1 - 1] and
+                                         ys[y0] <= oy <= ys[y1 - 1]))):
+                    escaped[y0 + 1:y1 - 1, x0 + 1:x1 - 1] = n
+                elif (x1 - x0 >= y1 - y0):
+                    mid = (x0 + x1) // 2
+                    rects.extend([(x0, y0, mid + 1, y1), (mid, y0, x1, y1)])
+                else:
+                    mid = (y0 + y1) // 2
+                    rects.extend([(x0, y0, x1, mid + 1), (x0, mid, x1, y1)])
+        return Image.fromarray(self.colors(escaped))
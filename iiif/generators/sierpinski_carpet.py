@@ -3,6 +3,15 @@
 See for example <https://en.wikipedia.org/wiki/Sierpinski_carpet>
 """
 
+from bisect import bisect_left
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 
 def _middle(x, y):
     """PRIVATE function to return True is x==1 and y==1.
@@ -17,8 +26,9 @@ class PixelGen(object):
     """Pixel generation class."""
 
     def __init__(self):
-        """Set size."""
+        """Set size and minimum block size for render()."""
         self.sz = 3**8
+        self.min_block = 128
 
     @property
     def size(self):
@@ -44,3 +54,84 @@ class PixelGen(object):
         if (_middle(x // divisor, y // divisor)):
             return None
         return self.pixel(x % divisor, y % divisor, divisor)
+
+    def pixels(self, ix, iy):
+        """Return colors for arrays of pixel coordinates.
+
+        Vectorized equivalent of pixel() using numpy: ix and iy are
+        integer arrays of the same shape, returns a uint8 array of
+        that shape plus a last dimension of 3 RGB values. Pixels for
+        which pixel() would return None are the background color.
+        """
+        rgb = np.empty(ix.shape + (3,), dtype=np.uint8)
+        rgb[...] = self.background_color
+        (x, y) = (ix, iy)
+        active = np.ones(ix.shape, dtype=bool)
+        size = self.sz
+        while (size > 3):
+            divisor = size // 3
+            active &= ~((x // divisor == 1) & (y // divisor == 1))
+            if (not active.any()):
+                return rgb
+            (x, y) = (x % divisor, y % divisor)
+            size = divisor
+        rgb[active & ~((x == 1) & (y == 1))] = (0, 0, 0)
+        return rgb
+
+    def render(self, xs, ys):
+        """Render image for the grid of pixels with columns xs and rows ys.
+
+        Walks the 3x3 subdivision once for the whole grid, see
+        render_cell(), so that output pixels in the empty middle square
+        of each cell are skipped together. The remaining blocks of output
+        pixels are calculated with pixels() if numpy is available, else
+        by calling pixel() for each. The result is the same as calling
+        pixel() for each output pixel.
+
+        Returns a PIL Image.
+        """
+        xs = [int(x) for x in xs]
+        ys = [int(y) for y in ys]
+        blocks = []
+        min_block = self.min_block if np is not None else 3
+        self.render_cell(blocks, xs, ys, 0, 0, self.sz, min_block)
+        if (np is None):
+            image = Image.new('RGB', (len(xs), len(ys)), self.background_color)
+            for (i0, i1, j0, j1) in blocks:
+                for j in range(j0, j1):
+                    for i in range(i0, i1):
+                        color = self.pixel(xs[i], ys[j])
+                        if (color is not None):
+                            image.putpixel((i, j), color)
+            return image
+        rgb = np.empty((len(ys), len(xs), 3), dtype=np.uint8)
+        rgb[...] = self.background_color
+        (xa, ya) = (np.array(xs, dtype=np.int64), np.array(ys, dtype=np.int64))
+        for (i0, i1, j0, j1) in blocks:
+            (iy, ix) = np.meshgrid(ya[j0:j1], xa[i0:i1], indexing='ij')
+            rgb[j0:j1, i0:i1] = self.pixels(ix, iy)
+        return Image.fromarray(rgb)
+
+    def render_cell(self, blocks, xs, ys, x0, y0, size, min_block):
+        """Find blocks of output pixels in cell of given size at x0, y0.
+
+        The output pixels are those with columns xs and rows ys (both
+        in increasing order) that fall in the cell. If the cell is
+        covered by fewer than min_block output pixels in either
+        direction then the ranges of output columns and rows
+        (i0, i1, j0, j1) are added to blocks, otherwise all sub-cells
+        except the empty middle are considered recursively.
+        """
+        (i0, i1) = (bisect_left(xs, x0), bisect_left(xs, x0 + size))
+        (j0, j1) = (bisect_left(ys, y0), bisect_left(ys, y0 + size))
+        if (i0 == i1 or j0 == j1):
+            return
+        if (size <= 3 or i1 - i0 < min_block or j1 - j0 < min_block):
+            blocks.append((i0, i1, j0, j1))
+            return
+        divisor = size // 3
+        for b in range(0, 3):
+            for a in range(0, 3):
+                if (not _middle(a, b)):
+                    self.render_cell(blocks, xs, ys, x0 + a * divisor,
+                                     y0 + b * divisor, divisor, min_block)
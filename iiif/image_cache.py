@@ -0,0 +1,109 @@
+"""Cache of decoded source images for the PIL manipulator.
+
+A single cache is intended to be shared by all the manipulator
+instances in a process so that a sequence of requests for tiles
+of the same image, as made by a zooming viewer, need open and
+decode the source image only once. Entries are keyed by the source
+file path, modification time and size, plus the scale of any reduced
+resolution decode. The cache has a limit on the total size of the
+images held and evicts the least recently used images to stay within
+it. Access is protected by a lock so that the cache may be used from
+a multi-threaded server.
+"""
+
+from collections import OrderedDict
+import os
+import os.path
+import threading
+
+
+def image_bytes(image):
+    """Approximate size in bytes of decoded PIL image.
+
+    PIL stores images with 1 byte per pixel for single band
+    8-bit modes, 2 bytes for I;16 modes, and 4 bytes per pixel
+    for most other modes (including RGB).
+    """
+    (width, height) = image.size
+    if (image.mode in ('1', 'L', 'P')):
+        bpp = 1
+    elif (image.mode.startswith('I;16')):
+        bpp = 2
+    else:
+        bpp = 4
+    return width * height * bpp
+
+
+class IIIFImageCache(object):
+    """LRU cache of decoded images with a limit on total size."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """Initialize IIIFImageCache object.
+
+        Keyword arguments:
+        max_bytes -- limit on the total size of images held (default 256MB)
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, srcfile, scale=1):
+        """Cache key for srcfile decoded at 1/scale resolution.
+
+        Includes the modification time and size of srcfile so that
+        a changed file will not match old entries. Will raise an
+        OSError if srcfile does not exist.
+        """
+        st = os.stat(srcfile)
+        return (os.path.abspath(srcfile), st.st_mtime, st.st_size, scale)
+
+    def get(self, key):
+        """Return image for key and mark it as most recently used.
+
+        Returns None if there is no image for key in the cache.
+        """
+        with self._lock:
+            image = self._images.pop(key, None)
+            if (image is None):
+                self.misses += 1
+                return None
+            self._images[key] = image
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        """Add decoded image to the cache under key.
+
+        Will evict least recently used images to keep within
+        self.max_bytes. An image larger than self.max_bytes will
+        not be cached. The image must already have been loaded (with
+        image.load()) and must not be modified after being added.
+
+        Returns True if the image was added, False otherwise.
+        """
+        size = image_bytes(image)
+        if (size > self.max_bytes):
+            return False
+        with self._lock:
+            old = self._images.pop(key, None)
+            if (old is not None):
+                self.bytes -= image_bytes(old)
+            self._images[key] = image
+            self.bytes += size
+            while (self.bytes > self.max_bytes):
+                (old_key, old) = self._images.popitem(last=False)
+                self.bytes -= image_bytes(old)
+        return True
+
+    def clear(self):
+        """Remove all images from the cache."""
+        with self._lock:
+            self._images.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        """Return number of images in the cache."""
+        return len(self._images)
@@ -0,0 +1,243 @@
+"""Index of source image dimensions and metadata.
+
+Image information requests need only the width and height of the
+source image but getting these via a manipulator's do_first() may
+require reading or converting the whole image. The index records, for
+each identifier, the path, modification time, width, height, mode and
+format of the source image so that these can be looked up instead.
+Entries are read from the image file headers with PIL and are checked
+against the modification time of the file on each lookup so that a
+changed image is re-read.
+
+The index is stored on disk as a JSON file which is written atomically
+so that it may be shared by several processes. Within a process one
+index object should be used for each file, see shared(), and access to
+it is protected by a lock. Entries added on lookups are saved at most
+every save_interval seconds and when the process exits. save() merges
+with any changes made by other processes, holding an exclusive lock on
+a lock file next to the index file where fcntl is available.
+"""
+
+import atexit
+import json
+import logging
+import os
+import os.path
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from PIL import Image
+
+
+def normpath(path):
+    """Return normalized absolute path for comparisons."""
+    return os.path.normpath(os.path.abspath(path))
+
+
+class IIIFImageIndex(object):
+    """Index of image dimensions and metadata keyed by identifier."""
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, index_file=None, save_interval=10.0):
+        """Initialize IIIFImageIndex object.
+
+        Keyword arguments:
+        index_file -- JSON file to load index from and save it to, or
+            None to keep the index only in memory
+        save_interval -- minimum interval in seconds between saves of
+            entries added by get() (default 10)
+        """
+        self.index_file = index_file
+        self.save_interval = save_interval
+        self.entries = {}
+        self.built_dirs = set()
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # identifiers changed or removed since last save
+        self._changed = set()
+        self._last_save = time.time()
+        if (self.index_file is not None):
+            if (os.path.isfile(self.index_file)):
+                self.load()
+            atexit.register(self.flush)
+
+    @classmethod
+    def shared(cls, index_file):
+        """Return the IIIFImageIndex object for index_file in this process.
+
+        Creates the object on first use so that all handlers using the
+        same file share one index.
+        """
+        key = normpath(index_file)
+        with cls._shared_lock:
+            index = cls._shared.get(key)
+            if (index is None):
+                index = cls(index_file)
+                cls._shared[key] = index
+            return index
+
+    def read(self):
+        """Return dict of entries in self.index_file, empty if none."""
+        try:
+            with open(self.index_file, 'r') as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def load(self):
+        """Load index from self.index_file."""
+        entries = self.read()
+        with self._lock:
+            self.entries = entries
+            self._changed = set()
+
+    def save(self):
+        """Save index to self.index_file, merged with the current file.
+
+        Entries changed or removed by this object since it was loaded
+        or last saved replace those in the current file, other entries
+        in the file (e.g. added by another process) are kept and also
+        added to this object. The merged index is written to a
+        temporary file in the same directory which is then renamed so
+        that readers never see a partial index. Does nothing if there
+        is no self.index_file.
+        """
+        if (self.index_file is None):
+            return
+        lock_fd = None
+        if (fcntl is not None):
+            lock_fd = os.open(self.index_file + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            entries = self.read()
+            with self._lock:
+                for identifier in self._changed:
+                    if (identifier in self.entries):
+                        entries[identifier] = self.entries[identifier]
+                    else:
+                        entries.pop(identifier, None)
+                self.entries = entries
+                self._changed = set()
+                self._last_save = time.time()
+                data = json.dumps(entries, indent=1, sort_keys=True)
+            dirname = os.path.dirname(os.path.abspath(self.index_file))
+            (fd, tmpfile) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as fh:
+                    fh.write(data)
+                os.rename(tmpfile, self.index_file)
+            except Exception:
+                os.unlink(tmpfile)
+                raise
+        finally:
+            if (lock_fd is not None):
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                os.close(lock_fd)
+
+    def flush(self, interval=0.0):
+        """Save index if there are unsaved changes.
+
+        Does nothing if the index was saved less than interval seconds
+        ago. Failure to write the index file is logged, not raised, so
+        that requests are not affected.
+        """
+        if (self.index_file is None or not self._changed or
+                time.time() - self._last_save < interval):
+            return
+        try:
+            self.save()
+        except (IOError, OSError) as e:
+            self.logger.warning("Failed to save index %s: %s" % (self.index_file, str(e)))
+
+    def lookup(self, identifier, path):
+        """Return index entry for identifier if up to date, else None.
+
+        The entry must be for the same path and have the same
+        modification time as the current file.
+        """
+        with self._lock:
+            entry = self.entries.get(identifier)
+        if (entry is None or normpath(entry['path']) != normpath(path)):
+            return None
+        try:
+            if (os.stat(path).st_mtime != entry['mtime']):
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def add(self, identifier, path):
+        """Read image header from path and add entry for identifier.
+
+        Returns the new entry, or None if the image could not be read.
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+            image = Image.open(path)
+        except Exception as e:
+            self.logger.warning("Failed to index %s: %s" % (path, str(e)))
+            return None
+        entry = {'path': path,
+                 'mtime': mtime,
+                 'width': image.size[0],
+                 'height': image.size[1],
+                 'mode': image.mode,
+                 'format': image.format}
+        image.close()
+        with self._lock:
+            self.entries[identifier] = entry
+            self._changed.add(identifier)
+        return entry
+
+    def get(self, identifier, path):
+        """Return up to date entry for identifier with image at path.
+
+        Will add an entry if necessary, which is written to the index
+        file if it is more than self.save_interval seconds since the
+        last save, otherwise on a later get() or at exit. Returns None
+        if the image could not be read.
+        """
+        entry = self.lookup(identifier, path)
+        if (entry is None):
+            entry = self.add(identifier, path)
+            self.flush(self.save_interval)
+        return entry
+
+    def build(self, image_dir, extensions=('.jpg', '.png', '.tif')):
+        """Bring index up to date with images in image_dir and save.
+
+        Identifiers are the image file names without the extension,
+        as used by the Flask server. Entries that are already up to date
+        are not re-read, entries for images that no longer exist are
+        removed.
+
+        Returns the number of images indexed.
+        """
+        self.built_dirs.add(normpath(image_dir))
+        current = {}
+        for image_file in sorted(os.listdir(image_dir)):
+            (identifier, ext) = os.path.splitext(image_file)
+            path = os.path.join(image_dir, image_file)
+            if (ext not in extensions or not os.path.isfile(path) or
+                    identifier in current):
+                continue
+            entry = self.lookup(identifier, path) or self.add(identifier, path)
+            if (entry is not None):
+                current[identifier] = entry
+        with self._lock:
+            for identifier in list(self.entries.keys()):
+                if (identifier not in current and
+                        os.path.dirname(normpath(self.entries[identifier]['path'])) ==
+                        normpath(image_dir)):
+                    del self.entries[identifier]
+                    self._changed.add(identifier)
+        self.save()
+        return len(current)
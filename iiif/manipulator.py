@@ -12,6 +12,11 @@ import re
 import shutil
 import subprocess
 
+try:
+    from time import perf_counter as timer
+except ImportError:  # pragma: no cover # python2
+    from time import time as timer
+
 from .error import IIIFError, IIIFZeroSizeError
 from .request import IIIFRequest
 
@@ -23,26 +28,43 @@ class IIIFManipulator(object):
     determine the HTTP response.
     """
 
-    def __init__(self, api_version='2.1'):
+    def __init__(self, api_version='2.1', in_memory=False, timing=False):
         """Initialize Manipulator object.
 
         Accepts api_version as a parameter to tailor handling of
         requests according to the API being supported.
 
+        If in_memory is True then manipulators that support it will
+        write the derived image to an in-memory buffer instead of a
+        temporary file when no output file is specified, see derive().
+
+        If timing is True then the time taken by each stage of derive()
+        is recorded in self.timings, see stage().
+
         Sets compliance_level to None because the null manipulator
         doesn't comply with any level. Sub-classes are expected to
         set this to a level number (0,1,2) appropriate to the
         facilities supported at the given API version. Use
         compliance_uri to get a URI.
+
+        Sets mirroring to False so that derive() rejects requests for
+        mirroring. Sub-classes whose do_rotation() supports mirroring
+        should set this True.
         """
         self.api_version = api_version
         self.compliance_level = None
+        self.mirroring = False
         self.max_area = None
         self.max_width = None
         self.max_height = None
         self.srcfile = None
         self.request = None
         self.outfile = None
+        self.in_memory = in_memory
+        self.outbuf = None
+        self.first_srcfile = None
+        self.timing = timing
+        self.timings = []
         self.logger = logging.getLogger(__name__)
 
     @property
@@ -79,6 +101,11 @@ class IIIFManipulator(object):
                    written to that file, otherwise a new temporary file
                    will be created and outfile set to its location.
 
+        If no outfile is specified and self.in_memory is set then
+        manipulators that support it will instead write the output to
+        an io.BytesIO buffer in self.outbuf. In this case that buffer
+        is returned in place of the output file name.
+
         See order in spec: http://www-sul.stanford.edu/iiif/image-api/#order
 
           Region THEN Size THEN Rotation THEN Quality THEN Format
@@ -108,19 +135,51 @@ class IIIFManipulator(object):
             if (not os.path.exists(dir)):
                 os.makedirs(dir)
         #
-        self.do_first()
+        if (self.first_srcfile is None or self.first_srcfile != self.srcfile):
+            self.stage('first', self.do_first)
+        self.first_srcfile = None
         (x, y, w, h) = self.region_to_apply()
-        self.do_region(x, y, w, h)
+        self.stage('region', self.do_region, x, y, w, h)
         (w, h) = self.size_to_apply()
-        self.do_size(w, h)
-        (mirror, rot) = self.rotation_to_apply(no_mirror=True)
-        self.do_rotation(mirror, rot)
+        self.stage('size', self.do_size, w, h)
+        (mirror, rot) = self.rotation_to_apply(no_mirror=not self.mirroring)
+        self.stage('rotation', self.do_rotation, mirror, rot)
         (quality) = self.quality_to_apply()
-        self.do_quality(quality)
-        self.do_format(self.request.format)
-        self.do_last()
+        self.stage('quality', self.do_quality, quality)
+        self.stage('format', self.do_format, self.request.format)
+        self.stage('last', self.do_last)
+        if (self.outbuf is not None):
+            return(self.outbuf, self.mime_type)
         return(self.outfile, self.mime_type)
 
+    def stage(self, name, method, *args):
+        """Call method(*args) as stage name of derive(), return result.
+
+        If self.timing is set then (name, seconds) is appended to
+        self.timings.
+        """
+        if (not self.timing):
+            return method(*args)
+        start = timer()
+        try:
+            return method(*args)
+        finally:
+            self.timings.append((name, timer() - start))
+
+    def image_dimensions(self):
+        """Set and return (width, height) of source image self.srcfile.
+
+        For use before derive() when only the dimensions are needed.
+        This implementation calls do_first() and records that it has
+        been done for self.srcfile so that derive() does not repeat it.
+        Sub-classes should override this to read the dimensions from
+        the image metadata if do_first() decodes or converts the image.
+        Call cleanup() if derive() is not then called.
+        """
+        self.do_first()
+        self.first_srcfile = self.srcfile
+        return (self.width, self.height)
+
     def do_first(self):
         """Simplest possible manipulator that can only handle no modification.
 
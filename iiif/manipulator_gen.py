@@ -5,10 +5,54 @@ import sys
 
 from PIL import Image
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # pragma: no cover
+    ProcessPoolExecutor = None
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 from .error import IIIFError
 from .manipulator_pil import IIIFManipulatorPIL
 
 
+def render_image(gen, xs, ys):
+    """Render image from generator gen for columns xs and rows ys.
+
+    The image is generated, in order of preference, by the generator
+    render() method for the whole image, by one vectorized call to the
+    generator pixels() method if numpy is available, or else by calling
+    pixel() for each pixel.
+
+    Returns a PIL Image.
+    """
+    image = None
+    if (hasattr(gen, 'render')):
+        image = gen.render(xs, ys)
+    if (image is None and np is not None and hasattr(gen, 'pixels')):
+        (iy, ix) = np.meshgrid(np.array(ys, dtype=np.int64),
+                               np.array(xs, dtype=np.int64), indexing='ij')
+        image = Image.fromarray(gen.pixels(ix, iy))
+    if (image is None):
+        image = Image.new("RGB", (len(xs), len(ys)), gen.background_color)
+        for y in range(0, len(ys)):
+            for x in range(0, len(xs)):
+                color = gen.pixel(xs[x], ys[y])
+                if (color is not None):
+                    image.putpixel((x, y), color)
+    return image
+
+
+def _render_strip(gen, xs, ys):
+    # Render strip in worker process, return (mode, size, data) that
+    # is cheaper to pass back than the image object
+    image = render_image(gen, xs, ys)
+    return (image.mode, image.size, image.tobytes())
+
+
 class IIIFManipulatorGen(IIIFManipulatorPIL):
     """Class to generate an image with PIL according to IIIF Image API.
 
@@ -18,16 +62,54 @@ class IIIFManipulatorGen(IIIFManipulatorPIL):
 
     All exceptions are raised as IIIFError objects which directly
     determine the HTTP response.
+
+    The output image is generated in horizontal strips of strip_height
+    rows. If the workers setting of an instance is greater than 1 then
+    the strips are generated in parallel by a pool of that many worker
+    processes which is shared by all instances. The strips are the same whether generated in
+    parallel or not so the output image is identical.
     """
 
-    def __init__(self, **kwargs):
+    strip_height = 128
+    _executor = None
+    _executor_workers = 0
+
+    def __init__(self, workers=0, **kwargs):
         """Initialize IIIFManipulatorGen object.
 
-        Keyword arguments are passed to superclass initialize method
+        Keyword arguments:
+            workers - number of worker processes used to generate each
+                image, 0 or 1 to generate images in this process
+            **kwargs - passed to superclass initialize method
         """
         super(IIIFManipulatorGen, self).__init__(**kwargs)
+        self.workers = workers
         self.gen = None
 
+    @classmethod
+    def executor(cls, workers):
+        """Return process pool executor for workers worker processes.
+
+        The executor is created on first use and shared by all
+        instances, it is replaced if an instance asks for a different
+        number of workers. Returns None if workers is not greater than
+        1 or if concurrent.futures is not available.
+        """
+        if (workers <= 1 or ProcessPoolExecutor is None):
+            return None
+        if (cls._executor is None or cls._executor_workers != workers):
+            cls.executor_shutdown()
+            IIIFManipulatorGen._executor = ProcessPoolExecutor(max_workers=workers)
+            IIIFManipulatorGen._executor_workers = workers
+        return cls._executor
+
+    @classmethod
+    def executor_shutdown(cls):
+        """Shut down process pool executor if there is one."""
+        if (cls._executor is not None):
+            cls._executor.shutdown()
+            IIIFManipulatorGen._executor = None
+
     def do_first(self):
         """Load generator, set size.
 
@@ -73,7 +155,13 @@ class IIIFManipulatorGen(IIIFManipulatorPIL):
             self.rh = h
 
     def do_size(self, w, h):
-        """Record size."""
+        """Record size and generate image.
+
+        The image coordinates of each column and row of the output
+        image are calculated and then the image is generated in strips
+        with render_image(), using worker processes if there is a pool
+        executor, and the strips are pasted together.
+        """
         if (w is None):
             self.sw = self.rw
             self.sh = self.rh
@@ -81,12 +169,22 @@ class IIIFManipulatorGen(IIIFManipulatorPIL):
             self.sw = w
             self.sh = h
         # Now we have region and size, generate the image
-        image = Image.new("RGB", (self.sw, self.sh), self.gen.background_color)
-        for y in range(0, self.sh):
-            for x in range(0, self.sw):
-                ix = int((x * self.rw) // self.sw + self.rx)
-                iy = int((y * self.rh) // self.sh + self.ry)
-                color = self.gen.pixel(ix, iy)
-                if (color is not None):
-                    image.putpixel((x, y), color)
-        self.image = image
+        xs = [int((x * self.rw) // self.sw + self.rx) for x in range(0, self.sw)]
+        ys = [int((y * self.rh) // self.sh + self.ry) for y in range(0, self.sh)]
+        strips = [ys[j:j + self.strip_height]
+                  for j in range(0, len(ys), self.strip_height)] or [ys]
+        executor = self.executor(self.workers) if (len(strips) > 1) else None
+        if (executor is None):
+            images = [render_image(self.gen, xs, strip) for strip in strips]
+        else:
+            n = len(strips)
+            images = [Image.frombytes(mode, size, data) for (mode, size, data) in
+                      executor.map(_render_strip, [self.gen] * n, [xs] * n, strips)]
+        if (len(images) == 1):
+            self.image = images[0]
+        else:
+            self.image = Image.new(images[0].mode, (self.sw, self.sh))
+            y = 0
+            for image in images:
+                self.image.paste(image, (0, y))
+                y += image.size[1]
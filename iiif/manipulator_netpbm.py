@@ -12,6 +12,11 @@ import glob
 import magic
 import subprocess
 
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
 from .error import IIIFError
 from .request import IIIFRequest
 from .manipulator import IIIFManipulator
@@ -34,6 +39,7 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
         """
         super(IIIFManipulatorNetpbm, self).__init__(**kwargs)
         self.complianceLevel = "http://iiif.example.org/compliance/level/1"
+        self.basename = None
         if (self.pnmdir is None):
             self.find_binaries()
 
@@ -69,6 +75,22 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
         # Need djatoka to get jp2 output
         cls.djatoka_comp = '/Users/simeon/packages/adore-djatoka-1.1/bin/compress.sh'
 
+    def image_dimensions(self):
+        """Set and return (width, height) of self.srcfile.
+
+        Reads the image header with PIL if available to avoid converting
+        the image, otherwise uses do_first().
+        """
+        if (Image is not None):
+            try:
+                with Image.open(self.srcfile) as image:
+                    (self.width, self.height) = image.size
+                return (self.width, self.height)
+            except Exception:
+                # Leave any error to do_first()
+                pass
+        return super(IIIFManipulatorNetpbm, self).image_dimensions()
+
     def do_first(self):
         """Create PNM file from input image file."""
         pid = os.getpid()
@@ -285,5 +307,7 @@ class IIIFManipulatorNetpbm(IIIFManipulator):
 
     def cleanup(self):
         """Clean up any temporary files."""
+        if (self.basename is None):
+            return
         for file in glob.glob(self.basename + '*'):
             os.unlink(file)
@@ -4,6 +4,8 @@ Uses the Python Image Library (PIL) for in-python manipulation:
 http://www.pythonware.com/products/pil/index.htm
 """
 
+import io
+import math
 import re
 import os
 import os.path
@@ -27,6 +29,21 @@ class IIIFManipulatorPIL(IIIFManipulator):
     tmpdir = '/tmp'
     filecmd = None
     pnmdir = None
+    # Shared cache of decoded source images, an IIIFImageCache object
+    # or None to not cache
+    image_cache = None
+    # Lossless transpose equivalent to mirroring (about the vertical axis)
+    # and then rotating clockwise by a multiple of 90 degrees, keyed by
+    # (mirror, rot) as returned by rotation_to_apply()
+    transpose_ops = {
+        (True, 0.0): Image.FLIP_LEFT_RIGHT,
+        (False, 90.0): Image.ROTATE_270,
+        (False, 180.0): Image.ROTATE_180,
+        (False, 270.0): Image.ROTATE_90,
+        (True, 90.0): Image.TRANSVERSE,
+        (True, 180.0): Image.FLIP_TOP_BOTTOM,
+        (True, 270.0): Image.TRANSPOSE
+    }
 
     def __init__(self, **kwargs):
         """Initialize IIIFManipulatorPIL object.
@@ -36,8 +53,11 @@ class IIIFManipulatorPIL(IIIFManipulator):
         super(IIIFManipulatorPIL, self).__init__(**kwargs)
         # Does not support jp2 output
         self.compliance_level = 2
+        self.mirroring = True
         self.image = None
         self.outtmp = None
+        self.region_box = None
+        self.cached_image = None
 
     def set_max_image_pixels(self, pixels):
         """Set PIL limit on pixel size of images to load if non-zero.
@@ -56,15 +76,48 @@ class IIIFManipulatorPIL(IIIFManipulator):
             Image.warnings.simplefilter(
                 'error', Image.DecompressionBombWarning)
 
+    def image_dimensions(self):
+        """Set and return (width, height) of self.srcfile from image header.
+
+        The image is opened to read the header and then closed, it is
+        not decoded and self.image_cache is not used.
+
+        Will raise an IIIFError on failure to read the image.
+        """
+        try:
+            with Image.open(self.srcfile) as image:
+                (self.width, self.height) = image.size
+        except Image.DecompressionBombWarning as e:
+            raise IIIFError(text=("Image size limit exceeded (PIL: %s)" % (str(e))))
+        except Exception as e:
+            raise IIIFError(text=("Failed to read image (PIL: %s)" % (str(e))))
+        return (self.width, self.height)
+
     def do_first(self):
         """Create PIL object from input image file.
 
         Image location must be in self.srcfile. Will result in
         self.width and self.height being set to the image dimensions.
 
+        If self.image_cache is set then a full resolution image
+        decoded previously will be used if available.
+
         Will raise an IIIFError on failure to load the image
         """
         self.logger.debug("do_first: src=%s" % (self.srcfile))
+        self.cached_image = None
+        if (self.image_cache is not None):
+            try:
+                self.cached_image = self.image_cache.get(
+                    self.image_cache.key(self.srcfile))
+            except OSError:
+                # Missing file, leave error to Image.open(..)
+                pass
+        if (self.cached_image is not None):
+            self.logger.debug("do_first: using cached image")
+            self.image = self.cached_image
+            (self.width, self.height) = self.image.size
+            return
         try:
             self.image = Image.open(self.srcfile)
         except Image.DecompressionBombWarning as e:
@@ -78,39 +131,202 @@ class IIIFManipulatorPIL(IIIFManipulator):
         (self.width, self.height) = self.image.size
 
     def do_region(self, x, y, w, h):
-        """Apply region selection."""
+        """Record region selection.
+
+        The region is not extracted here but is recorded in
+        self.region_box and then extracted as part of the resize in
+        do_size() so that there is just one resampling pass and no
+        intermediate cropped image.
+
+        If the region is going to be scaled down then we first try to
+        have the decoder produce a reduced resolution image, see
+        reduce_decode(), in which case self.region_box is the region
+        mapped onto the reduced image.
+        """
         if (x is None):
+            (rx, ry, rw, rh) = (0, 0, self.width, self.height)
+        else:
+            (rx, ry, rw, rh) = (x, y, w, h)
+        scale = self.reduce_decode(rw, rh)
+        self.cache_image(scale)
+        if (scale > 1):
+            self.logger.debug("region: (%d,%d,%d,%d) from 1/%d scale decode"
+                              % (rx, ry, rw, rh, scale))
+            self.region_box = (rx / float(scale), ry / float(scale),
+                               (rx + rw) / float(scale), (ry + rh) / float(scale))
+        elif (x is None):
             self.logger.debug("region: full (nop)")
         else:
             self.logger.debug("region: (%d,%d,%d,%d)" % (x, y, w, h))
-            self.image = self.image.crop((x, y, x + w, y + h))
-            self.width = w
-            self.height = h
+            self.region_box = (x, y, x + w, y + h)
+        self.width = rw
+        self.height = rh
 
     def do_size(self, w, h):
-        """Apply size scaling."""
+        """Apply region extraction and size scaling.
+
+        Any region recorded in self.region_box by do_region() is
+        extracted as part of the resize, or with a simple crop if
+        there is no scaling.
+        """
         if (w is None):
-            self.logger.debug("size: no scaling (nop)")
+            if (self.region_box is None):
+                self.logger.debug("size: no scaling (nop)")
+            else:
+                self.logger.debug("size: no scaling, crop region")
+                self.image = self.image.crop(self.region_box)
         else:
             self.logger.debug("size: scaling to (%d,%d)" % (w, h))
-            self.image = self.image.resize((w, h))
+            if (self.region_box is None):
+                self.image = self.image.resize((w, h))
+            else:
+                self.image = self.image.resize((w, h), box=self.region_box)
             self.width = w
             self.height = h
+        self.region_box = None
+
+    def reduce_decode(self, w, h):
+        """Set up reduced resolution decode if a region will be scaled down.
+
+        Looks ahead to the size that will be applied to the region of
+        width w and height h. If that is a reduction by a factor of 2 or
+        more then PIL's draft mode is used to ask the decoder for an
+        image scaled by 1/2, 1/4 or 1/8 that still covers the requested
+        size. Only JPEG images support this, for other formats and for
+        images that have already been loaded draft mode does nothing.
+        If self.image is from self.image_cache then reduce_cached() is
+        used instead.
+
+        Returns the scale factor of the reduced image, 1 if no reduction.
+        """
+        if (self.request is None or self.image is None):
+            return 1
+        (full_width, full_height) = (self.width, self.height)
+        try:
+            (self.width, self.height) = (w, h)
+            (sw, sh) = self.size_to_apply()
+        finally:
+            (self.width, self.height) = (full_width, full_height)
+        if (sw is None):
+            return 1
+        if (self.cached_image is not None):
+            return self.reduce_cached(w, h, sw, sh)
+        for scale in (8, 4, 2):
+            if (w // scale >= sw and h // scale >= sh):
+                break
+        else:
+            return 1
+        # Requesting the rounded-down size means that the decoder will
+        # pick exactly this scale, check the resulting size to be sure
+        (iw, ih) = self.image.size
+        self.image.draft(self.image.mode, (iw // scale, ih // scale))
+        for s in (8, 4, 2):
+            if (self.image.size == ((iw + s - 1) // s, (ih + s - 1) // s)):
+                return s
+        return 1
+
+    def reduce_cached(self, w, h, sw, sh):
+        """Use reduced resolution image from self.image_cache if available.
+
+        Used in place of draft mode when self.image is already decoded
+        and from the cache. Looks for the smallest cached image of the
+        source at 1/2, 1/4, 1/8... scale that covers the size sw, sh
+        that the region of width w and height h will be scaled to. Such
+        images may have been added by cache_image() after a reduced
+        resolution decode, or by a process that builds a pyramid of
+        levels such as IIIFStatic.
+
+        Returns the scale factor of the image used, 1 if no reduction.
+        """
+        scale = 1
+        while (w // (scale * 2) >= sw and h // (scale * 2) >= sh):
+            scale *= 2
+        while (scale > 1):
+            image = self.image_cache.get(self.image_cache.key(self.srcfile, scale))
+            if (image is not None):
+                self.image = image
+                self.cached_image = image
+                return scale
+            scale //= 2
+        return 1
+
+    def cache_image(self, scale):
+        """Get source image decoded at 1/scale from or add to self.image_cache.
+
+        Does nothing if there is no cache or if self.image is already
+        from the cache. Otherwise, if the cache has the source image
+        decoded at the same scale then that replaces self.image,
+        else self.image is decoded and added to the cache. The full
+        resolution image (scale 1) was already looked for in do_first().
+        """
+        if (self.image_cache is None or self.cached_image is not None):
+            return
+        key = self.image_cache.key(self.srcfile, scale)
+        image = (self.image_cache.get(key) if (scale > 1) else None)
+        if (image is not None):
+            self.logger.debug("cache_image: using cached 1/%d scale image" % (scale))
+            self.image.close()
+            self.image = image
+            self.cached_image = image
+        else:
+            self.image.load()
+            if (self.image_cache.put(key, self.image)):
+                self.cached_image = self.image
 
     def do_rotation(self, mirror, rot):
-        """Apply rotation and/or mirroring."""
+        """Apply rotation and/or mirroring.
+
+        All combinations of mirroring with rotations by multiples of 90
+        degrees are done with a single lossless transpose operation,
+        see transpose_ops. Mirroring with any other rotation is done in
+        a single affine transform, see mirror_rotate().
+        """
         if (not mirror and rot == 0.0):
             self.logger.debug("rotation: no rotation (nop)")
+        elif ((mirror, rot) in self.transpose_ops):
+            self.logger.debug("rotation: transpose for mirror=%s and %f degrees "
+                              "clockwise" % (mirror, rot))
+            self.image = self.image.transpose(self.transpose_ops[(mirror, rot)])
+        elif (not mirror):
+            self.logger.debug("rotation: by %f degrees clockwise" % (rot))
+            self.image = self.image.rotate(-rot, expand=True)
         else:
-            # FIXME - with PIL one can use the transpose() method to do 90deg
-            # FIXME - rotations as well as mirroring. This would be more efficient
-            # FIXME - for these cases than mirror _then_ rotate.
-            if (mirror):
-                self.logger.debug("rotation: mirror (about vertical axis)")
-                self.image = self.image.transpose(Image.FLIP_LEFT_RIGHT)
-            if (rot != 0.0):
-                self.logger.debug("rotation: by %f degrees clockwise" % (rot))
-                self.image = self.image.rotate(-rot, expand=True)
+            self.logger.debug("rotation: mirror (about vertical axis) "
+                              "then by %f degrees clockwise" % (rot))
+            self.image = self.mirror_rotate(rot)
+
+    def mirror_rotate(self, rot):
+        """Mirror and then rotate self.image by rot degrees clockwise.
+
+        Gives the same result as transpose(FLIP_LEFT_RIGHT) followed
+        by rotate(-rot, expand=True) but does both in one transform
+        without creating the intermediate mirrored image. The matrix
+        and expanded output size are calculated exactly as PIL does
+        for rotate(..), the mirroring is then folded into the matrix
+        because the transform maps output coordinates to input.
+
+        Returns the new image.
+        """
+        (w, h) = self.image.size
+        angle = -math.radians((-rot) % 360.0)
+        (a, b) = (round(math.cos(angle), 15), round(math.sin(angle), 15))
+        (cx, cy) = (w / 2.0, h / 2.0)
+        # rotation about center
+        c = a * -cx + b * -cy + cx
+        f = -b * -cx + a * -cy + cy
+        # expand to hold all of rotated image
+        xx = []
+        yy = []
+        for (x, y) in ((0, 0), (w, 0), (w, h), (0, h)):
+            xx.append(a * x + b * y + c)
+            yy.append(-b * x + a * y + f)
+        nw = int(math.ceil(max(xx)) - math.floor(min(xx)))
+        nh = int(math.ceil(max(yy)) - math.floor(min(yy)))
+        (tx, ty) = (-(nw - w) / 2.0, -(nh - h) / 2.0)
+        (c, f) = (a * tx + b * ty + c, -b * tx + a * ty + f)
+        # mirror, x -> w - x, applied to input coordinates
+        return self.image.transform((nw, nh), Image.AFFINE,
+                                    (-a, -b, w - c, -b, a, f))
 
     def do_quality(self, quality):
         """Apply value of quality parameter.
@@ -168,7 +384,11 @@ class IIIFManipulatorPIL(IIIFManipulator):
         else:
             raise IIIFError(code=415, parameter='format',
                             text="Unsupported output file format (%s), only png,jpg,webp are supported." % (fmt))
-        if (self.outfile is None):
+        if (self.outfile is None and self.in_memory):
+            # Write to buffer
+            self.outbuf = io.BytesIO()
+            self.image.save(self.outbuf, format=format)
+        elif (self.outfile is None):
             # Create temp
             f = tempfile.NamedTemporaryFile(delete=False)
             self.outfile = f.name
@@ -179,15 +399,22 @@ class IIIFManipulatorPIL(IIIFManipulator):
             self.image.save(self.outfile, format=format)
 
     def cleanup(self):
-        """Cleanup: ensure image closed and remove temporary output file."""
-        if self.image:
+        """Cleanup: ensure image closed, remove temporary output file or buffer.
+
+        An image from self.image_cache is shared and is not closed.
+        """
+        if (self.image and self.image is not self.cached_image):
             try:
                 self.image.close()
             except Exception:
                 pass
+        if (self.outbuf is not None):
+            self.outbuf.close()
+            self.outbuf = None
         if (self.outtmp is not None):
             try:
                 os.unlink(self.outtmp)
             except OSError as e:
                 self.logger.warning("Failed to cleanup tmp output file %s"
                                     % (self.outtmp))
+            self.outtmp = None
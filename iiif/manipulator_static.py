@@ -0,0 +1,237 @@
+"""IIIF image manipulator serving files pregenerated by IIIFStatic.
+
+Serves the info.json and image files written by iiif_static.py, either
+in the directory layout under a static directory or from a pack file,
+without any image processing. Requests are looked up first as given and
+then in canonical form. Requests for which there is no pregenerated file
+may optionally be passed to a fallback manipulator, typically the PIL
+manipulator, which derives the image from the source image in the usual
+way.
+"""
+
+import copy
+import io
+import os.path
+
+from .error import IIIFError
+from .info import IIIFInfo, IIIFInfoError
+from .manipulator import IIIFManipulator
+
+MIME_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp',
+              'gif': 'image/gif', 'tif': 'image/tiff', 'jp2': 'image/jp2',
+              'pdf': 'application/pdf'}
+
+
+class IIIFManipulatorStatic(IIIFManipulator):
+    """Module to serve pregenerated static files for IIIF requests."""
+
+    def __init__(self, static_dir=None, static_pack=None, fallback_klass=None, **kwargs):
+        """Initialize IIIFManipulatorStatic object.
+
+        Keyword arguments:
+            static_dir - directory of static files as written by IIIFStatic
+            static_pack - IIIFStaticPackReader for a pack file of static
+                files, used in preference to static_dir if both are set
+            fallback_klass - IIIFManipulator sub-class used for requests
+                without a static file, None to reject them
+            **kwargs - passed to superclass and also used to create the
+                fallback manipulator
+
+        The compliance level is 0 unless there is a fallback in which
+        case it is that of the fallback.
+        """
+        super(IIIFManipulatorStatic, self).__init__(**kwargs)
+        self.static_dir = static_dir
+        self.static_pack = static_pack
+        self.compliance_level = 0
+        self.fallback = None
+        self.used_fallback = False
+        self.found = None
+        if (fallback_klass is not None):
+            self.fallback = fallback_klass(**kwargs)
+            self.compliance_level = self.fallback.compliance_level
+
+    def identifiers(self):
+        """List of identifiers with pregenerated static files."""
+        ids = []
+        if (self.static_pack is not None):
+            for path in self.static_pack.index:
+                if (path.endswith('/info.json')):
+                    ids.append(path[:-len('/info.json')])
+        elif (self.static_dir is not None and os.path.isdir(self.static_dir)):
+            for identifier in os.listdir(self.static_dir):
+                if (os.path.isfile(os.path.join(self.static_dir, identifier, 'info.json'))):
+                    ids.append(identifier)
+        return ids
+
+    def get(self, path):
+        """Return data of the static file with IIIF path, or None if not found."""
+        if ('..' in path.split('/')):
+            return None
+        if (self.static_pack is not None):
+            return self.static_pack.get(path)
+        if (self.static_dir is not None):
+            filename = os.path.join(self.static_dir, path)
+            if (os.path.isfile(filename)):
+                with open(filename, 'rb') as fh:
+                    return fh.read()
+        return None
+
+    def static_source(self, identifier):
+        """File to use for cache validators if identifier has static files.
+
+        This is the info.json file for identifier in the directory
+        layout, or the pack file. Returns None if there are no static
+        files for identifier.
+        """
+        path = identifier + '/info.json'
+        if ('..' in path.split('/')):
+            return None
+        if (self.static_pack is not None):
+            return self.static_pack.pack_file if (path in self.static_pack) else None
+        if (self.static_dir is not None):
+            filename = os.path.join(self.static_dir, path)
+            if (os.path.isfile(filename)):
+                return filename
+        return None
+
+    def static_info(self, identifier):
+        """Return IIIFInfo object read from static info.json for identifier, or None.
+
+        Raises IIIFError if the info.json is not for self.api_version.
+        """
+        data = self.get(identifier + '/info.json')
+        if (data is None):
+            return None
+        info = IIIFInfo(api_version=self.api_version)
+        try:
+            info.read(io.StringIO(data.decode('utf-8')), api_version=self.api_version)
+        except IIIFInfoError as e:
+            raise IIIFError(code=500,
+                            text="Static info.json for %s cannot be used for API version %s (%s)" %
+                            (identifier, self.api_version, str(e)))
+        return info
+
+    def static_data(self, request):
+        """Return data of the static file for request, or None if there is none.
+
+        Looks for the request path as given and then, if the info.json
+        is available to give the image size, the canonical form. The
+        canonical full or max size is also looked for as the explicit
+        w, and w,h sizes used by IIIFStatic.
+        """
+        data = self.get(request.url())
+        if (data is not None):
+            return data
+        info = self.static_info(request.identifier)
+        if (info is None):
+            return None
+        canonical = copy.copy(request)
+        canonical.canonicalize(info.width, info.height)
+        data = self.get(canonical.url())
+        if (data is None and canonical.size in ('full', 'max')):
+            if (canonical.region_full):
+                (w, h) = (info.width, info.height)
+            else:
+                (w, h) = canonical.region_xywh[2:]
+            for size in ('%d,' % (w), '%d,%d' % (w, h)):
+                canonical.size = size
+                data = self.get(canonical.url())
+                if (data is not None):
+                    break
+        return data
+
+    def lookup(self, request):
+        """Return data of the static file for request, or None if there is none.
+
+        Calls static_data() once for each request object, the result is
+        kept so that checking before derive(), see uses_fallback(),
+        does not repeat the lookup.
+        """
+        if (self.found is None or self.found[0] is not request):
+            self.found = (request, self.stage('static', self.static_data, request))
+        return self.found[1]
+
+    def uses_fallback(self, request):
+        """Return True if derive() for request will use the fallback manipulator.
+
+        This is the case when there is no static file for request, and
+        there is a fallback manipulator and a source image for it in
+        self.srcfile.
+        """
+        return (self.lookup(request) is None and self.fallback is not None and
+                self.srcfile is not None and
+                self.srcfile != self.static_source(request.identifier))
+
+    def do_first(self):
+        """Get width and height of source image from fallback manipulator.
+
+        Width and height of images with static files come from their
+        info.json, see static_info().
+        """
+        if (self.fallback is None):
+            raise IIIFError(code=404, parameter='identifier',
+                            text="No source image for static manipulator.")
+        self.fallback.srcfile = self.srcfile
+        self.fallback.do_first()
+        self.width = self.fallback.width
+        self.height = self.fallback.height
+
+    def image_dimensions(self):
+        """Set and return (width, height) of source image from fallback manipulator.
+
+        Raises IIIFError as for do_first() if there is no fallback.
+        """
+        if (self.fallback is None):
+            self.do_first()
+        self.fallback.srcfile = self.srcfile
+        (self.width, self.height) = self.fallback.image_dimensions()
+        return (self.width, self.height)
+
+    def derive(self, srcfile=None, request=None, outfile=None):
+        """Serve pregenerated file for request, or derive with fallback.
+
+        Named argments as for IIIFManipulator.derive(). The data of a
+        static file is copied to outfile if that is set, and is
+        otherwise returned in an io.BytesIO buffer in self.outbuf
+        whether or not self.in_memory is set.
+
+        Raises IIIFError with code 501 if there is no static file
+        for the request and no fallback, or if there is no source
+        image for the fallback.
+        """
+        if (srcfile is not None):
+            self.srcfile = srcfile
+        if (request is not None):
+            self.request = request
+        if (outfile is not None):
+            self.outfile = outfile
+        data = self.lookup(self.request)
+        if (data is not None):
+            self.mime_type = MIME_TYPES.get(self.request.format)
+            if (self.outfile is None):
+                self.outbuf = io.BytesIO(data)
+                return(self.outbuf, self.mime_type)
+            dir = os.path.dirname(self.outfile)
+            if (not os.path.exists(dir)):
+                os.makedirs(dir)
+            with open(self.outfile, 'wb') as fh:
+                fh.write(data)
+            return(self.outfile, self.mime_type)
+        if (not self.uses_fallback(self.request)):
+            raise IIIFError(code=501,
+                            text="No static file for request %s." % (self.request.url()))
+        self.used_fallback = True
+        (out, self.mime_type) = self.fallback.derive(self.srcfile, self.request, self.outfile)
+        self.outfile = self.fallback.outfile
+        self.outbuf = self.fallback.outbuf
+        self.timings.extend(self.fallback.timings)
+        return(out, self.mime_type)
+
+    def cleanup(self):
+        """Cleanup buffer, and fallback manipulator if there is one."""
+        if (self.fallback is not None):
+            self.fallback.cleanup()
+        if (self.outbuf is not None and not self.used_fallback):
+            self.outbuf.close()
+        self.outbuf = None
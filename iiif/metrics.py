@@ -0,0 +1,322 @@
+"""Metrics for IIIF image servers in the Prometheus text format.
+
+IIIFMetrics keeps counters, gauges and histograms in memory, safe for
+use from multiple threads, and renders them in the Prometheus text
+exposition format for a /metrics endpoint. Each series is identified
+by a metric name and a dict of labels.
+
+With several server processes (e.g. mod_wsgi daemon processes or
+gunicorn workers) each process has its own metrics. If a metrics
+directory shared by the processes is given then each process writes a
+snapshot of its metrics to its own file in that directory, at most
+every flush_interval seconds from a background thread, and render()
+aggregates the snapshots of all processes. Counters and histograms are
+summed over all files, including those of processes that have exited,
+so that they never go backwards. Gauges are summed over live processes
+only. The metrics of other processes may thus be up to flush_interval
+seconds out of date. Remove the files in the directory when the server
+is restarted.
+
+Counters may also be provided by collector functions, called whenever
+a snapshot is made, which return the cumulative values of counters
+maintained elsewhere such as cache statistics.
+"""
+
+import atexit
+import binascii
+import errno
+import json
+import os
+import os.path
+import re
+import tempfile
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0)
+
+# Type and help text for each metric
+METRICS = {
+    'iiif_requests_total': (
+        'counter', 'IIIF requests by prefix, type and status code.'),
+    'iiif_request_duration_seconds': (
+        'histogram', 'IIIF request latency by prefix and type.'),
+    'iiif_response_bytes_total': (
+        'counter', 'Bytes of IIIF response bodies by prefix and type.'),
+    'iiif_requests_in_flight': (
+        'gauge', 'IIIF requests in progress by prefix.'),
+    'iiif_stage_duration_seconds': (
+        'histogram', 'Duration of stages of image requests by manipulator and stage.'),
+    'iiif_derivative_cache_events_total': (
+        'counter', 'Derivative cache hits, misses, stores and evictions by prefix.'),
+    'iiif_image_cache_events_total': (
+        'counter', 'Decoded source image cache hits and misses.'),
+    'iiif_coalesced_requests_total': (
+        'counter', 'Image derivations (leaders) and requests sharing them (followers) by prefix.'),
+    'iiif_admission_events_total': (
+        'counter', 'Image requests admitted, queued and rejected by admission control.'),
+}
+
+
+def series_key(name, labels):
+    """Key for series of metric name with labels, as in the text format."""
+    if (not labels):
+        return name
+    return name + '{' + ','.join(
+        '%s="%s"' % (k, str(labels[k]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k in sorted(labels)) + '}'
+
+
+def format_value(value):
+    """Metric value in text format, integers without decimal point."""
+    if (value == int(value)):
+        return str(int(value))
+    return repr(float(value))
+
+
+class IIIFMetrics(object):
+    """Counters, gauges and histograms with optional multiprocess aggregation."""
+
+    def __init__(self, metrics_dir=None, flush_interval=1.0):
+        """Initialize IIIFMetrics object.
+
+        Keyword arguments:
+        metrics_dir -- directory shared by server processes to aggregate
+            their metrics, created if necessary (default None for
+            metrics of this process only)
+        flush_interval -- maximum interval in seconds between writes of
+            the metrics of this process to metrics_dir (default 1)
+        """
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self.collectors = []
+        self._lock = threading.Lock()
+        self._reset()
+        if (self.metrics_dir is not None):
+            if (not os.path.isdir(self.metrics_dir)):
+                try:
+                    os.makedirs(self.metrics_dir)
+                except OSError:
+                    # May have been created by another process
+                    pass
+            atexit.register(self.flush)
+
+    def _reset(self):
+        # Clear metrics and set up for writing as this process
+        self.pid = os.getpid()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.dirty = False
+        self._flusher = None
+        self._file = None
+        if (self.metrics_dir is not None):
+            # random part so that a reused pid does not overwrite the
+            # file of an earlier process
+            self._file = os.path.join(self.metrics_dir, 'metrics_%d_%s.json' %
+                                      (self.pid, binascii.hexlify(os.urandom(4)).decode('ascii')))
+
+    def _updating(self):
+        # Called with lock held before update, start flush thread in this
+        # process if necessary. After a fork the child starts with no
+        # metrics so that those of the parent are not counted twice
+        if (self.pid != os.getpid()):
+            self._reset()
+        self.dirty = True
+        if (self.metrics_dir is not None and self._flusher is None):
+            self._flusher = threading.Thread(target=self._flush_loop)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _flush_loop(self):
+        # Write metrics of this process when changed
+        while True:
+            time.sleep(self.flush_interval)
+            if (self.dirty):
+                self.flush()
+
+    def inc(self, name, labels=None, value=1):
+        """Increment counter name with labels by value."""
+        key = series_key(name, labels)
+        with self._lock:
+            self._updating()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def inc_gauge(self, name, labels=None, value=1):
+        """Increment (or decrement if value is negative) gauge name with labels."""
+        key = series_key(name, labels)
+        with self._lock:
+            self._updating()
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        """Add observation value to histogram name with labels.
+
+        The bucket boundaries must be the same for all observations
+        of a series.
+        """
+        key = series_key(name, labels)
+        with self._lock:
+            self._updating()
+            h = self.histograms.get(key)
+            if (h is None):
+                h = {'le': list(buckets), 'counts': [0] * len(buckets),
+                     'sum': 0.0, 'count': 0}
+                self.histograms[key] = h
+            for (j, le) in enumerate(h['le']):
+                if (value <= le):
+                    h['counts'][j] += 1
+            h['sum'] += value
+            h['count'] += 1
+
+    def add_collector(self, fn):
+        """Add collector function fn.
+
+        fn() must return a list of (name, labels, value) for counters
+        with cumulative values maintained outside this object.
+        """
+        self.collectors.append(fn)
+
+    def snapshot(self):
+        """Return dict with copies of metrics of this process, including collected counters."""
+        with self._lock:
+            if (self.pid != os.getpid()):
+                self._reset()
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = dict((key, {'le': h['le'], 'counts': list(h['counts']),
+                                     'sum': h['sum'], 'count': h['count']})
+                              for (key, h) in self.histograms.items())
+        for fn in self.collectors:
+            for (name, labels, value) in fn():
+                counters[series_key(name, labels)] = value
+        return {'pid': os.getpid(), 'counters': counters, 'gauges': gauges,
+                'histograms': histograms}
+
+    def flush(self):
+        """Write snapshot of metrics of this process to its file in metrics_dir."""
+        if (self.metrics_dir is None):
+            return
+        self.dirty = False
+        snapshot = self.snapshot()
+        tmpfile = None
+        try:
+            (fd, tmpfile) = tempfile.mkstemp(dir=self.metrics_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(snapshot, fh)
+            os.rename(tmpfile, self._file)
+        except (IOError, OSError):
+            # Directory may have been removed, try again next time
+            self.dirty = True
+            if (tmpfile is not None and os.path.exists(tmpfile)):
+                os.unlink(tmpfile)
+
+    def snapshots(self):
+        """List of snapshots of all processes.
+
+        Just the snapshot of this process if there is no metrics_dir,
+        otherwise this process is flushed and the snapshots of all
+        processes are read from metrics_dir. Gauges are removed from
+        the snapshots of processes that are no longer running.
+        """
+        if (self.metrics_dir is None):
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for filename in sorted(os.listdir(self.metrics_dir)):
+            if (not re.match(r'metrics_\d+_\w+\.json$', filename)):
+                continue
+            try:
+                with open(os.path.join(self.metrics_dir, filename), 'r') as fh:
+                    snapshot = json.load(fh)
+            except (IOError, OSError, ValueError):
+                continue
+            if (not self.process_alive(snapshot['pid'])):
+                snapshot['gauges'] = {}
+            snapshots.append(snapshot)
+        return snapshots
+
+    def process_alive(self, pid):
+        """Return True if process pid is running on this host."""
+        if (pid == os.getpid()):
+            return True
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            # EPERM means process exists but belongs to another user
+            return (e.errno == errno.EPERM)
+        return True
+
+    def aggregate(self):
+        """Return dict of metrics summed over the snapshots of all processes."""
+        total = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        for snapshot in self.snapshots():
+            for kind in ('counters', 'gauges'):
+                for (key, value) in snapshot[kind].items():
+                    total[kind][key] = total[kind].get(key, 0) + value
+            for (key, h) in snapshot['histograms'].items():
+                t = total['histograms'].get(key)
+                if (t is None):
+                    total['histograms'][key] = h
+                else:
+                    t['counts'] = [a + b for (a, b) in zip(t['counts'], h['counts'])]
+                    t['sum'] += h['sum']
+                    t['count'] += h['count']
+        return total
+
+    def render(self):
+        """Return aggregated metrics in Prometheus text exposition format."""
+        total = self.aggregate()
+        series = {}
+        for kind in ('counters', 'gauges'):
+            for (key, value) in total[kind].items():
+                series.setdefault(key.split('{')[0], []).append(
+                    '%s %s' % (key, format_value(value)))
+        for (key, h) in total['histograms'].items():
+            (name, brace, labels) = key.partition('{')
+            labels = labels.rstrip('}')
+            sep = ',' if labels else ''
+            lines = series.setdefault(name, [])
+            for (le, count) in zip(h['le'], h['counts']):
+                lines.append('%s_bucket{%s%sle="%s"} %d' %
+                             (name, labels, sep, format_value(le), count))
+            lines.append('%s_bucket{%s%sle="+Inf"} %d' % (name, labels, sep, h['count']))
+            suffix = ('{' + labels + '}') if labels else ''
+            lines.append('%s_sum%s %s' % (name, suffix, format_value(h['sum'])))
+            lines.append('%s_count%s %d' % (name, suffix, h['count']))
+        out = []
+        for name in sorted(series):
+            (kind, text) = METRICS.get(name, ('untyped', name))
+            out.append('# HELP %s %s' % (name, text))
+            out.append('# TYPE %s %s' % (name, kind))
+            out.extend(sorted(series[name]))
+        return '\n'.join(out) + '\n'
+
+    def request_started(self, prefix):
+        """Record start of request for prefix."""
+        self.inc_gauge('iiif_requests_in_flight', {'prefix': prefix})
+
+    def request_finished(self, prefix, request_type, code, nbytes, seconds):
+        """Record end of request_type ('info' or 'image') request for prefix.
+
+        Arguments:
+        prefix -- prefix of the handler
+        request_type -- 'info' or 'image'
+        code -- HTTP status code of response
+        nbytes -- number of bytes in response body
+        seconds -- time taken
+        """
+        self.inc_gauge('iiif_requests_in_flight', {'prefix': prefix}, -1)
+        labels = {'prefix': prefix, 'type': request_type}
+        self.inc('iiif_requests_total', dict(labels, code=code))
+        self.inc('iiif_response_bytes_total', labels, nbytes)
+        self.observe('iiif_request_duration_seconds', labels, seconds)
+
+    def observe_stages(self, klass_name, timings):
+        """Record stage timings of an image request, see IIIFHandler.timing_sink."""
+        for (stage, seconds) in timings:
+            self.observe('iiif_stage_duration_seconds',
+                         {'manipulator': klass_name, 'stage': stage}, seconds)
@@ -415,30 +415,32 @@ class IIIFRequest(object):
         self.size_caret = False
         self.size_full = False
         self.size_wh = (None, None)
-        if self.size.startswith('^'):
+        size = self.size
+        if (size is not None and size.startswith('^')):
             if self.api_version < '3.0':
                 raise IIIFRequestError(
                     code=400, parameter="size",
                     text="Use of caret (^) for upscaling is not supported before API version 3.0")
             # as caret can be used with any combination of features
-            # set caret to true and then remove it to catch further processing
+            # set caret to true and then remove it for further processing,
+            # self.size is left unchanged so that url() is correct
             self.size_caret = True
-            self.size = self.size[1:]
-        if (self.size is None or self.size == 'full' and self.api_version < '3.0'):
+            size = size[1:]
+        if (size is None or size == 'full' and self.api_version < '3.0'):
             self.size_full = True
             return
-        elif (self.size == 'max' and self.api_version >= '2.1'):
+        elif (size == 'max' and self.api_version >= '2.1'):
             self.size_max = True
             return
-        elif (self.size == 'max' and self.api_version < '2.1'):
+        elif (size == 'max' and self.api_version < '2.1'):
             raise IIIFRequestError(
                 code=400, parameter="size",
                 text="Size value max is not valid with API versions before 2.1")
-        elif (self.size == 'full' and self.api_version > '2.1'):
+        elif (size == 'full' and self.api_version > '2.1'):
             raise IIIFRequestError(
                 code=400, parameter="size",
                 text="Size value full is not valid with API versions after 2.1")
-        pct_match = re.match('pct:(.*)$', self.size)
+        pct_match = re.match('pct:(.*)$', size)
         if (pct_match is not None):
             pct_str = pct_match.group(1)
             try:
@@ -456,9 +458,9 @@ class IIIFRequest(object):
                     text="Base size percentage, must be > 0.0, got %f." %
                     (self.size_pct))
         else:
-            if (self.size[0] == '!'):
+            if (size[0] == '!'):
                 # Have "!w,h" form
-                size_no_bang = self.size[1:]
+                size_no_bang = size[1:]
                 (mw, mh) = self._parse_w_comma_h(size_no_bang, 'size')
                 if (mw is None or mh is None):
                     raise IIIFRequestError(
@@ -469,7 +471,7 @@ class IIIFRequest(object):
                 self.size_bang = True
             else:
                 # Must now be "w,h", "w," or ",h"
-                self.size_wh = self._parse_w_comma_h(self.size, 'size')
+                self.size_wh = self._parse_w_comma_h(size, 'size')
             # Sanity check w,h
             (w, h) = self.size_wh
             if ((w is not None and w <= 0) or
@@ -529,18 +531,20 @@ class IIIFRequest(object):
         self.rotation_mirror = False
         if (self.rotation is None):
             return
-        # Look for ! prefix first
-        if (self.rotation[0] == '!'):
+        # Look for ! prefix first, self.rotation is left unchanged
+        # so that url() is correct
+        rotation = self.rotation
+        if (rotation[0] == '!'):
             self.rotation_mirror = True
-            self.rotation = self.rotation[1:]
+            rotation = rotation[1:]
         # Interpret value now
         try:
-            self.rotation_deg = float(self.rotation)
+            self.rotation_deg = float(rotation)
         except ValueError:
             raise IIIFRequestError(
                 code=400, parameter="rotation",
                 text="Bad rotation value, must be a number, got '%s'." %
-                (self.rotation))
+                (rotation))
         if (self.rotation_deg < 0.0 or self.rotation_deg > 360.0):
             raise IIIFRequestError(
                 code=400, parameter="rotation",
@@ -581,6 +585,63 @@ class IIIFRequest(object):
                 parameter='format',
                 text='Bad format parameter')
 
+    def canonicalize(self, width, height):
+        """Change this request to the canonical form for the given image size.
+
+        Equivalent requests such as full/full/0/default.jpg,
+        0,0,W,H/full/360/default.jpg and pct:0,0,100,100/pct:100/0/default.jpg
+        are all changed to the same canonical form following the
+        Image API canonical URI syntax, with region and size in
+        pixels calculated in the same way as IIIFManipulator
+        region_to_apply() and size_to_apply(). Assumes that there are
+        no limits on image size so that max is the full image size.
+
+          region -- full or x,y,w,h
+          size -- full or w, (or w,h if the aspect ratio is changed)
+                  before version 3.0, max or w,h (or ^w,h if the
+                  image is scaled up) for 3.0
+          rotation -- mirror ! and angle without trailing zeros
+          quality -- default quality if not specified
+
+        The request must already have been parsed. Will raise an
+        IIIFError if the request is not valid for the image size.
+
+        Returns self so that calls may be chained, e.g.
+        r.canonicalize(w, h).url()
+        """
+        # Import here to avoid circular import
+        from .manipulator import IIIFManipulator
+        m = IIIFManipulator(api_version=self.api_version)
+        m.request = self
+        (m.width, m.height) = (width, height)
+        (x, y, w, h) = m.region_to_apply()
+        if (x is None):
+            region = 'full'
+        else:
+            (x, y) = (int(x), int(y))
+            region = "%d,%d,%d,%d" % (x, y, w, h)
+            (m.width, m.height) = (w, h)
+        (sw, sh) = m.size_to_apply()
+        if (sw is None):
+            size = ('max' if (self.api_version >= '3.0') else 'full')
+        elif (self.api_version >= '3.0'):
+            size = "%d,%d" % (sw, sh)
+            if (sw > m.width or sh > m.height):
+                size = '^' + size
+        elif (int(m.height * sw / float(m.width) + 0.5) == sh):
+            size = "%d," % (sw)
+        else:
+            size = "%d,%d" % (sw, sh)
+        rotation = ("%f" % (self.rotation_deg)).rstrip('0').rstrip('.')
+        if (self.rotation_mirror):
+            rotation = '!' + rotation
+        self.region = region
+        self.size = size
+        self.rotation = rotation
+        self.quality = (self.quality if self.quality else self.default_quality)
+        self.parse_parameters()
+        return(self)
+
     def is_scaled_full_image(self):
         """True if this request is for a scaled full image.
 
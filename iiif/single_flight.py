@@ -0,0 +1,146 @@
+"""Coalescing of concurrent identical computations.
+
+When many viewers open a popular image at the same time, the server
+receives many concurrent requests for the same low resolution tiles.
+IIIFSingleFlight runs one computation for each key at a time: the
+first caller for a key (the leader) runs it, and callers with the same
+key that arrive while it is in flight wait for it to finish and share
+its result (or exception) instead of repeating the work.
+
+Coalescing is within one process. If a lock directory is given then the
+leader also takes an exclusive lock on a lock file for the key in that
+directory, so that leaders in different processes for the same key run
+one at a time. This is useful with a derivative cache shared by the
+processes: a process that waited for the lock will usually find the
+result in the cache. Lock files are removed when released, and locks
+are released by the operating system if a process exits. Locks are
+only available where fcntl is, otherwise just in-process coalescing is
+done.
+"""
+
+import hashlib
+import os
+import os.path
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class _Call(object):
+    # One in-flight computation and its outcome
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class IIIFSingleFlight(object):
+    """Run one computation at a time for each key, sharing results."""
+
+    def __init__(self, lock_dir=None):
+        """Initialize IIIFSingleFlight object.
+
+        Keyword arguments:
+        lock_dir -- directory for lock files to coalesce across
+            processes, created if necessary (default None for
+            in-process only)
+        """
+        self.lock_dir = lock_dir
+        self.leaders = 0
+        self.followers = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        if (self.lock_dir is not None and not os.path.isdir(self.lock_dir)):
+            try:
+                os.makedirs(self.lock_dir)
+            except OSError:
+                # May have been created by another process
+                pass
+
+    @property
+    def locking(self):
+        """True if lock files are used to coalesce across processes."""
+        return (self.lock_dir is not None and fcntl is not None)
+
+    def do(self, key, fn):
+        """Return result of fn(), shared with concurrent calls with key.
+
+        If a call with the same key is in flight then wait for it and
+        return its result, or raise its exception. Otherwise call fn
+        (with the lock file for key held if self.locking).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = (call is None)
+            if (leader):
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if (not leader):
+            call.done.wait()
+            if (call.error is not None):
+                raise call.error
+            return call.result
+        try:
+            if (self.locking):
+                lock = self.acquire(key)
+                try:
+                    call.result = fn()
+                finally:
+                    self.release(lock)
+            else:
+                call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def lock_path(self, key):
+        """Path of lock file for key."""
+        name = hashlib.sha1(str(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.lock_dir, name + '.lock')
+
+    def acquire(self, key):
+        """Take exclusive lock on lock file for key, return (fd, path).
+
+        Blocks until the lock is available. The lock file may be
+        removed by the holder as it releases the lock, so after
+        getting the lock check that the file is still the one at the
+        path and retry if not.
+        """
+        path = self.lock_path(key)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if (os.fstat(fd).st_ino == os.stat(path).st_ino):
+                    return (fd, path)
+            except OSError:
+                pass
+            os.close(fd)
+
+    def release(self, lock):
+        """Remove lock file and release lock from acquire()."""
+        (fd, path) = lock
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def stats(self):
+        """Return dict of counts of leader and follower calls."""
+        with self._lock:
+            return {'leaders': self.leaders, 'followers': self.followers,
+                    'in_flight': len(self._calls)}
@@ -4,20 +4,117 @@ Use IIIF Image API manipulations to generate a set of tiles for
 a level0 implementation of the IIIF Image API using static files.
 """
 
+import copy
+import hashlib
 import math
 import logging
+import multiprocessing
 import os
 import os.path
 import shutil
 from string import Template
 
+from PIL import Image
+
+try:
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+except ImportError:  # pragma: no cover
+    ProcessPoolExecutor = None
+
+from .image_cache import IIIFImageCache, image_bytes
 from .manipulator_pil import IIIFManipulatorPIL
 from .manipulator_gen import IIIFManipulatorGen
+from .static_manifest import IIIFStaticManifest, file_sha1
+from .static_pack import IIIFStaticPack
 from .info import IIIFInfo
 from .request import IIIFRequest
 from .error import IIIFZeroSizeError
 
 
+# Extensions of image files included from directories in batch mode
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+# IIIFStatic object used to generate files in worker processes, set
+# before the workers are forked, see IIIFStatic.executor()
+_worker_static = None
+
+
+def _init_worker():
+    # Worker processes do not themselves start pools for generators
+    if ('workers' in _worker_static.manipulator_args):
+        _worker_static.manipulator_args['workers'] = 0
+    IIIFManipulatorGen._executor = None
+
+
+def _generate_files(files):
+    # Generate files for list of (request, undistorted) in worker process
+    return [_worker_static.generate_file(r, undistorted) for (r, undistorted) in files]
+
+
+def _generate_image(src, identifier):
+    # Generate files for one image in worker process, the worker uses
+    # its copy of the IIIFStatic object to generate tiles serially
+    _worker_static.jobs = 0
+    return _worker_static.generate_image(src, identifier)
+
+
+def static_dir_sources(src_dir, extensions=SOURCE_EXTENSIONS):
+    """Generate (path, identifier) for image files under src_dir.
+
+    Walks the directory tree in sorted order and includes files with
+    any of the extensions (case insensitive). Identifiers are derived
+    from the path relative to src_dir without extension, with directory
+    separators replaced by underscores so that each identifier is a
+    single directory in the output.
+    """
+    for (dirpath, dirnames, filenames) in os.walk(src_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            (name, ext) = os.path.splitext(filename)
+            if (ext.lower() not in extensions):
+                continue
+            relpath = os.path.relpath(os.path.join(dirpath, name), src_dir)
+            yield (os.path.join(dirpath, filename),
+                   '_'.join(relpath.split(os.sep)))
+
+
+def static_list_sources(list_file, extensions=SOURCE_EXTENSIONS):
+    """Generate (path, identifier) for image files listed in list_file.
+
+    The list file has one image file or directory per line, blank lines
+    and lines starting with # are ignored. Relative paths are relative
+    to the directory of the list file. Directories are expanded with
+    static_dir_sources(), the identifier for an image file is the file
+    name without extension.
+    """
+    base_dir = os.path.dirname(os.path.abspath(list_file))
+    with open(list_file, 'r') as fh:
+        for line in fh:
+            path = line.strip()
+            if (path == '' or path.startswith('#')):
+                continue
+            path = os.path.join(base_dir, path)
+            if (os.path.isdir(path)):
+                for source in static_dir_sources(path, extensions):
+                    yield source
+            else:
+                yield (path, os.path.splitext(os.path.basename(path))[0])
+
+
+def halve_image(image):
+    """Return image reduced to half size by averaging 2x2 blocks.
+
+    The size of the new image is rounded up so that it covers all of
+    image. Uses Image.reduce() if available (Pillow 7 and later), else
+    a resize with a box filter.
+    """
+    try:
+        return image.reduce(2)
+    except (AttributeError, ValueError):
+        (width, height) = image.size
+        return image.resize(((width + 1) // 2, (height + 1) // 2), Image.BOX)
+
+
 def static_partial_tile_sizes(width, height, tilesize, scale_factors):
     """Generator for partial tile sizes for zoomed in views.
 
@@ -110,6 +207,16 @@ class IIIFStatic(object):
         sg.generate("image2.jpg")
         sg.generate("image3.jpg")
 
+    A manifest.json file is written alongside info.json for each image,
+    see IIIFStaticManifest. If generate() is run again for the same
+    image then files that the manifest shows are up to date are not
+    generated again, this also allows an interrupted run to be resumed.
+
+    If a pack file is specified then the image files and info.json are
+    added to that pack file instead of being written as separate files,
+    with links in place of the symlinks, see IIIFStaticPack. Call close()
+    when done to write the pack index.
+
     The class is quite noisy at level logging.INFO, set the logging
     level to logging.WARNING to get log output only when there are
     warnings or errors.
@@ -118,7 +225,8 @@ class IIIFStatic(object):
     def __init__(self, src=None, dst=None, tilesize=None,
                  api_version='2.0', dryrun=None, prefix='',
                  osd_version=None, generator=False,
-                 max_image_pixels=0, extras=[]):
+                 max_image_pixels=0, extras=[], generator_workers=0, jobs=0,
+                 force=False, pack=None):
         """Initialization for IIIFStatic instances.
 
         All keyword arguments are optional:
@@ -130,6 +238,14 @@ class IIIFStatic(object):
         prefix -- identifier prefix
         osd_version -- use a specific version of OpenSeadragon
         extras -- extras request parameters to generate for
+        generator_workers -- number of worker processes used to generate
+            each image if generator is set (default 0 for none)
+        jobs -- number of worker processes used to generate the files
+            for each image (default 0 to generate them in this process)
+        force -- True to generate all files even if the manifest shows
+            that they are up to date (default False)
+        pack -- pack file to write image files and info.json to instead
+            of writing separate files, see IIIFStaticPack
         """
         self.src = src
         self.dst = dst
@@ -145,9 +261,15 @@ class IIIFStatic(object):
         self.osd_version = osd_version if osd_version else '2.0.0'
         if (generator):
             self.manipulator_klass = IIIFManipulatorGen
+            self.manipulator_args = {'workers': generator_workers}
         else:
             self.manipulator_klass = IIIFManipulatorPIL
+            self.manipulator_args = {}
         self.max_image_pixels = max_image_pixels
+        self.jobs = jobs
+        self.force = force
+        self.pack = IIIFStaticPack(pack) if (pack and not self.dryrun) else None
+        self.manifest_interval = 100
         # parse values in extras before adding to list, remove any leading /
         # if present on extras values
         self.extras = []
@@ -185,6 +307,11 @@ class IIIFStatic(object):
         }
         # used internally:
         self.identifier = None
+        self.image_cache = None
+        self.manifest = None
+        self.files_written = 0
+        self.files_skipped = 0
+        self.bytes_written = 0
         self.copied_osd = False
         self.template_dir = os.path.join(self.module_dir, 'templates')
 
@@ -225,20 +352,59 @@ class IIIFStatic(object):
         scale_factors = im.scale_factors(self.tilesize)
         # Setup destination and IIIF identifier
         self.setup_destination()
-        # Write out images
+        # List all files to write
+        files = []
         for (region, size) in static_partial_tile_sizes(width, height, self.tilesize, scale_factors):
-            self.generate_tile(region, size)
+            files.append((self.tile_request(region, size), True))
         sizes = []
         for size in static_full_sizes(width, height, self.tilesize):
             # See https://github.com/zimeon/iiif/issues/9
             sizes.append({'width': size[0], 'height': size[1]})
-            self.generate_tile('full', size)
+            files.append((self.tile_request('full', size), True))
         for request in self.extras:
             request.identifier = self.identifier
             if (request.is_scaled_full_image()):
                 sizes.append({'width': request.size_wh[0],
                               'height': request.size_wh[1]})
-            self.generate_file(request)
+            files.append((request, False))
+        # Skip files that the manifest shows are already up to date
+        paths = [self.file_path(r, undistorted) for (r, undistorted) in files]
+        if (not self.dryrun):
+            self.manifest = self.load_manifest()
+            todo = []
+            for (path, f) in zip(paths, files):
+                if (not self.force and self.manifest.is_current(path, self.dst, self.pack)):
+                    self.files_skipped += 1
+                else:
+                    todo.append(f)
+            if (len(todo) < len(files)):
+                self.logger.info("%d files up to date in manifest, skipped" %
+                                 (len(files) - len(todo)))
+            files = todo
+        try:
+            # Decode source image just once, all files are derived from it
+            # or from the levels made by successive halving for each scale
+            # factor which the manipulators will find in self.image_cache
+            if (files and not self.dryrun and
+                    self.manipulator_klass is IIIFManipulatorPIL):
+                im.image.load()
+                self.image_cache = IIIFImageCache(max_bytes=2 * image_bytes(im.image))
+                self.image_cache.put(self.image_cache.key(self.src), im.image)
+                level = im.image
+                for sf in scale_factors[1:]:
+                    level = halve_image(level)
+                    self.image_cache.put(self.image_cache.key(self.src, sf), level)
+            self.generate_files(files)
+            if (self.manifest is not None):
+                self.manifest.prune(paths)
+        finally:
+            self.image_cache = None
+            im.cleanup()
+            # Save manifest even if interrupted so that files written
+            # so far will not be generated again
+            if (self.manifest is not None):
+                self.manifest.save()
+                self.manifest = None
         # Write info.json
         qualities = ['default'] if (self.api_version > '1.1') else ['native']
         info = IIIFInfo(level=0, server_and_prefix=self.prefix, identifier=self.identifier,
@@ -252,6 +418,10 @@ class IIIFStatic(object):
                 "dryrun mode, would write the following files:")
             self.logger.warning("%s / %s/%s" %
                                 (self.dst, self.identifier, 'info.json'))
+        elif (self.pack is not None):
+            self.pack.add(self.identifier + '/info.json', info.as_json().encode('utf-8'))
+            self.logger.info("%s : %s/%s" %
+                             (self.pack.pack_file, self.identifier, 'info.json'))
         else:
             with open(json_file, 'w') as f:
                 f.write(info.as_json())
@@ -260,8 +430,182 @@ class IIIFStatic(object):
                              (self.dst, self.identifier, 'info.json'))
             self.logger.debug("Written %s" % (json_file))
 
-    def generate_tile(self, region, size):
-        """Generate one tile for this given region, size of this image."""
+    def close(self):
+        """Close pack file and write its index, if writing to a pack file."""
+        if (self.pack is not None):
+            self.pack.close()
+
+    def generate_batch(self, sources, html_args=None):
+        """Generate static files for each image in sources.
+
+        Sources is an iterable of (path, identifier) pairs, such as from
+        static_dir_sources() or static_list_sources(). If self.jobs is
+        greater than 1 then up to that many images are generated at once
+        by worker processes, see executor(), each generating the tiles of
+        one image in turn. No more than twice that many images are queued
+        for the workers so that sources may be a generator for a very
+        large number of images. Images with an identifier that has
+        already been used are skipped. Failure to generate one image
+        does not stop the others. If html_args is not None then it is
+        the dict of keyword arguments for write_html() which is called
+        for each image generated.
+
+        Returns a dict with the counts of 'images' generated and
+        'failed', and a list of (path, identifier, message) 'errors'.
+        """
+        summary = {'images': 0, 'failed': 0, 'errors': []}
+        identifiers = set()
+
+        def done(src, identifier, result):
+            # Add result from generate_image() to summary
+            (written, skipped, nbytes, error) = result
+            if (error is None):
+                summary['images'] += 1
+                if (html_args is not None):
+                    self.identifier = identifier
+                    self.write_html(**html_args)
+            else:
+                self.logger.warning("Failed to generate %s from %s: %s" %
+                                    (identifier, src, error))
+                summary['failed'] += 1
+                summary['errors'].append((src, identifier, error))
+
+        executor = self.executor()
+        pending = {}
+        for (src, identifier) in sources:
+            if (identifier in identifiers):
+                self.logger.warning("Ignoring source '%s': identifier %s already used" %
+                                    (src, identifier))
+                continue
+            identifiers.add(identifier)
+            if (executor is None):
+                done(src, identifier, self.generate_image(src, identifier))
+                continue
+            pending[executor.submit(_generate_image, src, identifier)] = (src, identifier)
+            while (len(pending) >= 2 * self.jobs):
+                self.batch_done(pending, wait(pending, return_when=FIRST_COMPLETED)[0], done)
+        if (executor is not None):
+            self.batch_done(pending, list(pending.keys()), done)
+            executor.shutdown()
+            global _worker_static
+            _worker_static = None
+        return summary
+
+    def batch_done(self, pending, futures, done):
+        """Handle completed futures from generate_batch() worker processes.
+
+        Adds the counts of files from each to those of this object, and
+        passes the (written, skipped, bytes, error) result to done.
+        """
+        for future in futures:
+            (src, identifier) = pending.pop(future)
+            result = future.result()
+            self.files_written += result[0]
+            self.files_skipped += result[1]
+            self.bytes_written += result[2]
+            done(src, identifier, result)
+
+    def generate_image(self, src, identifier):
+        """Generate static files for one image with error handling.
+
+        Returns (written, skipped, bytes, error) where written and skipped
+        are the numbers of files written and up to date, bytes is the
+        number of bytes written, and error is None on success or else
+        the error message.
+        """
+        before = (self.files_written, self.files_skipped, self.bytes_written)
+        error = None
+        try:
+            self.generate(src, identifier=identifier)
+        except Exception as e:
+            error = str(e)
+        return (self.files_written - before[0], self.files_skipped - before[1],
+                self.bytes_written - before[2], error)
+
+    def generate_files(self, files):
+        """Generate files for list of (request, undistorted) pairs.
+
+        If self.jobs is greater than 1 then the files are generated by
+        a pool of worker processes, see executor(). Adds to the counts
+        in self.files_written and self.bytes_written, and records the
+        files written in self.manifest if there is one.
+        """
+        executor = self.executor()
+        if (executor is None):
+            for (r, undistorted) in files:
+                self.file_written(self.generate_file(r, undistorted))
+        else:
+            # Give each worker several chunks so that they finish together
+            n = max(1, len(files) // (self.jobs * 4))
+            chunks = [files[j:j + n] for j in range(0, len(files), n)]
+            global _worker_static
+            with executor:
+                for chunk_results in executor.map(_generate_files, chunks):
+                    for result in chunk_results:
+                        self.file_written(result)
+            _worker_static = None
+
+    def file_written(self, result):
+        """Record result (path, size, sha1, mtime, offset) from generate_file().
+
+        The manifest is saved every self.manifest_interval files so
+        that an interrupted run can be resumed.
+        """
+        if (result is None):
+            return
+        (path, size, sha1, mtime, offset) = result
+        self.files_written += 1
+        self.bytes_written += size
+        if (self.manifest is not None):
+            self.manifest.add(path, size, sha1, mtime, offset)
+            if (self.files_written % self.manifest_interval == 0):
+                self.manifest.save()
+
+    def load_manifest(self):
+        """Load manifest for current image and set generation parameters.
+
+        Files recorded in the manifest are forgotten if any of the
+        parameters that affect them has changed since the manifest was
+        written.
+
+        Returns IIIFStaticManifest object.
+        """
+        manifest = IIIFStaticManifest(
+            os.path.join(self.dst, self.identifier, 'manifest.json'))
+        if (self.manipulator_klass is IIIFManipulatorGen):
+            source = {'generator': self.src}
+        else:
+            source = manifest.source_info(self.src)
+        params = {'source': source,
+                  'tilesize': self.tilesize,
+                  'api_version': self.api_version,
+                  'osd_version': self.osd_version,
+                  'manipulator': self.manipulator_klass.__name__}
+        if (not manifest.set_params(params)):
+            self.logger.debug("Manifest parameters changed, all files will be generated")
+        return manifest
+
+    def executor(self):
+        """Return process pool executor for self.jobs workers, or None.
+
+        The workers are forked from this process after the source image
+        has been decoded so that they share the decoded image and levels
+        in self.image_cache, and use this IIIFStatic object to generate
+        files. Returns None, for files to be generated in this process,
+        if self.jobs is not greater than 1, in dryrun mode, or if the
+        fork start method is not available.
+        """
+        if (self.jobs <= 1 or self.dryrun or ProcessPoolExecutor is None or
+                'fork' not in multiprocessing.get_all_start_methods()):
+            return None
+        global _worker_static
+        _worker_static = self
+        return ProcessPoolExecutor(max_workers=self.jobs,
+                                   mp_context=multiprocessing.get_context('fork'),
+                                   initializer=_init_worker)
+
+    def tile_request(self, region, size):
+        """Return IIIFRequest object for one tile with region and size of this image."""
         r = IIIFRequest(identifier=self.identifier,
                         api_version=self.api_version)
         if (region == 'full'):
@@ -270,7 +614,22 @@ class IIIFStatic(object):
             r.region_xywh = region  # [rx,ry,rw,rh]
         r.size_wh = size  # [sw,sh]
         r.format = 'jpg'
-        self.generate_file(r, True)
+        return r
+
+    def generate_tile(self, region, size):
+        """Generate one tile for this given region, size of this image."""
+        return self.generate_file(self.tile_request(region, size), True)
+
+    def file_path(self, r, undistorted=False):
+        """Path relative to self.dst of the file for request r.
+
+        Uses the same form of the size parameter for undistorted images
+        as generate_file(), without changing r.
+        """
+        if (undistorted and self.get_osd_config(self.osd_version)['use_canonical']):
+            r = copy.copy(r)
+            r.size_wh = [r.size_wh[0], None]
+        return r.url()
 
     def generate_file(self, r, undistorted=False):
         """Generate file for IIIFRequest object r from this image.
@@ -284,6 +643,12 @@ class IIIFStatic(object):
         the new canonical form even in the case where the API version is declared
         earlier. Thus, determine whether to use the canonical or `w,h` form based
         solely on the setting of osd_version.
+
+        Returns (path, size, sha1, mtime, offset) for the file written,
+        where mtime is the modification time of a file written under
+        self.dst and offset is the offset of the data of a file written
+        to self.pack (the other being None), or None if no file was
+        written.
         """
         use_canonical = self.get_osd_config(self.osd_version)['use_canonical']
         height = None
@@ -291,19 +656,35 @@ class IIIFStatic(object):
             height = r.size_wh[1]
             r.size_wh = [r.size_wh[0], None]  # [sw,sh] -> [sw,]
         path = r.url()
+        result = None
         # Generate...
         if (self.dryrun):
             self.logger.info("%s / %s" % (self.dst, path))
         else:
-            m = self.manipulator_klass(api_version=self.api_version)
+            m = self.manipulator_klass(api_version=self.api_version,
+                                       in_memory=(self.pack is not None),
+                                       **self.manipulator_args)
+            if (self.image_cache is not None):
+                m.image_cache = self.image_cache
             try:
-                m.derive(srcfile=self.src, request=r,
-                         outfile=os.path.join(self.dst, path))
-                self.logger.info("%s / %s" % (self.dst, path))
+                if (self.pack is None):
+                    outfile = os.path.join(self.dst, path)
+                    m.derive(srcfile=self.src, request=r, outfile=outfile)
+                    st = os.stat(outfile)
+                    result = (path, st.st_size, file_sha1(outfile), st.st_mtime, None)
+                    self.logger.info("%s / %s" % (self.dst, path))
+                else:
+                    (outbuf, mime_type) = m.derive(srcfile=self.src, request=r)
+                    data = outbuf.getvalue()
+                    m.cleanup()
+                    self.pack.add(path, data)
+                    result = (path, len(data), hashlib.sha1(data).hexdigest(),
+                              None, self.pack.index[path][0])
+                    self.logger.info("%s : %s" % (self.pack.pack_file, path))
             except IIIFZeroSizeError:
                 self.logger.info("%s / %s - zero size, skipped" %
                                  (self.dst, path))
-                return  # done if zero size
+                return None  # done if zero size
         if (r.region_full and use_canonical and height is not None):
             # In v2.0 of the spec, the canonical URI form `w,` for scaled
             # images of the full region was introduced. This is somewhat at
@@ -321,12 +702,15 @@ class IIIFStatic(object):
             wh_path = os.path.join(region_dir, wh_dir)
             wc_dir = "%d," % (r.size_wh[0])
             wc_path = os.path.join(region_dir, wc_dir)
-            if (not self.dryrun):
+            if (self.pack is not None):
+                self.pack.add_link(wh_path + path[len(wc_path):], path)
+            elif (not self.dryrun):
                 ln = os.path.join(self.dst, wh_path)
                 if (os.path.exists(ln)):
                     os.remove(ln)
                 os.symlink(wc_dir, ln)
             self.logger.info("%s / %s -> %s" % (self.dst, wh_path, wc_path))
+        return result
 
     def setup_destination(self):
         """Setup output directory based on self.dst and self.identifier.
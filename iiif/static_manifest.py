@@ -0,0 +1,167 @@
+"""Manifest of files generated by IIIFStatic.
+
+Records the parameters used to generate the static files for one image
+(source file details and checksum, tile size, API version, OpenSeadragon
+version and manipulator) along with the size, SHA1 checksum and
+modification time (or offset in a pack file) of each file written. When
+generation is repeated with the same parameters, files that are
+recorded in the manifest and still exist unchanged need not be
+generated again. A file is checksummed only if its size matches but its
+modification time or offset does not. The manifest is saved periodically during
+generation so that an interrupted run can be resumed.
+
+The manifest is stored as a JSON file which is written atomically so
+that a partial manifest is never seen.
+"""
+
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+
+
+def file_sha1(path):
+    """Hex SHA1 checksum of the contents of file at path."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class IIIFStaticManifest(object):
+    """Manifest of static files generated for one image."""
+
+    def __init__(self, manifest_file):
+        """Initialize IIIFStaticManifest object.
+
+        Arguments:
+        manifest_file -- JSON file to load manifest from, if it exists,
+            and save it to
+        """
+        self.manifest_file = manifest_file
+        self.params = None
+        self.files = {}
+        if (os.path.isfile(self.manifest_file)):
+            self.load()
+
+    def load(self):
+        """Load manifest from self.manifest_file.
+
+        A manifest that cannot be read is ignored, all files will then
+        be considered to need generating.
+        """
+        try:
+            with open(self.manifest_file, 'r') as fh:
+                data = json.load(fh)
+            (self.params, self.files) = (data['params'], data['files'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            (self.params, self.files) = (None, {})
+
+    def save(self):
+        """Save manifest to self.manifest_file.
+
+        Writes to a temporary file in the same directory which is then
+        renamed so that readers never see a partial manifest.
+        """
+        data = json.dumps({'params': self.params, 'files': self.files},
+                          indent=1, sort_keys=True)
+        dirname = os.path.dirname(os.path.abspath(self.manifest_file))
+        (fd, tmpfile) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(data)
+            os.rename(tmpfile, self.manifest_file)
+        except Exception:
+            os.unlink(tmpfile)
+            raise
+
+    def source_info(self, srcfile):
+        """Return dict of path, modification time, size and SHA1 checksum of srcfile.
+
+        The checksum recorded in the manifest is reused if the path,
+        modification time and size are the same as recorded, so that
+        an unchanged source file need not be read.
+        """
+        st = os.stat(srcfile)
+        info = {'path': os.path.abspath(srcfile),
+                'mtime': st.st_mtime,
+                'size': st.st_size}
+        old = (self.params or {}).get('source') or {}
+        if (all(old.get(k) == info[k] for k in ('path', 'mtime', 'size'))):
+            info['sha1'] = old.get('sha1')
+        else:
+            info['sha1'] = file_sha1(srcfile)
+        return info
+
+    def set_params(self, params):
+        """Set generation parameters, forgetting files if they changed.
+
+        Returns True if the parameters are the same as those recorded,
+        False otherwise.
+        """
+        if (params == self.params):
+            return True
+        self.params = params
+        self.files = {}
+        return False
+
+    def is_current(self, path, dst, pack=None):
+        """Return True if file path under dst is recorded and unchanged.
+
+        The file must exist with the size recorded in the manifest. It
+        is then current if the modification time is also as recorded,
+        otherwise the SHA1 checksum must match and the new modification
+        time is recorded. If pack is set then the file is looked for in
+        that IIIFStaticPack instead of under dst, and the offset of the
+        data in the pack is used in place of the modification time.
+        """
+        entry = self.files.get(path)
+        if (entry is None):
+            return False
+        if (pack is not None):
+            location = pack.index.get(path)
+            if (location is None or location[1] != entry['size']):
+                return False
+            if (location[0] == entry.get('offset')):
+                return True
+            data = pack.get(path)
+            if (hashlib.sha1(data).hexdigest() != entry['sha1']):
+                return False
+            entry['offset'] = location[0]
+            return True
+        filename = os.path.join(dst, path)
+        try:
+            st = os.stat(filename)
+            if (st.st_size != entry['size']):
+                return False
+            if (st.st_mtime == entry.get('mtime')):
+                return True
+            if (file_sha1(filename) != entry['sha1']):
+                return False
+        except (IOError, OSError):
+            return False
+        entry['mtime'] = st.st_mtime
+        return True
+
+    def add(self, path, size, sha1, mtime=None, offset=None):
+        """Record file path with size and SHA1 checksum.
+
+        Keyword arguments:
+        mtime -- modification time of file written under dst
+        offset -- offset of data of file written to a pack
+        """
+        entry = {'size': size, 'sha1': sha1}
+        if (mtime is not None):
+            entry['mtime'] = mtime
+        if (offset is not None):
+            entry['offset'] = offset
+        self.files[path] = entry
+
+    def prune(self, paths):
+        """Remove entries for files not in paths."""
+        paths = set(paths)
+        for path in list(self.files.keys()):
+            if (path not in paths):
+                del self.files[path]
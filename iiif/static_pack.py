@@ -0,0 +1,238 @@
+"""Single file pack archive of static IIIF files.
+
+Instead of writing one file per tile, IIIFStatic may write all the files
+for an image, or for a whole collection, into one pack file. The pack
+file is append-only and is a sequence of records each of which is:
+
+    magic     4 bytes  b'IIPK'
+    type      1 byte   b'F' for file data, b'L' for a link
+    path_len  2 bytes  unsigned big-endian length of path
+    data_len  8 bytes  unsigned big-endian length of data
+    path      path_len bytes of UTF-8 encoded IIIF path
+    data      data_len bytes of file data, or the UTF-8 encoded
+              path of the target for a link
+
+A later record for the same path replaces an earlier one. Records are
+appended under an exclusive lock on the pack file (where fcntl is
+available) so that several worker processes may write to the same pack.
+
+The index from each path to the offset and length of its data is
+written as JSON to a separate index file (the pack file name plus
+'.idx') when the writer is closed. The index records the size of the
+pack file it describes, if the index is missing or does not match then
+the reader rebuilds it by scanning the record headers. The reader maps
+the pack file into memory with mmap so that files are served without
+any per-file filesystem operations.
+"""
+
+import json
+import mmap
+import os
+import os.path
+import struct
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+PACK_MAGIC = b'IIPK'
+PACK_HEADER = struct.Struct('>4scHQ')
+
+
+class IIIFStaticPackError(Exception):
+    """Error reading pack file."""
+
+    pass
+
+
+def scan_pack(fh):
+    """Build index for the pack file open as fh.
+
+    Reads just the record headers and paths, seeking over the data.
+    Links are resolved to the data of their targets, links to paths
+    that are not in the pack are ignored.
+
+    Returns (index, end) where index is a dict mapping each path to
+    (offset, length) of its data, and end is the offset of the end of
+    the last complete record.
+    """
+    index = {}
+    links = {}
+    fh.seek(0, os.SEEK_END)
+    size = fh.tell()
+    offset = 0
+    while (offset + PACK_HEADER.size <= size):
+        fh.seek(offset)
+        (magic, rtype, path_len, data_len) = PACK_HEADER.unpack(fh.read(PACK_HEADER.size))
+        if (magic != PACK_MAGIC):
+            raise IIIFStaticPackError("Bad record at offset %d" % (offset))
+        data_offset = offset + PACK_HEADER.size + path_len
+        if (data_offset + data_len > size):
+            # Incomplete last record
+            break
+        path = fh.read(path_len).decode('utf-8')
+        if (rtype == b'L'):
+            links[path] = fh.read(data_len).decode('utf-8')
+            index.pop(path, None)
+        else:
+            index[path] = (data_offset, data_len)
+            links.pop(path, None)
+        offset = data_offset + data_len
+    for (path, target) in links.items():
+        if (target in index):
+            index[path] = index[target]
+    return (index, offset)
+
+
+class IIIFStaticPack(object):
+    """Writer to add files to a pack file."""
+
+    def __init__(self, pack_file):
+        """Initialize IIIFStaticPack object.
+
+        Arguments:
+        pack_file -- pack file name, created if it does not exist and
+            otherwise added to. An incomplete record at the end of an
+            existing pack file is removed
+        """
+        self.pack_file = pack_file
+        self.index = {}
+        self._fh = None
+        self._pid = None
+        # Remove any incomplete last record left by an interrupted writer
+        if (os.path.isfile(self.pack_file)):
+            with open(self.pack_file, 'rb+') as fh:
+                (self.index, end) = scan_pack(fh)
+                fh.truncate(end)
+
+    def _open(self):
+        # Open pack file for append, once in each process so that forked
+        # worker processes do not share the file offset
+        if (self._fh is None or self._pid != os.getpid()):
+            self._fh = open(self.pack_file, 'ab')
+            self._pid = os.getpid()
+        return self._fh
+
+    def _append(self, rtype, path, data):
+        # Append one record under an exclusive lock, return offset of data
+        path_bytes = path.encode('utf-8')
+        record = PACK_HEADER.pack(PACK_MAGIC, rtype, len(path_bytes), len(data)) + path_bytes + data
+        fh = self._open()
+        if (fcntl is not None):
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            fh.write(record)
+            fh.flush()
+            return fh.tell() - len(data)
+        finally:
+            if (fcntl is not None):
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def add(self, path, data):
+        """Add file with IIIF path and data (bytes) to the pack."""
+        self.index[path] = (self._append(b'F', path, data), len(data))
+
+    def add_link(self, path, target):
+        """Add path as a link to the file with path target."""
+        self._append(b'L', path, target.encode('utf-8'))
+        if (target in self.index):
+            self.index[path] = self.index[target]
+
+    def get(self, path):
+        """Return data for file with IIIF path, or None if not known.
+
+        Knows about files in the pack when this writer was created and
+        those added by this process.
+        """
+        entry = self.index.get(path)
+        if (entry is None):
+            return None
+        with open(self.pack_file, 'rb') as fh:
+            fh.seek(entry[0])
+            return fh.read(entry[1])
+
+    def close(self):
+        """Close pack file and write index.
+
+        The index is built by scanning the pack file so that it includes
+        records added by all processes. Returns the index.
+        """
+        if (self._fh is not None):
+            self._fh.close()
+            self._fh = None
+        # Create empty pack if nothing was added
+        open(self.pack_file, 'ab').close()
+        with open(self.pack_file, 'rb') as fh:
+            (self.index, size) = scan_pack(fh)
+        write_index(self.pack_file, self.index, size)
+        return self.index
+
+
+def write_index(pack_file, index, size):
+    """Write index for pack_file of given size atomically."""
+    data = json.dumps({'size': size, 'files': index}, sort_keys=True)
+    dirname = os.path.dirname(os.path.abspath(pack_file))
+    (fd, tmpfile) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(data)
+        os.rename(tmpfile, pack_file + '.idx')
+    except Exception:
+        os.unlink(tmpfile)
+        raise
+
+
+class IIIFStaticPackReader(object):
+    """Reader for files in a pack file using mmap."""
+
+    def __init__(self, pack_file):
+        """Initialize IIIFStaticPackReader object, open and map pack_file.
+
+        Arguments:
+        pack_file -- pack file name
+        """
+        self.pack_file = pack_file
+        self._fh = open(pack_file, 'rb')
+        size = os.fstat(self._fh.fileno()).st_size
+        self.index = self.read_index(size)
+        if (self.index is None):
+            (self.index, end) = scan_pack(self._fh)
+        self._mm = None
+        if (size > 0):
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_index(self, size):
+        """Read index file if it matches pack file size, else return None."""
+        try:
+            with open(self.pack_file + '.idx', 'r') as fh:
+                data = json.load(fh)
+            if (data['size'] != size):
+                return None
+            return dict((path, tuple(entry)) for (path, entry) in data['files'].items())
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def get(self, path):
+        """Return data for file with IIIF path, or None if not in pack."""
+        entry = self.index.get(path)
+        if (entry is None):
+            return None
+        (offset, length) = entry
+        return self._mm[offset:offset + length]
+
+    def __contains__(self, path):
+        """Return True if file with IIIF path is in the pack."""
+        return path in self.index
+
+    def __len__(self):
+        """Return number of files in the pack."""
+        return len(self.index)
+
+    def close(self):
+        """Close mapping and pack file."""
+        if (self._mm is not None):
+            self._mm.close()
+            self._mm = None
+        self._fh.close()
@@ -35,6 +35,9 @@ def get_config(base_dir=''):
                "such that there are tiles up to the full image")
     p.add('--api-versions', default='1.0,1.1,2.0,2.1,3.0',
           help="Set of API versions to support")
+    p.add('--manipulator', default='pil',
+          help="Manipulator to use, pil or static to serve files "
+               "pregenerated by iiif_static.py")
     args = p.parse_args()
 
     if (args.debug):
@@ -56,30 +59,51 @@ def get_config(base_dir=''):
     return(args)
 
 
-def create_reference_server_flask_app(cfg):
-    """Create referece server Flask application with one or more IIIF handlers."""
-    # Create Flask app
-    app = Flask(__name__)
-    Flask.secret_key = "SECRET_HERE"
-    app.debug = cfg.debug
-    # Install request handlers
-    client_prefixes = dict()
+def reference_server_configs(cfg):
+    """List of configurations for each IIIF handler."""
+    handler_configs = []
     for api_version in cfg.api_versions:
         handler_config = Config(cfg)
         handler_config.api_version = api_version
-        handler_config.klass_name = 'pil'
+        handler_config.klass_name = cfg.manipulator
         handler_config.auth_type = 'none'
         # Set same prefix on local server as expected on iiif.io
         handler_config.prefix = "api/image/%s/example/reference" % (api_version)
         handler_config.client_prefix = handler_config.prefix
+        handler_configs.append(handler_config)
+    return handler_configs
+
+
+def create_reference_server_flask_app(cfg):
+    """Create referece server Flask application with one or more IIIF handlers."""
+    # Create Flask app
+    app = Flask(__name__)
+    Flask.secret_key = "SECRET_HERE"
+    app.debug = cfg.debug
+    # Install request handlers
+    for handler_config in reference_server_configs(cfg):
         add_handler(app, handler_config)
     return app
 
 
+def create_reference_server_asgi_app(cfg):
+    """Create reference server ASGI application with one or more IIIF handlers."""
+    from iiif.asgi import IIIFASGIApp
+    app = IIIFASGIApp(workers=cfg.asgi_workers)
+    for handler_config in reference_server_configs(cfg):
+        app.add_handler(handler_config)
+    return app
+
+
 if __name__ == '__main__':
     # Command line, run server
     write_pid_file()
     cfg = get_config()
-    app = create_reference_server_flask_app(cfg)
-    setup_app(app, cfg)
-    app.run(host=cfg.app_host, port=cfg.app_port)
+    if (cfg.asgi):
+        from iiif.asgi import serve
+        serve(create_reference_server_asgi_app(cfg),
+              host=(cfg.app_host or cfg.host), port=(cfg.app_port or cfg.port))
+    else:
+        app = create_reference_server_flask_app(cfg)
+        setup_app(app, cfg)
+        app.run(host=cfg.app_host, port=cfg.app_port)
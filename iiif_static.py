@@ -4,14 +4,16 @@
 Copyright 2014--2018 Simeon Warner
 """
 
+import itertools
 import logging
 import optparse
 import sys
 import os.path
+import time
 
 from iiif import __version__
 from iiif.error import IIIFError
-from iiif.static import IIIFStatic, IIIFStaticError
+from iiif.static import IIIFStatic, IIIFStaticError, static_dir_sources, static_list_sources
 
 
 def main():
@@ -21,7 +23,7 @@ def main():
 
     # Options and arguments
     p = optparse.OptionParser(description='IIIF Image API static file generator',
-                              usage='usage: %prog [options] file [[file2..]] (-h for help)',
+                              usage='usage: %prog [options] file|dir [[file2|dir2..]] (-h for help)',
                               version='%prog ' + __version__)
 
     p.add_option('--dst', '-d', action='store', default='/tmp',
@@ -39,6 +41,12 @@ def main():
                  help="Identifier for the image that will be used in place of the filename "
                       "(minus extension). Notes that this option cannot be used if more than "
                       "one image file is to be processed")
+    p.add_option('--list', '-l', action='append', default=[],
+                 help="File listing image files or directories to process, one per line, "
+                      "relative to the location of the list file. May be repeated. "
+                      "Directories given here or as sources are processed in batch mode "
+                      "with identifiers derived from the path of each image relative "
+                      "to the directory")
     p.add_option('--extra', '-e', action='append', default=[],
                  help="Extra request parameters to be used to generate static files, may be "
                       "repeated (e.g. '/full/90,/0/default.jpg' for a 90 wide thumnail)")
@@ -66,6 +74,23 @@ def main():
     p.add_option('--generator', action='store_true', default=False,
                  help="Use named generator modules in iiif.generators package instead "
                       "of a starting image [default %default]")
+    p.add_option('--generator-workers', action='store', type='int', default=0,
+                 help="Number of worker processes used to generate each image "
+                      "with --generator, images are generated in strips that "
+                      "are shared between the workers [default %default]")
+    p.add_option('--jobs', '-j', action='store', type='int', default=0,
+                 help="Number of worker processes used to generate the tiles of "
+                      "each image, the workers share the decoded image. In batch mode "
+                      "this is instead the number of images processed at once "
+                      "[default %default]")
+    p.add_option('--pack', action='store', default=None,
+                 help="Write image files and info.json for all sources to the given "
+                      "pack file, with index in the pack file name plus .idx, instead "
+                      "of separate files under --dst (manifest.json files are still "
+                      "written under --dst)")
+    p.add_option('--force', action='store_true',
+                 help="Generate all files even if the manifest.json written by an "
+                      "earlier run shows that they are up to date")
     p.add_option('--max-image-pixels', action='store', type='int', default=0,
                  help="Set the maximum number of pixels in an image. A non-zero value "
                       "will set a hard limit on the image size. If left unset then the "
@@ -90,9 +115,10 @@ def main():
     if (not opt.write_html and opt.include_osd):
         logger.warn(
             "--include-osd has no effect without --write-html, ignoring")
-    if (len(sources) == 0):
+    dirs = [] if (opt.generator) else [source for source in sources if os.path.isdir(source)]
+    if (len(sources) == 0 and len(opt.list) == 0):
         logger.warn("No sources specified, nothing to do, bye! (-h for help)")
-    elif (len(sources) > 1 and opt.identifier):
+    elif ((len(sources) > 1 or dirs or opt.list) and opt.identifier):
         logger.error(
             "Cannot use --identifier/-i option with multiple sources, aborting.")
     else:
@@ -101,22 +127,45 @@ def main():
                             api_version=opt.api_version, dryrun=opt.dryrun,
                             prefix=opt.prefix, osd_version=opt.osd_version,
                             generator=opt.generator,
+                            generator_workers=opt.generator_workers,
+                            jobs=opt.jobs, force=opt.force, pack=opt.pack,
                             max_image_pixels=opt.max_image_pixels,
                             extras=opt.extra)
+            html_args = None
+            if (opt.write_html):
+                html_args = dict(html_dir=opt.write_html, include_osd=opt.include_osd,
+                                 osd_width=opt.osd_width, osd_height=opt.osd_height)
+            start = time.time()
             for source in sources:
                 # File or directory (or neither)?
                 if (os.path.isfile(source) or opt.generator):
                     logger.info("source file: %s" % (source))
                     sg.generate(source, identifier=opt.identifier)
                     if (opt.write_html):
-                        sg.write_html(html_dir=opt.write_html, include_osd=opt.include_osd,
-                                      osd_width=opt.osd_width, osd_height=opt.osd_height)
+                        sg.write_html(**html_args)
                 elif (os.path.isdir(source)):
-                    logger.warn(
-                        "Ignoring source '%s': directory coversion not supported" % (source))
+                    # Directories are processed in batch mode below
+                    pass
                 else:
                     logger.warn(
                         "Ignoring source '%s': neither file nor path" % (source))
+            if (dirs or opt.list):
+                batch = itertools.chain(
+                    itertools.chain.from_iterable(static_dir_sources(d) for d in dirs),
+                    itertools.chain.from_iterable(static_list_sources(f) for f in opt.list))
+                summary = sg.generate_batch(batch, html_args=html_args)
+                logger.info("Batch: %d images generated, %d failed%s" %
+                            (summary['images'], summary['failed'],
+                             ''.join(' ' + src for (src, identifier, error) in summary['errors'])))
+            sg.close()
+            if (not opt.dryrun):
+                elapsed = max(time.time() - start, 0.001)
+                mbytes = sg.bytes_written / 1000000.0
+                logger.info("Wrote %d files (%.1fMB) in %.1fs: %.1f tiles/s, %.2fMB/s, "
+                            "%d files up to date" %
+                            (sg.files_written, mbytes, elapsed,
+                             sg.files_written / elapsed, mbytes / elapsed,
+                             sg.files_skipped))
         except (IIIFStaticError, IIIFError) as e:
             # catch known errors and report nicely...
             logger.error("Error: " + str(e))
@@ -39,8 +39,9 @@ def get_config(base_dir=''):
     p.add('--api-versions', default='1.0,1.1,2.0,2.1,3.0',
           help="Set of API versions to support")
     p.add('--manipulators', default='pil',
-          help="Set of manipuators to instantiate. May be dummy,netpbm,pil "
-               "or gen for generated image")
+          help="Set of manipuators to instantiate. May be dummy,netpbm,pil, "
+               "gen for generated image or static for files pregenerated "
+               "by iiif_static.py")
     p.add('--auth-types', default='none',
           help="Set of authentication types to support")
     p.add('--pages-dir', default=os.path.join(base_dir, 'testpages'),
@@ -82,20 +83,16 @@ def get_config(base_dir=''):
     return(args)
 
 
-def create_testserver_flask_app(cfg):
-    """Create testserver Flask application with one or more IIIF handlers."""
-    # Create Flask app
-    app = Flask(__name__, static_url_path='/' + cfg.pages_dir)
-    Flask.secret_key = "SECRET_HERE"
-    app.debug = cfg.debug
-
+def testserver_configs(cfg):
+    """Shared configuration and list of configurations for each IIIF handler."""
     # Create shared configuration dict based on options
     config = Config(cfg)
     config.homedir = os.path.dirname(os.path.realpath(__file__))
     config.gauth_client_secret_file = os.path.join(
         config.homedir, config.gauth_client_secret)
 
-    # Install request handlers
+    # Configuration for each request handler
+    handler_configs = []
     client_prefixes = dict()
     for api_version in cfg.api_versions:
         for klass_name in cfg.manipulators:
@@ -113,10 +110,24 @@ def create_testserver_flask_app(cfg):
                 client_prefixes[client_prefix] = prefix
                 handler_config.prefix = prefix
                 handler_config.client_prefix = client_prefix
-                add_handler(app, handler_config)
+                handler_configs.append(handler_config)
+    config.prefixes = client_prefixes
+    return (config, handler_configs)
+
+
+def create_testserver_flask_app(cfg):
+    """Create testserver Flask application with one or more IIIF handlers."""
+    # Create Flask app
+    app = Flask(__name__, static_url_path='/' + cfg.pages_dir)
+    Flask.secret_key = "SECRET_HERE"
+    app.debug = cfg.debug
+
+    # Install request handlers
+    (config, handler_configs) = testserver_configs(cfg)
+    for handler_config in handler_configs:
+        add_handler(app, handler_config)
 
     # Index page
-    config.prefixes = client_prefixes
     app.add_url_rule('/', 'top_level_index_page',
                      top_level_index_page, defaults={'config': config})
 
@@ -128,9 +139,28 @@ def create_testserver_flask_app(cfg):
     return(app)
 
 
+def create_testserver_asgi_app(cfg):
+    """Create testserver ASGI application with one or more IIIF handlers.
+
+    OpenSeadragon pages and test pages are not supported. Raises
+    ValueError if there are handlers with auth, which are not supported.
+    """
+    from iiif.asgi import IIIFASGIApp
+    (config, handler_configs) = testserver_configs(cfg)
+    app = IIIFASGIApp(config, workers=cfg.asgi_workers)
+    for handler_config in handler_configs:
+        app.add_handler(handler_config)
+    return(app)
+
+
 if __name__ == '__main__':
     # Command line, run server
     write_pid_file()
     cfg = get_config()
-    app = setup_app(create_testserver_flask_app(cfg), cfg)
-    app.run(host=cfg.app_host, port=cfg.app_port)
+    if (cfg.asgi):
+        from iiif.asgi import serve
+        serve(create_testserver_asgi_app(cfg),
+              host=(cfg.app_host or cfg.host), port=(cfg.app_port or cfg.port))
+    else:
+        app = setup_app(create_testserver_flask_app(cfg), cfg)
+        app.run(host=cfg.app_host, port=cfg.app_port)
@@ -0,0 +1,82 @@
+"""Test code for iiif/admission.py."""
+import threading
+import time
+import unittest
+
+from iiif.admission import IIIFAdmission, request_cost
+from iiif.error import IIIFError
+from iiif.request import IIIFRequest
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def cost(self, path, width=19000, height=19000, api_version='2.1'):
+        """request_cost() for path."""
+        r = IIIFRequest(identifier='a', api_version=api_version)
+        r.parse_url(path)
+        return request_cost(r, width, height)
+
+    def test01_request_cost(self):
+        """Test request_cost()."""
+        # tile, 512x512 region at full resolution
+        self.assertAlmostEqual(self.cost('0,0,512,512/512,/0/default.jpg'),
+                               2 * 512 * 512 / 1e6)
+        # scaled tile has same output but larger region
+        self.assertAlmostEqual(self.cost('0,0,1024,1024/512,/0/default.jpg'),
+                               (1024 * 1024 + 512 * 512) / 1e6)
+        # full image
+        self.assertAlmostEqual(self.cost('full/full/0/default.jpg'), 2 * 361.0)
+        self.assertAlmostEqual(self.cost('full/max/0/default.png', api_version='3.0'),
+                               5 * 361.0)
+        self.assertAlmostEqual(self.cost('full/100,/0/default.png', 1000, 500),
+                               (500000 + 4 * 5000) / 1e6)
+        # region clipped to image
+        self.assertAlmostEqual(self.cost('900,0,200,200/full/0/default.jpg', 1000, 1000),
+                               2 * 100 * 200 / 1e6)
+        # invalid for image
+        self.assertRaises(IIIFError, self.cost, '1000,0,200,200/full/0/default.jpg', 1000, 1000)
+
+    def test02_acquire_release(self):
+        """Test acquire() and release() without waiting."""
+        a = IIIFAdmission(budget=100.0, max_wait=0)
+        self.assertEqual(a.retry_after, 1)
+        self.assertEqual(a.acquire(0.5), 0.0)
+        c1 = a.acquire(60.0)
+        self.assertEqual(c1, 60.0)
+        self.assertEqual(a.stats()['in_use'], 60.0)
+        # cheap requests still admitted
+        self.assertEqual(a.acquire(1.0), 0.0)
+        try:
+            a.acquire(50.0)
+            self.fail("Expected 503")
+        except IIIFError as e:
+            self.assertEqual(e.code, 503)
+            self.assertEqual(e.headers, {'Retry-After': '1'})
+        a.release(c1)
+        # request over budget charged whole budget
+        c2 = a.acquire(500.0)
+        self.assertEqual(c2, 100.0)
+        self.assertRaises(IIIFError, a.acquire, 2.0)
+        a.release(c2)
+        self.assertEqual(a.run(50.0, lambda: 'x'), 'x')
+        self.assertEqual(a.stats(), {'in_use': 0.0, 'admitted': 5, 'queued': 0,
+                                     'rejected': 2})
+
+    def test03_queue(self):
+        """Test request queues until budget is released."""
+        a = IIIFAdmission(budget=10.0, max_wait=5.0)
+        self.assertEqual(a.retry_after, 5)
+        charge = a.acquire(8.0)
+        results = []
+        t = threading.Thread(target=lambda: results.append(a.run(5.0, lambda: 'ok')))
+        t.start()
+        for j in range(100):
+            if (a.stats()['queued'] == 1):
+                break
+            time.sleep(0.01)
+        self.assertEqual(results, [])
+        a.release(charge)
+        t.join()
+        self.assertEqual(results, ['ok'])
+        self.assertEqual(a.stats()['in_use'], 0.0)
@@ -0,0 +1,217 @@
+"""Test code for iiif/asgi.py."""
+import os.path
+import sys
+import unittest
+
+from iiif.flask_utils import Config, IIIFHandler
+from iiif.metrics import IIIFMetrics
+
+if (sys.version_info >= (3, 6)):
+    import asyncio
+    from wsgiref.headers import Headers
+    from iiif.asgi import IIIFASGIApp, IIIFASGIHandler, start_server
+    from iiif.manipulator_pil import IIIFManipulatorPIL
+
+
+def handler_config(api_version='2.1', klass_name='pil'):
+    """Configuration for one handler."""
+    c = Config()
+    c.api_version = api_version
+    c.klass_name = klass_name
+    c.auth_type = 'none'
+    c.prefix = 'p' + api_version
+    c.client_prefix = c.prefix
+    c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+    c.tile_height = 512
+    c.tile_width = 512
+    c.scale_factors = ['auto']
+    c.scheme = 'http'
+    c.host = 'example.org'
+    c.port = 80
+    c.include_osd = False
+    return c
+
+
+@unittest.skipIf(sys.version_info < (3, 6), "Requires Python 3.6+")
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Create event loop and app with one handler."""
+        self.loop = asyncio.new_event_loop()
+        config = Config()
+        config.host = 'example.org'
+        config.prefixes = {'p2.1': 'p2.1'}
+        self.app = IIIFASGIApp(config, workers=2)
+        self.assertTrue(self.app.add_handler(handler_config()))
+
+    def tearDown(self):
+        """Close app and event loop."""
+        self.app.close()
+        self.loop.close()
+
+    def future(self, result):
+        """Future with result set, an awaitable for receive and send."""
+        f = self.loop.create_future()
+        f.set_result(result)
+        return f
+
+    def call(self, path, method='GET', headers=None, messages=None):
+        """Call app for request, return (status, headers, body)."""
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                             for (k, v) in (headers or {}).items()]}
+        sent = [] if messages is None else messages
+        self.loop.run_until_complete(self.app(
+            scope,
+            lambda: self.future({'type': 'http.request', 'body': b'', 'more_body': False}),
+            lambda message: self.future(sent.append(message))))
+        h = dict((k.decode('latin-1'), v.decode('latin-1')) for (k, v) in sent[0]['headers'])
+        body = b''.join(m['body'] for m in sent[1:])
+        return (sent[0]['status'], h, body)
+
+    def test01_handler(self):
+        """Test IIIFASGIHandler."""
+        h = IIIFASGIHandler('p', 'test1', handler_config(), IIIFManipulatorPIL,
+                            Headers([('accept', 'application/ld+json')]))
+        self.assertEqual(h.json_mime_type, 'application/ld+json')
+        (status, headers, body) = h.make_response('abc', 201, {'X-A': 'b'})
+        self.assertEqual(status, 201)
+        self.assertEqual(headers['X-A'], 'b')
+        self.assertEqual(body, b'abc')
+
+    def test02_info_and_image(self):
+        """Test info.json and image requests."""
+        (status, headers, body) = self.call('/p2.1/test1/info.json')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertIn(b'"http://example.org/p2.1/test1"', body)
+        (status, headers, body) = self.call('/p2.1/test1/full/50,/0/default.png')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'image/png')
+        self.assertEqual(headers['content-length'], str(len(body)))
+        self.assertEqual(body[1:4], b'PNG')
+        # conditional request
+        (status, headers, body) = self.call('/p2.1/test1/full/50,/0/default.png',
+                                            headers={'If-None-Match': headers['etag']})
+        self.assertEqual(status, 304)
+        # HEAD
+        (status, headers, body) = self.call('/p2.1/test1/full/50,/0/default.png', method='HEAD')
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers['content-length'], '0')
+        self.assertEqual(body, b'')
+        # IIIF errors
+        (status, headers, body) = self.call('/p2.1/test1/full/50,/0/bad.png')
+        self.assertEqual(status, 400)
+        (status, headers, body) = self.call('/p2.1/nope/info.json')
+        self.assertEqual(status, 404)
+
+    def test03_routes(self):
+        """Test index pages, redirect and other responses."""
+        (status, headers, body) = self.call('/')
+        self.assertEqual(status, 200)
+        self.assertIn(b'p2.1', body)
+        for path in ('/p2.1', '/p2.1/'):
+            (status, headers, body) = self.call(path)
+            self.assertEqual(status, 200)
+            self.assertIn(b'test1', body)
+        (status, headers, body) = self.call('/p2.1/test1')
+        self.assertEqual(status, 303)
+        self.assertEqual(headers['location'], '/p2.1/test1/info.json')
+        (status, headers, body) = self.call('/p2.1/test1/info.json', method='OPTIONS')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['access-control-allow-methods'], 'GET,OPTIONS')
+        (status, headers, body) = self.call('/p2.1/test1/full/full/0/default.jpg', method='OPTIONS')
+        self.assertEqual(status, 405)
+        (status, headers, body) = self.call('/p2.1/test1/info.json', method='POST')
+        self.assertEqual(status, 405)
+        (status, headers, body) = self.call('/other/test1/info.json')
+        self.assertEqual(status, 404)
+        (status, headers, body) = self.call('/p2.1//info.json')
+        self.assertEqual(status, 404)
+
+    def test04_chunks(self):
+        """Test response sent in chunks."""
+        self.app.chunk_size = 100
+        messages = []
+        (status, headers, body) = self.call('/p2.1/test1/full/full/0/default.png',
+                                            messages=messages)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(messages), 1 + (len(body) + 99) // 100)
+        self.assertTrue(messages[1]['more_body'])
+        self.assertFalse(messages[-1]['more_body'])
+
+    def test05_add_handler(self):
+        """Test add_handler() with unsupported auth and bad manipulator."""
+        c = handler_config()
+        c.auth_type = 'basic'
+        self.assertRaises(ValueError, self.app.add_handler, c)
+        self.assertEqual(len(self.app.handlers), 1)
+        c = handler_config(klass_name='no-klass')
+        self.assertFalse(self.app.add_handler(c))
+
+    def test06_lifespan(self):
+        """Test lifespan messages."""
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+        self.loop.run_until_complete(self.app(
+            {'type': 'lifespan'},
+            lambda: self.future(messages.pop(0)),
+            lambda message: self.future(sent.append(message))))
+        self.assertEqual([m['type'] for m in sent],
+                         ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+    def test07_server(self):
+        """Test built-in server with keep-alive connection."""
+        server = self.loop.run_until_complete(start_server(self.app, '127.0.0.1', 0))
+        port = server.sockets[0].getsockname()[1]
+        try:
+            (reader, writer) = self.loop.run_until_complete(
+                asyncio.open_connection('127.0.0.1', port))
+            for path in ('/p2.1/test1/info.json', '/p2.1/test1/full/50,/0/default.jpg'):
+                writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % (path)).encode('latin-1'))
+                head = self.loop.run_until_complete(reader.readuntil(b'\r\n\r\n'))
+                lines = head.decode('latin-1').split('\r\n')
+                self.assertEqual(lines[0], 'HTTP/1.1 200 OK')
+                length = [int(line.split(':')[1]) for line in lines
+                          if line.startswith('content-length:')][0]
+                self.loop.run_until_complete(reader.readexactly(length))
+            writer.close()
+            # HTTP/1.0 connection closed after response
+            (reader, writer) = self.loop.run_until_complete(
+                asyncio.open_connection('127.0.0.1', port))
+            writer.write(b'GET /nope HTTP/1.0\r\n\r\n')
+            data = self.loop.run_until_complete(reader.read())
+            self.assertTrue(data.startswith(b'HTTP/1.1 404 Not Found\r\n'))
+            self.assertIn(b'Connection: close\r\n', data)
+            writer.close()
+            # bad request line
+            (reader, writer) = self.loop.run_until_complete(
+                asyncio.open_connection('127.0.0.1', port))
+            writer.write(b'GARBAGE\r\n\r\n')
+            data = self.loop.run_until_complete(reader.read())
+            self.assertTrue(data.startswith(b'HTTP/1.1 400 Bad Request\r\n'))
+            writer.close()
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+
+    def test08_metrics(self):
+        """Test metrics endpoint and recording of requests."""
+        (status, headers, body) = self.call('/metrics')
+        self.assertEqual(status, 404)
+        IIIFHandler.metrics = IIIFMetrics()
+        try:
+            self.call('/p2.1/test1/info.json')
+            self.call('/p2.1/test1/full/50,/0/default.jpg')
+            self.call('/p2.1/nope/info.json')
+            (status, headers, body) = self.call('/metrics')
+        finally:
+            IIIFHandler.metrics = None
+        self.assertEqual(status, 200)
+        self.assertTrue(headers['content-type'].startswith('text/plain'))
+        lines = body.decode('utf-8').split('\n')
+        self.assertIn('iiif_requests_total{code="200",prefix="p2.1",type="info"} 1', lines)
+        self.assertIn('iiif_requests_total{code="404",prefix="p2.1",type="info"} 1', lines)
+        self.assertIn('iiif_requests_total{code="200",prefix="p2.1",type="image"} 1', lines)
+        self.assertIn('iiif_requests_in_flight{prefix="p2.1"} 0', lines)
@@ -0,0 +1,100 @@
+"""Test code for iiif/derivative_cache.py."""
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from iiif.derivative_cache import IIIFDerivativeCache
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.srcfile = os.path.join(self.tmpdir, 'src.png')
+        with open(self.srcfile, 'w') as fh:
+            fh.write('source')
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def test01_init(self):
+        """Test initialization."""
+        c = IIIFDerivativeCache(self.cache_dir)
+        self.assertTrue(os.path.isdir(self.cache_dir))
+        self.assertEqual(c.max_bytes, 1024 * 1024 * 1024)
+        self.assertEqual(c.bytes, 0)
+        self.assertEqual(c.stats(), {'hits': 0, 'misses': 0, 'stores': 0,
+                                     'evictions': 0, 'bytes': 0})
+
+    def test02_key(self):
+        """Test key generation."""
+        c = IIIFDerivativeCache(self.cache_dir)
+        k1 = c.key(self.srcfile, 'pil', '2.1', 'a/full/full/0/default.jpg')
+        self.assertEqual(len(k1), 40)
+        self.assertEqual(c.key(self.srcfile, 'pil', '2.1', 'a/full/full/0/default.jpg'), k1)
+        self.assertNotEqual(c.key(self.srcfile, 'pil', '3.0', 'a/full/full/0/default.jpg'), k1)
+        os.utime(self.srcfile, (time.time() + 10, time.time() + 10))
+        self.assertNotEqual(c.key(self.srcfile, 'pil', '2.1', 'a/full/full/0/default.jpg'), k1)
+        self.assertRaises(OSError, c.key, self.srcfile + 'x', 'pil')
+        self.assertEqual(c.path('abcdef'), os.path.join(self.cache_dir, 'ab', 'abcdef'))
+
+    def test03_get_put(self):
+        """Test get and put."""
+        c = IIIFDerivativeCache(self.cache_dir)
+        key = c.key(self.srcfile, 'x')
+        self.assertEqual(c.get(key), None)
+        self.assertTrue(c.put(key, b'\x00data\n', 'image/png'))
+        self.assertEqual(c.get(key), (b'\x00data\n', 'image/png'))
+        self.assertEqual(c.stats()['hits'], 1)
+        self.assertEqual(c.stats()['misses'], 1)
+        self.assertEqual(c.stats()['stores'], 1)
+        self.assertEqual(c.bytes, 16)
+        # no temporary files left
+        self.assertEqual(os.listdir(os.path.dirname(c.path(key))), [key])
+        # new object sees existing entry
+        c2 = IIIFDerivativeCache(self.cache_dir)
+        self.assertEqual(c2.bytes, 16)
+        self.assertEqual(c2.get(key), (b'\x00data\n', 'image/png'))
+        # too big
+        c2.max_bytes = 5
+        self.assertFalse(c2.put(key, b'123456', 'image/png'))
+
+    def test04_evict(self):
+        """Test eviction of least recently used entries."""
+        c = IIIFDerivativeCache(self.cache_dir, max_bytes=250)
+        now = time.time()
+        keys = []
+        for n in range(3):
+            key = c.key(self.srcfile, str(n))
+            keys.append(key)
+            self.assertTrue(c.put(key, b'x' * 90, 'a/b'))
+            os.utime(c.path(key), (now - 100 + n, now - 100 + n))
+        # last put took cache over limit, oldest evicted
+        self.assertEqual(c.stats()['evictions'], 1)
+        self.assertEqual(c.bytes, 188)
+        self.assertEqual(c.get(keys[0]), None)
+        # hit on keys[1] makes keys[2] the least recently used
+        self.assertNotEqual(c.get(keys[1]), None)
+        self.assertTrue(c.put(c.key(self.srcfile, '3'), b'x' * 90, 'a/b'))
+        self.assertEqual(c.get(keys[2]), None)
+        self.assertNotEqual(c.get(keys[1]), None)
+
+    def test05_put_replace(self):
+        """Test put of existing key replaces entry in size count."""
+        c = IIIFDerivativeCache(self.cache_dir)
+        key = c.key(self.srcfile, 'x')
+        self.assertTrue(c.put(key, b'\x00data\n', 'image/png'))
+        self.assertEqual(c.bytes, 16)
+        self.assertTrue(c.put(key, b'\x00data\n', 'image/png'))
+        self.assertEqual(c.bytes, 16)
+        self.assertTrue(c.put(key, b'abc', 'image/png'))
+        self.assertEqual(c.bytes, 13)
+        self.assertEqual(IIIFDerivativeCache(self.cache_dir).bytes, 13)
+        self.assertEqual(c.stats()['stores'], 3)
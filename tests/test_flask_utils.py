@@ -5,18 +5,28 @@ import flask
 import mock
 import os.path
 import json
+import shutil
+import tempfile
 
+from iiif.admission import IIIFAdmission
 from iiif.auth_basic import IIIFAuthBasic
+from iiif.derivative_cache import IIIFDerivativeCache
 from iiif.error import IIIFError
+from iiif.image_cache import IIIFImageCache
+from iiif.image_index import IIIFImageIndex
 from iiif.manipulator import IIIFManipulator
 from iiif.manipulator_pil import IIIFManipulatorPIL
+from iiif.manipulator_static import IIIFManipulatorStatic
+from iiif.single_flight import IIIFSingleFlight
+from iiif.static import IIIFStatic
 
 from iiif.flask_utils import (Config, html_page, top_level_index_page, identifiers,
                               prefix_index_page, host_port_prefix,
                               osd_page_handler, IIIFHandler, iiif_info_handler,
                               iiif_image_handler, degraded_request, options_handler,
                               parse_authorization_header, parse_accept_header,
-                              make_prefix, split_comma_argument, add_shared_configs,
+                              make_prefix, split_comma_argument, max_age_for_prefix,
+                              add_shared_configs, setup_handler,
                               add_handler, serve_static, ReverseProxied)
 
 
@@ -423,6 +433,404 @@ class TestAll(unittest.TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertEqual(resp.headers['Access-control-allow-origin'], '*')
 
+    def test31_IIIFHandler_image_information_response_index(self):
+        """Test IIIFHandler.image_information_response() with image index."""
+        c = Config()
+        c.api_version = '2.1'
+        c.klass_name = 'pil'
+        c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+        c.tile_height = 512
+        c.tile_width = 512
+        c.scale_factors = ['auto']
+        c.scheme = 'http'
+        c.host = 'example.org'
+        c.port = 80
+        c.image_index = IIIFImageIndex()
+        c.image_index.build(c.image_dir)
+        i = IIIFHandler(prefix='p', identifier='starfish', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        environ = WSGI_ENVIRON()
+        with mock.patch.object(IIIFManipulatorPIL, 'do_first') as do_first:
+            with self.test_app.request_context(environ):
+                resp = i.image_information_response()
+            self.assertFalse(do_first.called)
+        j = json.loads(resp.response[0].decode('utf-8'))
+        self.assertEqual(j['width'], 3000)
+        self.assertEqual(j['height'], 4000)
+        self.assertEqual(j['tiles'][0]['scaleFactors'], [1, 2, 4])
+
+    def test32_IIIFHandler_image_request_response_in_memory(self):
+        """Test IIIFHandler.image_request_response() with in-memory output."""
+        c = Config()
+        c.api_version = '2.1'
+        c.klass_name = 'pil'
+        c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+        c.in_memory = True
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        self.assertTrue(i.manipulator.in_memory)
+        environ = WSGI_ENVIRON()
+        with self.test_app.request_context(environ):
+            resp = i.image_request_response('full/50,/0/default.png')
+            self.assertEqual(resp.mimetype, 'image/png')
+            self.assertEqual(resp.headers['Content-Length'], str(len(resp.data)))
+            self.assertTrue(resp.data.startswith(b'\x89PNG'))
+            self.assertEqual(resp.headers['Access-control-allow-origin'], '*')
+        self.assertEqual(i.manipulator.outbuf, None)
+        self.assertEqual(i.manipulator.outtmp, None)
+
+    def test33_IIIFHandler_image_request_response_derivative_cache(self):
+        """Test IIIFHandler.image_request_response() with derivative cache."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            c = Config()
+            c.api_version = '2.1'
+            c.klass_name = 'pil'
+            c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+            c.derivative_cache = IIIFDerivativeCache(tmpdir)
+            environ = WSGI_ENVIRON()
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('full/50,/0/default.png')
+                self.assertEqual(resp.mimetype, 'image/png')
+                data = resp.data
+                self.assertTrue(data.startswith(b'\x89PNG'))
+            self.assertEqual(c.derivative_cache.stats()['misses'], 1)
+            self.assertEqual(c.derivative_cache.stats()['stores'], 1)
+            # second request served from cache without derive
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            with mock.patch.object(IIIFManipulatorPIL, 'derive') as derive:
+                with mock.patch.object(IIIFManipulatorPIL, 'cleanup') as cleanup:
+                    with self.test_app.request_context(environ):
+                        resp = i.image_request_response('full/50,/0/default.png')
+                        self.assertEqual(resp.mimetype, 'image/png')
+                        self.assertEqual(resp.data, data)
+                        self.assertIn('Link', resp.headers)
+                    self.assertTrue(cleanup.called)
+                self.assertFalse(derive.called)
+            self.assertEqual(c.derivative_cache.stats()['hits'], 1)
+            # equivalent request also served from cache
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            with mock.patch.object(IIIFManipulatorPIL, 'derive') as derive:
+                with self.test_app.request_context(environ):
+                    resp = i.image_request_response('pct:0,0,100,100/50,/360/default.png')
+                    self.assertEqual(resp.data, data)
+                self.assertFalse(derive.called)
+            self.assertEqual(c.derivative_cache.stats()['hits'], 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test34_IIIFHandler_image_request_response_single_flight(self):
+        """Test IIIFHandler.image_request_response() with single flight."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            c = Config()
+            c.api_version = '2.1'
+            c.klass_name = 'pil'
+            c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+            c.single_flight = IIIFSingleFlight()
+            environ = WSGI_ENVIRON()
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('full/50,/0/default.png')
+                self.assertEqual(resp.mimetype, 'image/png')
+                self.assertEqual(resp.headers['Content-Length'], str(len(resp.data)))
+                data = resp.data
+                self.assertTrue(data.startswith(b'\x89PNG'))
+            self.assertEqual(i.manipulator.outtmp, None)
+            self.assertEqual(c.single_flight.stats()['leaders'], 1)
+            # with derivative cache and lock files, cache is checked
+            # again after waiting for lock
+            c.derivative_cache = IIIFDerivativeCache(tmpdir)
+            c.single_flight = IIIFSingleFlight(lock_dir=os.path.join(tmpdir, 'locks'))
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('full/50,/0/default.png')
+                self.assertEqual(resp.data, data)
+            self.assertEqual(c.derivative_cache.stats()['stores'], 1)
+            c.derivative_cache.put('ab' * 20, b'cached', 'image/png')
+            with mock.patch.object(IIIFManipulatorPIL, 'derive') as derive:
+                self.assertEqual(i.derive_data('ab' * 20, recheck=True),
+                                 (b'cached', 'image/png'))
+                self.assertFalse(derive.called)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test35_IIIFHandler_image_request_response_admission(self):
+        """Test IIIFHandler.image_request_response() with admission control."""
+        c = Config()
+        c.api_version = '2.1'
+        c.klass_name = 'pil'
+        c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+        c.cache_max_age = 3600
+        environ = WSGI_ENVIRON()
+        IIIFHandler.admission = IIIFAdmission(budget=0.1, max_wait=0, cheap_cost=0.01)
+        try:
+            # nothing else in progress so admitted even though over budget
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('full/full/0/default.png')
+                self.assertEqual(resp.status_code, 200)
+            self.assertEqual(IIIFHandler.admission.stats()['admitted'], 1)
+            self.assertEqual(IIIFHandler.admission.stats()['in_use'], 0.0)
+            # budget used by another request -> 503, not cached, cost
+            # estimated without decoding image
+            charge = IIIFHandler.admission.acquire(0.05)
+            with mock.patch.object(IIIFManipulatorPIL, 'do_first') as do_first:
+                with mock.patch.object(IIIFManipulatorPIL, 'cleanup') as cleanup:
+                    with self.test_app.request_context(environ):
+                        resp = iiif_image_handler(prefix='p', identifier='test1',
+                                                  path='full/full/0/default.png',
+                                                  config=c, klass=IIIFManipulatorPIL)
+                        self.assertEqual(resp.status_code, 503)
+                        self.assertEqual(resp.headers['Retry-After'], '1')
+                        self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+                        self.assertNotIn('ETag', resp.headers)
+                        self.assertNotIn('Last-Modified', resp.headers)
+                    self.assertTrue(cleanup.called)
+                self.assertFalse(do_first.called)
+            with self.test_app.request_context(environ):
+                # cheap request still admitted
+                resp = iiif_image_handler(prefix='p', identifier='test1',
+                                          path='full/10,/0/default.png',
+                                          config=c, klass=IIIFManipulatorPIL)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.headers['Cache-Control'], 'max-age=3600')
+            # static manipulator: pregenerated file served without
+            # admission, image derived by fallback is subject to it
+            tmpdir = tempfile.mkdtemp()
+            try:
+                IIIFStatic(dst=tmpdir).generate(src=os.path.join(c.image_dir, 'test1.png'),
+                                                identifier='test1')
+                c.klass_name = 'static'
+                c.manipulator_args = {'static_dir': tmpdir,
+                                      'fallback_klass': IIIFManipulatorPIL}
+                with self.test_app.request_context(environ):
+                    resp = iiif_image_handler(prefix='p', identifier='test1',
+                                              path='full/full/0/default.jpg',
+                                              config=c, klass=IIIFManipulatorStatic)
+                    self.assertEqual(resp.status_code, 200)
+                    resp = iiif_image_handler(prefix='p', identifier='test1',
+                                              path='full/full/0/default.png',
+                                              config=c, klass=IIIFManipulatorStatic)
+                    self.assertEqual(resp.status_code, 503)
+            finally:
+                shutil.rmtree(tmpdir)
+            IIIFHandler.admission.release(charge)
+        finally:
+            IIIFHandler.admission = None
+
+    def test36_IIIFHandler_image_request_response_timing(self):
+        """Test IIIFHandler.image_request_response() with Server-Timing."""
+        c = Config()
+        c.api_version = '2.1'
+        c.klass_name = 'pil'
+        c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+        c.in_memory = True
+        environ = WSGI_ENVIRON()
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        self.assertFalse(i.manipulator.timing)
+        with self.test_app.request_context(environ):
+            resp = i.image_request_response('full/50,/0/default.png')
+            self.assertNotIn('Server-Timing', resp.headers)
+        c.server_timing = True
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        self.assertTrue(i.manipulator.timing)
+        with self.test_app.request_context(environ):
+            resp = i.image_request_response('full/50,/0/default.png')
+            self.assertEqual(resp.status_code, 200)
+            names = [t.split(';')[0] for t in resp.headers['Server-Timing'].split(', ')]
+            self.assertEqual(names, ['parse', 'file', 'first', 'region', 'size',
+                                     'rotation', 'quality', 'format', 'last'])
+            self.assertTrue(resp.headers['Server-Timing'].startswith('parse;dur='))
+        # timings passed to sink
+        c.server_timing = False
+        sink = mock.Mock()
+        IIIFHandler.timing_sink = sink
+        try:
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorPIL, auth=None)
+            self.assertTrue(i.manipulator.timing)
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('full/50,/0/default.png')
+                self.assertNotIn('Server-Timing', resp.headers)
+        finally:
+            IIIFHandler.timing_sink = None
+        self.assertEqual(sink.call_count, 1)
+        (klass_name, timings) = sink.call_args[0]
+        self.assertEqual(klass_name, 'pil')
+        self.assertEqual(len(timings), 9)
+
+    def test37_IIIFHandler_static(self):
+        """Test IIIFHandler with static manipulator."""
+        tmpdir = tempfile.mkdtemp()
+        c = Config()
+        c.api_version = '2.1'
+        c.klass_name = 'static'
+        c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+        c.tile_height = 512
+        c.tile_width = 512
+        c.scale_factors = ['auto']
+        c.scheme = 'http'
+        c.host = 'example.org'
+        c.port = 80
+        environ = WSGI_ENVIRON()
+        try:
+            IIIFStatic(dst=tmpdir).generate(src=os.path.join(c.image_dir, 'test1.png'),
+                                            identifier='t1')
+            c.manipulator_args = {'static_dir': tmpdir}
+            self.assertEqual(identifiers(c), ['t1'])
+            with open(os.path.join(tmpdir, 't1/full/175,/0/default.jpg'), 'rb') as fh:
+                data = fh.read()
+            i = IIIFHandler(prefix='p', identifier='t1', config=c,
+                            klass=IIIFManipulatorStatic, auth=None)
+            with self.test_app.request_context(environ):
+                resp = i.image_information_response()
+                j = json.loads(resp.data.decode('utf-8'))
+                self.assertEqual(j['@id'], 'http://example.org/p/t1')
+                self.assertEqual(j['width'], 175)
+                self.assertTrue('ETag' in resp.headers)
+            i = IIIFHandler(prefix='p', identifier='t1', config=c,
+                            klass=IIIFManipulatorStatic, auth=None)
+            with mock.patch.object(IIIFManipulatorPIL, 'derive') as derive:
+                with self.test_app.request_context(environ):
+                    resp = i.image_request_response('full/full/0/default.jpg')
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertEqual(resp.headers['Content-Type'], 'image/jpeg')
+                    self.assertEqual(resp.data, data)
+                self.assertFalse(derive.called)
+            # not pregenerated, source images not used without fallback
+            i = IIIFHandler(prefix='p', identifier='t1', config=c,
+                            klass=IIIFManipulatorStatic, auth=None)
+            with self.test_app.request_context(environ):
+                self.assertRaises(IIIFError, i.image_request_response, 'full/50,/0/default.jpg')
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorStatic, auth=None)
+            self.assertRaises(IIIFError, i.image_information_response)
+            # fallback
+            c.static_fallback = True
+            c.manipulator_args['fallback_klass'] = IIIFManipulatorPIL
+            self.assertIn('test1', identifiers(c))
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorStatic, auth=None)
+            with self.test_app.request_context(environ):
+                resp = i.image_information_response()
+                self.assertEqual(json.loads(resp.data.decode('utf-8'))['width'], 175)
+            i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                            klass=IIIFManipulatorStatic, auth=None)
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('full/50,/0/default.png')
+                self.assertEqual(resp.status_code, 200)
+            # no source image for fallback
+            i = IIIFHandler(prefix='p', identifier='t1', config=c,
+                            klass=IIIFManipulatorStatic, auth=None)
+            with self.test_app.request_context(environ):
+                self.assertRaises(IIIFError, i.image_request_response, 'full/50,/0/default.png')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test38_IIIFHandler_conditional_requests(self):
+        """Test ETag, Last-Modified and 304 responses."""
+        c = Config()
+        c.api_version = '2.1'
+        c.klass_name = 'pil'
+        c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+        c.tile_height = 512
+        c.tile_width = 512
+        c.scale_factors = [1, 2]
+        c.scheme = 'http'
+        c.host = 'example.org'
+        c.port = 80
+        c.cache_max_age = 3600
+        environ = WSGI_ENVIRON()
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with self.test_app.request_context(environ):
+            resp = i.image_request_response('full/50,/0/default.png')
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+            last_modified = resp.headers['Last-Modified']
+            self.assertTrue(etag.startswith('"'))
+            self.assertEqual(resp.headers['Cache-Control'], 'max-age=3600')
+        # If-None-Match, 304 without decoding image
+        environ['HTTP_IF_NONE_MATCH'] = 'W/"other", ' + etag
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with mock.patch.object(IIIFManipulatorPIL, 'do_first') as do_first:
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('full/50,/0/default.png')
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.headers['ETag'], etag)
+            self.assertFalse(do_first.called)
+        # equivalent request, same ETag
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with mock.patch.object(IIIFManipulatorPIL, 'do_first') as do_first:
+            with self.test_app.request_context(environ):
+                resp = i.image_request_response('pct:0,0,100,100/50,/0/default.png')
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.headers['ETag'], etag)
+            self.assertFalse(do_first.called)
+        # different request, different ETag
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with self.test_app.request_context(environ):
+            resp = i.image_request_response('full/51,/0/default.png')
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+        # If-Modified-Since
+        del environ['HTTP_IF_NONE_MATCH']
+        environ['HTTP_IF_MODIFIED_SINCE'] = last_modified
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with self.test_app.request_context(environ):
+            resp = i.image_request_response('full/50,/0/default.png')
+            self.assertEqual(resp.status_code, 304)
+        environ['HTTP_IF_MODIFIED_SINCE'] = 'Thu, 01 Jan 1970 00:00:00 GMT'
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with self.test_app.request_context(environ):
+            resp = i.image_request_response('full/50,/0/default.png')
+            self.assertEqual(resp.status_code, 200)
+        # info.json
+        del environ['HTTP_IF_MODIFIED_SINCE']
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with self.test_app.request_context(environ):
+            resp = i.image_information_response()
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+        environ['HTTP_IF_NONE_MATCH'] = etag
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with mock.patch.object(IIIFManipulatorPIL, 'do_first') as do_first:
+            with self.test_app.request_context(environ):
+                resp = i.image_information_response()
+                self.assertEqual(resp.status_code, 304)
+            self.assertFalse(do_first.called)
+        # error response has no validators or max-age
+        del environ['HTTP_IF_NONE_MATCH']
+        i = IIIFHandler(prefix='p', identifier='test1', config=c,
+                        klass=IIIFManipulatorPIL, auth=None)
+        with self.test_app.request_context(environ):
+            try:
+                i.image_request_response('full/50,/0/default.gif')
+                self.fail("Expected IIIFError")
+            except IIIFError as e:
+                resp = i.error_response(e)
+            self.assertEqual(resp.status_code, 415)
+            self.assertNotIn('ETag', resp.headers)
+            self.assertNotIn('Last-Modified', resp.headers)
+            self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+
     def test40_parse_authorization_header(self):
         """Test parse_authorization_header."""
         # Garbage
@@ -485,6 +893,16 @@ class TestAll(unittest.TestCase):
         self.assertEqual(split_comma_argument('a,b,cccccccccc,,,'),
                          ['a', 'b', 'cccccccccc'])
 
+    def test44_max_age_for_prefix(self):
+        """Test max_age_for_prefix()."""
+        self.assertEqual(max_age_for_prefix(None, 'a'), None)
+        self.assertEqual(max_age_for_prefix('100', 'a'), 100)
+        self.assertEqual(max_age_for_prefix(100, 'a'), 100)
+        self.assertEqual(max_age_for_prefix('a=10,100', 'a'), 10)
+        self.assertEqual(max_age_for_prefix('a=10,100', 'b'), 100)
+        self.assertEqual(max_age_for_prefix('a=10,/b/c=20', 'b/c'), 20)
+        self.assertEqual(max_age_for_prefix('a=10', 'b'), None)
+
     def test50_add_shared_configs(self):
         """Test add_shared_configs() - just check it runs."""
         p = argparse.ArgumentParser()
@@ -513,6 +931,40 @@ class TestAll(unittest.TestCase):
             c.prefix = 'pfx2_' + klass
             c.client_prefix = c.prefix
             self.assertTrue(add_handler(self.test_app, Config(c)))
+        # Static manipulator needs directory or pack
+        c.klass_name = 'static'
+        c.prefix = 'pfx2_static'
+        c.client_prefix = c.prefix
+        self.assertFalse(add_handler(self.test_app, Config(c)))
+        c.static_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+        c.static_fallback = True
+        hc = Config(c)
+        self.assertTrue(add_handler(self.test_app, hc))
+        self.assertEqual(hc.manipulator_args['static_dir'], c.static_dir)
+        self.assertEqual(hc.manipulator_args['fallback_klass'], IIIFManipulatorPIL)
+        # settings are per handler, not changed by another handler
+        c.static_fallback = False
+        c.prefix = 'pfx2_static_nofb'
+        c.client_prefix = c.prefix
+        self.assertTrue(add_handler(self.test_app, Config(c)))
+        self.assertEqual(hc.manipulator_args['fallback_klass'], IIIFManipulatorPIL)
+        c.klass_name = 'dummy'
+        # Coalescing of requests
+        c.coalesce_requests = True
+        c.prefix = 'pfx3_coalesce'
+        c.client_prefix = c.prefix
+        c2 = Config(c)
+        self.assertTrue(add_handler(self.test_app, c2))
+        self.assertFalse(c2.single_flight.locking)
+        c.coalesce_requests = False
+        # Admission control
+        c.admission_budget = 100.0
+        c.prefix = 'pfx3_admission'
+        c.client_prefix = c.prefix
+        self.assertTrue(add_handler(self.test_app, Config(c)))
+        self.assertEqual(IIIFHandler.admission.budget, 100.0)
+        IIIFHandler.admission = None
+        c.admission_budget = 0
         # Include OSD
         c.include_osd = True
         self.assertTrue(add_handler(self.test_app, Config(c)))
@@ -523,6 +975,72 @@ class TestAll(unittest.TestCase):
         c.klass_name = 'no-klass'
         self.assertFalse(add_handler(self.test_app, Config(c)))
 
+    def test52_add_handler_metrics(self):
+        """Test add_handler with metrics."""
+        c = Config()
+        c.klass_name = 'pil'
+        c.api_version = '2.1'
+        c.include_osd = False
+        c.auth_type = 'none'
+        c.prefix = 'pm'
+        c.client_prefix = c.prefix
+        c.image_dir = os.path.join(os.path.dirname(__file__), '../testimages')
+        c.tile_height = 512
+        c.tile_width = 512
+        c.scale_factors = ['auto']
+        c.scheme = 'http'
+        c.host = 'example.org'
+        c.port = 80
+        c.metrics = True
+        c.coalesce_requests = True
+        app = flask.Flask('metrics_test')
+        try:
+            self.assertTrue(add_handler(app, Config(c)))
+            self.assertTrue(IIIFHandler.metrics is not None)
+            self.assertEqual(IIIFHandler.timing_sink, IIIFHandler.metrics.observe_stages)
+            # second handler does not add /metrics again
+            c.prefix = 'pm2'
+            c.client_prefix = c.prefix
+            self.assertTrue(add_handler(app, Config(c)))
+            client = app.test_client()
+            self.assertEqual(client.get('/pm/test1/info.json').status_code, 200)
+            resp = client.get('/pm/test1/full/50,/0/default.png')
+            self.assertEqual(resp.status_code, 200)
+            nbytes = len(resp.data)
+            self.assertEqual(client.get('/pm/test1/full/50,/0/bad.png').status_code, 400)
+            resp = client.get('/metrics')
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.content_type.startswith('text/plain; version=0.0.4'))
+            lines = resp.data.decode('utf-8').split('\n')
+            self.assertIn('iiif_requests_total{code="200",prefix="pm",type="info"} 1', lines)
+            self.assertIn('iiif_requests_total{code="200",prefix="pm",type="image"} 1', lines)
+            self.assertIn('iiif_requests_total{code="400",prefix="pm",type="image"} 1', lines)
+            self.assertIn('iiif_request_duration_seconds_count{prefix="pm",type="image"} 2', lines)
+            image_bytes = [line for line in lines
+                           if line.startswith('iiif_response_bytes_total{prefix="pm",type="image"}')]
+            self.assertTrue(int(image_bytes[0].split(' ')[1]) > nbytes)
+            self.assertIn('iiif_requests_in_flight{prefix="pm"} 0', lines)
+            self.assertIn('iiif_stage_duration_seconds_count{manipulator="pil",stage="format"} 1', lines)
+            self.assertIn('iiif_coalesced_requests_total{prefix="pm",role="leaders"} 1', lines)
+            # process-wide collectors added once, per-handler for each prefix
+            IIIFHandler.metrics = None
+            IIIFManipulatorPIL.image_cache = IIIFImageCache()
+            IIIFHandler.admission = IIIFAdmission(budget=100.0)
+            for prefix in ('pm', 'pm2'):
+                c.prefix = prefix
+                c.client_prefix = c.prefix
+                setup_handler(Config(c))
+            self.assertEqual(len(IIIFHandler.metrics.collectors), 4)
+            lines = IIIFHandler.metrics.render().split('\n')
+            self.assertIn('iiif_image_cache_events_total{event="hits"} 0', lines)
+            self.assertIn('iiif_admission_events_total{event="admitted"} 0', lines)
+            self.assertIn('iiif_coalesced_requests_total{prefix="pm2",role="leaders"} 0', lines)
+        finally:
+            IIIFHandler.metrics = None
+            IIIFHandler.timing_sink = None
+            IIIFHandler.admission = None
+            IIIFManipulatorPIL.image_cache = None
+
     def test62_serve_static(self):
         """Test serve_static()."""
         environ = WSGI_ENVIRON()
@@ -1,4 +1,5 @@
 """Test code for iiif.generators.check."""
+import numpy
 import unittest
 
 from iiif.generators.check import PixelGen
@@ -31,3 +32,26 @@ class TestAll(unittest.TestCase):
         # n%2 and not
         self.assertEqual(gen.pixel(0, 0, 9, 55), (55, 0, 0))
         self.assertEqual(gen.pixel(3, 0, 9, 55), None)
+
+    def test04_pixels(self):
+        """Test pixels, same as pixel for each."""
+        gen = PixelGen()
+        (iy, ix) = numpy.meshgrid(numpy.arange(0, gen.size[1], 61),
+                                  numpy.arange(0, gen.size[0], 61), indexing='ij')
+        rgb = gen.pixels(ix, iy)
+        self.assertEqual(rgb.shape, ix.shape + (3,))
+        for (y, x) in ((0, 0), (1, 2), (7, 5), (ix.shape[0] - 1, ix.shape[1] - 1)):
+            color = gen.pixel(int(ix[y, x]), int(iy[y, x])) or gen.background_color
+            self.assertEqual(tuple(rgb[y, x]), color)
+
+    def test05_render(self):
+        """Test render, same as pixels for grid."""
+        gen = PixelGen()
+        for (x0, y0, w, n) in ((0, 0, gen.size[0], 100), (100, 200, 300, 64),
+                               (6000, 6100, 50, 37)):
+            xs = [x0 + (i * w) // n for i in range(n)]
+            ys = [y0 + (j * w) // n for j in range(n)]
+            (iy, ix) = numpy.meshgrid(ys, xs, indexing='ij')
+            image = gen.render(xs, ys)
+            self.assertEqual(image.size, (n, n))
+            self.assertEqual(image.tobytes(), gen.pixels(ix, iy).tobytes())
@@ -1,4 +1,5 @@
 """Test code for iiif.generators.diagonal_cross."""
+import numpy
 import unittest
 
 from iiif.generators.diagonal_cross import PixelGen
@@ -27,3 +28,14 @@ class TestAll(unittest.TestCase):
         self.assertEqual(gen.pixel(1, 0, 3), None)
         # off diag
         self.assertEqual(gen.pixel(3, 0, 9), None)
+
+    def test04_pixels(self):
+        """Test pixels, same as pixel for each."""
+        gen = PixelGen()
+        (iy, ix) = numpy.meshgrid(numpy.arange(0, gen.size[1], 31),
+                                  numpy.arange(0, gen.size[0], 31), indexing='ij')
+        rgb = gen.pixels(ix, iy)
+        self.assertEqual(rgb.shape, ix.shape + (3,))
+        for (y, x) in ((0, 0), (1, 2), (7, 5), (ix.shape[0] - 1, ix.shape[1] - 1)):
+            color = gen.pixel(int(ix[y, x]), int(iy[y, x])) or gen.background_color
+            self.assertEqual(tuple(rgb[y, x]), color)
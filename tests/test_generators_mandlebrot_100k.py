@@ -1,4 +1,5 @@
 """Test code for iiif.generators.mandlebrot_100k."""
+import numpy
 import unittest
 import cmath
 
@@ -38,3 +39,48 @@ class TestAll(unittest.TestCase):
         self.assertEqual(gen.mpixel(complex(0, 0), 9999), None)
         # next iter
         self.assertEqual(gen.mpixel(complex(0.5, 0.5), 0), None)
+
+    def test06_pixels(self):
+        """Test pixels, same as pixel for each."""
+        gen = PixelGen()
+        (iy, ix) = numpy.meshgrid(numpy.arange(0, gen.size[1], 997),
+                                  numpy.arange(0, gen.size[0], 997), indexing='ij')
+        rgb = gen.pixels(ix, iy)
+        self.assertEqual(rgb.shape, ix.shape + (3,))
+        for (y, x) in ((0, 0), (1, 2), (7, 5), (ix.shape[0] - 1, ix.shape[1] - 1)):
+            color = gen.pixel(int(ix[y, x]), int(iy[y, x])) or gen.background_color
+            self.assertEqual(tuple(rgb[y, x]), color)
+
+    def test07_in_main_bulbs(self):
+        """Test in_main_bulbs."""
+        gen = PixelGen()
+        self.assertTrue(gen.in_main_bulbs(complex(0, 0)))
+        self.assertTrue(gen.in_main_bulbs(complex(0.2, 0.1)))
+        self.assertTrue(gen.in_main_bulbs(complex(-1.0, 0.1)))
+        self.assertFalse(gen.in_main_bulbs(complex(0.3, 0)))
+        self.assertFalse(gen.in_main_bulbs(complex(-1.3, 0)))
+        self.assertFalse(gen.in_main_bulbs(complex(-0.1, 0.9)))
+
+    def test08_mpixel_periodic(self):
+        """Test mpixel with periodic orbit outside main bulbs."""
+        gen = PixelGen()
+        # c=-1.75 has a period 3 attracting cycle
+        gen.set_c(complex(-1.75, 0))
+        self.assertFalse(gen.in_main_bulbs(gen.c))
+        self.assertEqual(gen.mpixel(complex(-1.75, 0)), None)
+        gen.set_c(complex(-1.8, 0.1))
+        self.assertEqual(gen.mpixel(complex(-1.8, 0.1)), (10, 50, 100))
+        # exactly repeating orbit 0, -1, 0, ...
+        gen.c = complex(-1, 0)
+        self.assertEqual(gen.mpixel(complex(0, 0)), None)
+
+    def test09_render(self):
+        """Test render with boundary tracing, same as pixels."""
+        gen = PixelGen()
+        for (x0, y0, step) in ((0, 0, 200), (30000, 45000, 4), (37000, 48000, 1)):
+            xs = numpy.arange(x0, x0 + 100 * step, step)
+            ys = numpy.arange(y0, y0 + 90 * step, step)
+            (iy, ix) = numpy.meshgrid(ys, xs, indexing='ij')
+            image = gen.render(xs, ys)
+            self.assertEqual(image.size, (100, 90))
+            self.assertEqual(image.tobytes(), gen.pixels(ix, iy).tobytes())
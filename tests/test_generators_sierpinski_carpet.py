@@ -1,4 +1,5 @@
 """Test code for iiif.generators.sierpinski_carpet."""
+import numpy
 import unittest
 
 from iiif.generators.sierpinski_carpet import PixelGen
@@ -28,3 +29,28 @@ class TestAll(unittest.TestCase):
         self.assertEqual(gen.pixel(1, 1, 3), None)
         # next iter
         self.assertEqual(gen.pixel(3, 3, 9), None)
+
+    def test04_pixels(self):
+        """Test pixels, same as pixel for each."""
+        gen = PixelGen()
+        (iy, ix) = numpy.meshgrid(numpy.arange(0, gen.size[1], 31),
+                                  numpy.arange(0, gen.size[0], 31), indexing='ij')
+        rgb = gen.pixels(ix, iy)
+        self.assertEqual(rgb.shape, ix.shape + (3,))
+        for (y, x) in ((0, 0), (1, 2), (7, 5), (ix.shape[0] - 1, ix.shape[1] - 1)):
+            color = gen.pixel(int(ix[y, x]), int(iy[y, x])) or gen.background_color
+            self.assertEqual(tuple(rgb[y, x]), color)
+
+    def test05_render(self):
+        """Test render, same as pixels for grid."""
+        gen = PixelGen()
+        for min_block in (128, 3):
+            gen.min_block = min_block
+            for (x0, y0, w, n) in ((0, 0, gen.size[0], 300), (100, 200, 300, 64),
+                                   (2000, 2100, 50, 37)):
+                xs = [x0 + (i * w) // n for i in range(n)]
+                ys = [y0 + (j * w) // n for j in range(n)]
+                (iy, ix) = numpy.meshgrid(ys, xs, indexing='ij')
+                image = gen.render(xs, ys)
+                self.assertEqual(image.size, (n, n))
+                self.assertEqual(image.tobytes(), gen.pixels(ix, iy).tobytes())
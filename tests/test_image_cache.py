@@ -0,0 +1,75 @@
+"""Test code for iiif/image_cache.py."""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+
+from iiif.image_cache import image_bytes, IIIFImageCache
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def test01_image_bytes(self):
+        """Test estimate of decoded image size."""
+        self.assertEqual(image_bytes(Image.new('RGB', (10, 20))), 800)
+        self.assertEqual(image_bytes(Image.new('L', (10, 20))), 200)
+        self.assertEqual(image_bytes(Image.new('P', (10, 20))), 200)
+        self.assertEqual(image_bytes(Image.new('I;16', (10, 20))), 400)
+
+    def test02_init(self):
+        """Test initialization."""
+        c = IIIFImageCache()
+        self.assertEqual(c.max_bytes, 256 * 1024 * 1024)
+        self.assertEqual(len(c), 0)
+        c = IIIFImageCache(max_bytes=1000)
+        self.assertEqual(c.max_bytes, 1000)
+
+    def test03_key(self):
+        """Test key generation."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            c = IIIFImageCache()
+            f = os.path.join(tmpdir, 'a.png')
+            Image.new('L', (2, 2)).save(f)
+            k1 = c.key(f)
+            self.assertEqual(k1[0], os.path.abspath(f))
+            self.assertEqual(k1[3], 1)
+            self.assertNotEqual(c.key(f, 2), k1)
+            # change in mtime gives new key
+            os.utime(f, (time.time() + 10, time.time() + 10))
+            self.assertNotEqual(c.key(f), k1)
+            self.assertRaises(OSError, c.key, os.path.join(tmpdir, 'none'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test04_get_put(self):
+        """Test get and put with LRU eviction."""
+        c = IIIFImageCache(max_bytes=250)
+        a = Image.new('L', (10, 10))
+        b = Image.new('L', (10, 10))
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(c.misses, 1)
+        self.assertTrue(c.put('a', a))
+        self.assertTrue(c.put('b', b))
+        self.assertEqual(c.bytes, 200)
+        self.assertIs(c.get('a'), a)
+        self.assertEqual(c.hits, 1)
+        # adding another evicts b as least recently used
+        self.assertTrue(c.put('c', Image.new('L', (10, 10))))
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.bytes, 200)
+        self.assertIs(c.get('a'), a)
+        self.assertEqual(c.get('b'), None)
+        # replacing entry
+        self.assertTrue(c.put('a', Image.new('L', (5, 5))))
+        self.assertEqual(c.bytes, 125)
+        # too big to cache
+        self.assertFalse(c.put('d', Image.new('RGB', (10, 10))))
+        self.assertEqual(c.get('d'), None)
+        c.clear()
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.bytes, 0)
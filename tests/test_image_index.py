@@ -0,0 +1,134 @@
+"""Test code for iiif/image_index.py."""
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+from testfixtures import LogCapture
+
+from iiif.image_index import IIIFImageIndex
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory with two images."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.image_dir = os.path.join(self.tmpdir, 'images')
+        os.mkdir(self.image_dir)
+        Image.new('RGB', (30, 20)).save(os.path.join(self.image_dir, 'a.png'))
+        Image.new('L', (10, 40)).save(os.path.join(self.image_dir, 'b.jpg'))
+        with open(os.path.join(self.image_dir, 'c.txt'), 'w') as fh:
+            fh.write('not an image')
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def test01_init(self):
+        """Test initialization."""
+        idx = IIIFImageIndex()
+        self.assertEqual(idx.index_file, None)
+        self.assertEqual(idx.entries, {})
+        # save does nothing with no file
+        idx.save()
+
+    def test02_add_lookup(self):
+        """Test add and lookup of entries."""
+        idx = IIIFImageIndex()
+        path = os.path.join(self.image_dir, 'a.png')
+        self.assertEqual(idx.lookup('a', path), None)
+        entry = idx.add('a', path)
+        self.assertEqual(entry['width'], 30)
+        self.assertEqual(entry['height'], 20)
+        self.assertEqual(entry['mode'], 'RGB')
+        self.assertEqual(entry['format'], 'PNG')
+        self.assertEqual(idx.lookup('a', path), entry)
+        # wrong path or changed file
+        self.assertEqual(idx.lookup('a', path + 'x'), None)
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(idx.lookup('a', path), None)
+        # get re-reads
+        self.assertEqual(idx.get('a', path)['width'], 30)
+        self.assertNotEqual(idx.lookup('a', path), None)
+        # bad image
+        self.assertEqual(idx.add('c', os.path.join(self.image_dir, 'c.txt')), None)
+        self.assertEqual(idx.get('c', os.path.join(self.image_dir, 'c.txt')), None)
+
+    def test03_build_save_load(self):
+        """Test build of index and save/load from file."""
+        index_file = os.path.join(self.tmpdir, 'index.json')
+        idx = IIIFImageIndex(index_file)
+        self.assertEqual(idx.build(self.image_dir), 2)
+        self.assertEqual(sorted(idx.entries.keys()), ['a', 'b'])
+        with open(index_file, 'r') as fh:
+            self.assertEqual(json.load(fh)['b']['height'], 40)
+        # no temporary files left
+        self.assertEqual([f for f in os.listdir(self.tmpdir) if f.endswith('.tmp')], [])
+        # new index object loads
+        idx2 = IIIFImageIndex(index_file)
+        self.assertEqual(idx2.entries, idx.entries)
+        # removed image is removed from index on build
+        os.unlink(os.path.join(self.image_dir, 'a.png'))
+        self.assertEqual(idx2.build(self.image_dir), 1)
+        self.assertEqual(list(idx2.entries.keys()), ['b'])
+        self.assertEqual(list(IIIFImageIndex(index_file).entries.keys()), ['b'])
+
+    def test04_save_merge(self):
+        """Test get() does not save at once and save() merges with other index objects."""
+        index_file = os.path.join(self.tmpdir, 'index.json')
+        idx1 = IIIFImageIndex(index_file)
+        idx2 = IIIFImageIndex(index_file)
+        self.assertNotEqual(idx1.get('a', os.path.join(self.image_dir, 'a.png')), None)
+        self.assertFalse(os.path.exists(index_file))
+        self.assertNotEqual(idx2.get('b', os.path.join(self.image_dir, 'b.jpg')), None)
+        idx1.save()
+        idx2.save()
+        self.assertEqual(sorted(IIIFImageIndex(index_file).entries.keys()), ['a', 'b'])
+        self.assertEqual(sorted(idx2.entries.keys()), ['a', 'b'])
+        # removal by build is kept by merge
+        os.unlink(os.path.join(self.image_dir, 'a.png'))
+        self.assertEqual(idx2.build(self.image_dir), 1)
+        idx1.save()
+        self.assertEqual(list(IIIFImageIndex(index_file).entries.keys()), ['b'])
+
+    def test05_shared_and_paths(self):
+        """Test shared() and normalization of paths."""
+        index_file = os.path.join(self.tmpdir, 'index.json')
+        idx = IIIFImageIndex.shared(index_file)
+        self.assertTrue(IIIFImageIndex.shared(os.path.join(self.tmpdir, '.', 'index.json')) is idx)
+        self.assertEqual(idx.build(self.image_dir + '/'), 2)
+        self.assertNotEqual(idx.lookup('a', os.path.join(self.image_dir, '.', 'a.png')), None)
+        # pruning with different form of image_dir
+        os.unlink(os.path.join(self.image_dir, 'a.png'))
+        self.assertEqual(idx.build(os.path.join(self.image_dir, '..', 'images')), 1)
+        self.assertEqual(list(idx.entries.keys()), ['b'])
+        IIIFImageIndex._shared.clear()
+
+    def test06_get_save(self):
+        """Test entries added by get() are saved after save_interval."""
+        index_file = os.path.join(self.tmpdir, 'index.json')
+        idx = IIIFImageIndex(index_file, save_interval=0)
+        self.assertNotEqual(idx.get('a', os.path.join(self.image_dir, 'a.png')), None)
+        self.assertEqual(list(IIIFImageIndex(index_file).entries.keys()), ['a'])
+        # not saved again within save_interval
+        idx.save_interval = 3600
+        self.assertNotEqual(idx.get('b', os.path.join(self.image_dir, 'b.jpg')), None)
+        self.assertEqual(list(IIIFImageIndex(index_file).entries.keys()), ['a'])
+        # but saved by flush(), as at exit
+        idx.flush()
+        self.assertEqual(sorted(IIIFImageIndex(index_file).entries.keys()), ['a', 'b'])
+        # failure to save is logged
+        shutil.rmtree(self.tmpdir)
+        idx.add('a', os.path.join(os.path.dirname(__file__), '../testimages/test1.png'))
+        with LogCapture('iiif.image_index') as lc:
+            idx.flush()
+        self.assertIn('Failed to save index', str(lc))
+        os.mkdir(self.tmpdir)
+        idx.flush()
+        self.assertEqual(idx._changed, set())
@@ -1,5 +1,6 @@
 """Test code for null iiif.manipulator."""
 import os
+import mock
 import shutil
 import tempfile
 import unittest
@@ -26,6 +27,7 @@ class TestAll(unittest.TestCase):
         self.assertEqual(m.srcfile, None)
         self.assertEqual(m.request, None)
         self.assertEqual(m.outfile, None)
+        self.assertFalse(m.mirroring)
         m.cleanup()
 
     def test02_derive(self):
@@ -51,6 +53,14 @@ class TestAll(unittest.TestCase):
             self.assertEqual(os.path.getsize(outfile), 65810)
         finally:
             shutil.rmtree(tmp)
+        # mirroring not supported
+        r = IIIFRequest()
+        r.parse_url('id1/full/full/!0/default')
+        try:
+            m.derive(srcfile='testimages/test1.png', request=r)
+            self.fail('Expected IIIFError')
+        except IIIFError as e:
+            self.assertEqual(e.code, 501)
 
     def test03_do_first(self):
         """Test do_first."""
@@ -396,3 +406,50 @@ class TestAll(unittest.TestCase):
         self.assertEqual(m.compliance_uri, None)
         m.compliance_level = 2
         self.assertEqual(m.compliance_uri, None)
+
+    def test17_stage_timings(self):
+        """Test stage() and timings recorded by derive."""
+        m = IIIFManipulator()
+        self.assertEqual(m.stage('a', lambda x: x + 1, 1), 2)
+        self.assertEqual(m.timings, [])
+        m = IIIFManipulator(timing=True)
+        self.assertEqual(m.stage('a', lambda x: x + 1, 1), 2)
+        self.assertEqual([name for (name, secs) in m.timings], ['a'])
+        self.assertRaises(IIIFError, m.stage, 'b', m.do_region, 1, 2, 3, 4)
+        self.assertEqual(m.timings[-1][0], 'b')
+        m = IIIFManipulator(timing=True)
+        r = IIIFRequest()
+        r.parse_url('id1/full/full/0/default')
+        tmp = tempfile.mkdtemp()
+        try:
+            m.derive(srcfile='testimages/test1.png', request=r,
+                     outfile=os.path.join(tmp, 'testout.png'))
+        finally:
+            shutil.rmtree(tmp)
+        self.assertEqual([name for (name, secs) in m.timings],
+                         ['first', 'region', 'size', 'rotation', 'quality',
+                          'format', 'last'])
+        for (name, secs) in m.timings:
+            self.assertTrue(secs >= 0.0)
+
+    def test18_image_dimensions(self):
+        """Test image_dimensions() and do_first() not repeated in derive()."""
+        m = IIIFManipulator()
+        m.srcfile = 'testimages/test1.png'
+        self.assertEqual(m.image_dimensions(), (-1, -1))
+        self.assertEqual(m.first_srcfile, 'testimages/test1.png')
+        r = IIIFRequest()
+        r.parse_url('id1/full/full/0/default')
+        tmp = tempfile.mkdtemp()
+        try:
+            with mock.patch.object(IIIFManipulator, 'do_first') as do_first:
+                m.derive(srcfile='testimages/test1.png', request=r,
+                         outfile=os.path.join(tmp, 'testout.png'))
+                self.assertFalse(do_first.called)
+                self.assertEqual(m.first_srcfile, None)
+                # but is done for the next derive
+                m.derive(srcfile='testimages/test1.png', request=r,
+                         outfile=os.path.join(tmp, 'testout.png'))
+                self.assertTrue(do_first.called)
+        finally:
+            shutil.rmtree(tmp)
@@ -1,4 +1,5 @@
 """Test code for generators of IIIF Images."""
+import mock
 import unittest
 import tempfile
 import os
@@ -85,3 +86,53 @@ class TestAll(unittest.TestCase):
         m.do_size(101, 102)
         self.assertEqual(m.sw, 101)
         self.assertEqual(m.sh, 102)
+
+    def test_do_size_pixels(self):
+        """Test do_size with generator pixels() method."""
+        m = IIIFManipulatorGen()
+        m.srcfile = 'check'
+        m.do_first()
+        m.do_region(100, 200, 3000, 2500)
+        m.do_size(60, 50)
+        image = m.image
+        # same as per-pixel generation
+        with mock.patch('iiif.manipulator_gen.np', None):
+            m.do_size(60, 50)
+        self.assertEqual(image.size, (60, 50))
+        self.assertEqual(image.mode, 'RGB')
+        self.assertEqual(image.tobytes(), m.image.tobytes())
+
+    def test_do_size_render(self):
+        """Test do_size with generator render() method."""
+        m = IIIFManipulatorGen()
+        m.srcfile = 'mandlebrot_100k'
+        m.do_first()
+        m.do_region(30000, 45000, 2000, 2000)
+        m.do_size(100, 100)
+        image = m.image
+        # same as per-pixel generation
+        with mock.patch('iiif.manipulator_gen.np', None):
+            with mock.patch('iiif.generators.mandlebrot_100k.np', None):
+                m.do_size(100, 100)
+        self.assertEqual(image.size, (100, 100))
+        self.assertEqual(image.tobytes(), m.image.tobytes())
+
+    def test_do_size_workers(self):
+        """Test do_size with strips generated by worker processes."""
+        m = IIIFManipulatorGen()
+        m.srcfile = 'mandlebrot_100k'
+        m.do_first()
+        m.do_region(30000, 45000, 20000, 20000)
+        m.strip_height = 64
+        m.do_size(150, 150)
+        image = m.image
+        try:
+            m.workers = 2
+            self.assertTrue(IIIFManipulatorGen.executor(2))
+            m.do_size(150, 150)
+        finally:
+            IIIFManipulatorGen.executor_shutdown()
+        self.assertEqual(image.size, (150, 150))
+        self.assertEqual(image.tobytes(), m.image.tobytes())
+        self.assertEqual(IIIFManipulatorGen.executor(0), None)
+        self.assertEqual(IIIFManipulatorGen(workers=3).workers, 3)
@@ -1,15 +1,19 @@
 """Test code for PIL based IIIF image manipulator."""
 import unittest
+import gc
 import tempfile
 import os
 import os.path
 import re
 import sys
+import warnings
+import mock
 from testfixtures import LogCapture
 
 from PIL import Image
 
 from iiif.error import IIIFError
+from iiif.image_cache import IIIFImageCache
 from iiif.manipulator_pil import IIIFManipulatorPIL
 from iiif.request import IIIFRequest
 
@@ -201,3 +205,218 @@ class TestAll(unittest.TestCase):
             self.assertEqual(m.cleanup(), None)
             self.assertEqual(lc.records[-1].msg,
                              'Failed to cleanup tmp output file /this_will_not_exist_really_I_hope')
+
+    def test10_reduce_decode(self):
+        """Test reduced resolution decode for scaled down requests."""
+        # no request, nothing done
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/starfish.jpg'
+        m.do_first()
+        self.assertEqual(m.reduce_decode(3000, 4000), 1)
+        # thumbnail of JPEG uses 1/8 scale decode
+        m.request = IIIFRequest(identifier='a').parse_url('full/256,/0/default.jpg')
+        self.assertEqual(m.reduce_decode(3000, 4000), 8)
+        self.assertEqual(m.image.size, (375, 500))
+        self.assertEqual((m.width, m.height), (3000, 4000))
+        # region, 1/2 scale only
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/starfish.jpg'
+        m.request = IIIFRequest(identifier='a').parse_url('1000,1000,1000,1000/400,/0/default.jpg')
+        m.do_first()
+        m.do_region(1000, 1000, 1000, 1000)
+        self.assertEqual(m.image.size, (1500, 2000))
+        self.assertEqual(m.region_box, (500.0, 500.0, 1000.0, 1000.0))
+        self.assertEqual((m.width, m.height), (1000, 1000))
+        m.do_size(400, 400)
+        self.assertEqual(m.image.size, (400, 400))
+        self.assertEqual(m.region_box, None)
+        # no reduction for small scaling or for PNG
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/starfish.jpg'
+        m.request = IIIFRequest(identifier='a').parse_url('full/2000,/0/default.jpg')
+        m.do_first()
+        self.assertEqual(m.reduce_decode(3000, 4000), 1)
+        self.assertEqual(m.image.size, (3000, 4000))
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/test1.png'
+        m.request = IIIFRequest(identifier='a').parse_url('full/20,/0/default.jpg')
+        m.do_first()
+        self.assertEqual(m.reduce_decode(175, 131), 1)
+        self.assertEqual(m.image.size, (175, 131))
+        # complete derivation
+        m = IIIFManipulatorPIL()
+        r = IIIFRequest(identifier='a').parse_url('full/256,/0/default.png')
+        m.derive(srcfile='testimages/starfish.jpg', request=r)
+        self.assertEqual(Image.open(m.outfile).size, (256, 341))
+        m.cleanup()
+
+    def test11_region_and_size(self):
+        """Test region is extracted as part of size scaling."""
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/test1.png'
+        m.do_first()
+        m.do_region(10, 20, 100, 75)
+        self.assertEqual(m.region_box, (10, 20, 110, 95))
+        self.assertEqual(m.image.size, (175, 131))  # not yet cropped
+        m.do_size(None, None)
+        self.assertEqual(m.image.size, (100, 75))
+        self.assertEqual(m.region_box, None)
+        m.do_first()
+        m.do_region(10, 20, 100, 75)
+        m.do_size(40, 30)
+        self.assertEqual(m.image.size, (40, 30))
+        self.assertEqual((m.width, m.height), (40, 30))
+
+    def test12_mirror_rotate(self):
+        """Test mirror and rotation in one transform."""
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/test1.png'
+        m.do_first()
+        m.image = m.image.convert('L')
+        expected = m.image.transpose(Image.FLIP_LEFT_RIGHT).rotate(-30.0, expand=True)
+        self.assertEqual(m.do_rotation(True, 30.0), None)
+        self.assertEqual(m.image.size, expected.size)
+        self.assertEqual(m.image.tobytes(), expected.tobytes())
+        # mirroring supported in derive()
+        self.assertTrue(m.mirroring)
+        m = IIIFManipulatorPIL(in_memory=True)
+        r = IIIFRequest(identifier='a').parse_url('full/full/!30/default.png')
+        (outbuf, mime_type) = m.derive(srcfile='testimages/test1.png', request=r)
+        src = Image.open('testimages/test1.png')
+        expected = src.transpose(Image.FLIP_LEFT_RIGHT).rotate(-30.0, expand=True)
+        image = Image.open(outbuf)
+        self.assertEqual(image.size, expected.size)
+        self.assertEqual(image.tobytes(), expected.tobytes())
+
+    def test13_do_rotation_transpose(self):
+        """Test right angle rotations and mirroring done with transpose."""
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/test1.png'
+        m.do_first()
+        src = m.image.convert('RGB')
+        for mirror in (False, True):
+            for rot in (0.0, 90.0, 180.0, 270.0):
+                if (not mirror and rot == 0.0):
+                    continue
+                expected = src.transpose(Image.FLIP_LEFT_RIGHT) if mirror else src
+                expected = expected.rotate(-rot, expand=True)
+                m.image = src
+                self.assertEqual(m.do_rotation(mirror, rot), None)
+                self.assertEqual(m.image.size, expected.size)
+                self.assertEqual(m.image.tobytes(), expected.tobytes())
+        # mirroring with right angle rotations through derive()
+        for rotation in ('!0', '!90', '!180', '!270'):
+            m = IIIFManipulatorPIL(in_memory=True)
+            r = IIIFRequest(identifier='a').parse_url('full/full/%s/default.png' % (rotation))
+            with mock.patch.object(Image.Image, 'transform') as transform:
+                (outbuf, mime_type) = m.derive(srcfile='testimages/test1.png', request=r)
+                self.assertFalse(transform.called)
+            expected = src.transpose(Image.FLIP_LEFT_RIGHT).rotate(-float(rotation[1:]), expand=True)
+            image = Image.open(outbuf)
+            self.assertEqual(image.size, expected.size)
+            self.assertEqual(image.tobytes(), expected.tobytes())
+
+    def test14_image_cache(self):
+        """Test use of shared cache of decoded source images."""
+        cache = IIIFImageCache()
+        try:
+            IIIFManipulatorPIL.image_cache = cache
+            # thumbnail decoded at 1/8 scale and cached
+            m = IIIFManipulatorPIL()
+            r = IIIFRequest(identifier='a').parse_url('full/256,/0/default.png')
+            m.derive(srcfile='testimages/starfish.jpg', request=r)
+            m.cleanup()
+            self.assertEqual(len(cache), 1)
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+            # same again uses cached image
+            m = IIIFManipulatorPIL()
+            m.derive(srcfile='testimages/starfish.jpg', request=r)
+            self.assertEqual(m.cached_image.size, (375, 500))
+            self.assertEqual(Image.open(m.outfile).size, (256, 341))
+            m.cleanup()
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+            # full size image cached and not closed in cleanup
+            m = IIIFManipulatorPIL()
+            r = IIIFRequest(identifier='a').parse_url('full/full/0/default.png')
+            m.derive(srcfile='testimages/test1.png', request=r)
+            m.cleanup()
+            self.assertEqual(len(cache), 2)
+            m = IIIFManipulatorPIL()
+            m.derive(srcfile='testimages/test1.png', request=r)
+            self.assertEqual(Image.open(m.outfile).size, (175, 131))
+            m.cleanup()
+            self.assertEqual((cache.hits, cache.misses), (2, 4))
+        finally:
+            IIIFManipulatorPIL.image_cache = None
+
+    def test15_reduce_cached(self):
+        """Test use of reduced resolution images from the cache."""
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/test1.png'
+        m.image_cache = IIIFImageCache()
+        m.do_first()
+        m.image.load()
+        m.image_cache.put(m.image_cache.key(m.srcfile), m.image)
+        half = m.image.reduce(2)
+        m.image_cache.put(m.image_cache.key(m.srcfile, 2), half)
+        # no 1/4 scale image so 1/2 scale used
+        m.do_first()
+        self.assertEqual(m.reduce_cached(175, 131, 40, 30), 2)
+        self.assertIs(m.image, half)
+        self.assertIs(m.cached_image, half)
+        # not reduced enough for 1/2 scale
+        m.do_first()
+        self.assertEqual(m.reduce_cached(175, 131, 100, 75), 1)
+        self.assertEqual(m.image.size, (175, 131))
+        # via do_region, region mapped onto 1/2 scale image
+        m.request = IIIFRequest(identifier='a').parse_url('0,0,100,100/25,/0/default.png')
+        m.do_first()
+        m.do_region(0, 0, 100, 100)
+        self.assertIs(m.image, half)
+        self.assertEqual(m.region_box, (0.0, 0.0, 50.0, 50.0))
+        m.do_size(25, 25)
+        self.assertEqual(m.image.size, (25, 25))
+
+    def test16_image_dimensions(self):
+        """Test image_dimensions() reads size without leaving image open."""
+        m = IIIFManipulatorPIL()
+        m.srcfile = 'testimages/starfish.jpg'
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            self.assertEqual(m.image_dimensions(), (3000, 4000))
+            gc.collect()
+        self.assertEqual([x for x in w if issubclass(x.category, ResourceWarning)], [])
+        self.assertEqual((m.width, m.height), (3000, 4000))
+        self.assertEqual(m.image, None)
+        m.srcfile = 'testimages/bad/pdf_example.pdf'
+        self.assertRaises(IIIFError, m.image_dimensions)
+
+    def test17_do_format_in_memory(self):
+        """Test format selection with in-memory output."""
+        m = IIIFManipulatorPIL(in_memory=True)
+        m.srcfile = 'testimages/test1.png'
+        m.do_first()
+        self.assertEqual(m.do_format('png'), None)
+        self.assertEqual(m.outfile, None)
+        self.assertEqual(m.outtmp, None)
+        img = Image.open(m.outbuf)
+        self.assertEqual(img.format, 'PNG')
+        self.assertEqual(img.size, (175, 131))
+        m.cleanup()
+        self.assertEqual(m.outbuf, None)
+        # derive returns buffer
+        m = IIIFManipulatorPIL(in_memory=True)
+        r = IIIFRequest(identifier='a').parse_url('full/10,/0/default.jpg')
+        (outbuf, mime_type) = m.derive(srcfile='testimages/test1.png', request=r)
+        self.assertEqual(outbuf, m.outbuf)
+        self.assertEqual(mime_type, 'image/jpeg')
+        self.assertEqual(Image.open(outbuf).size, (10, 7))
+        # output file specified takes precedence
+        m = IIIFManipulatorPIL(in_memory=True)
+        m.outfile = tempfile.NamedTemporaryFile(delete=True).name
+        m.srcfile = 'testimages/test1.png'
+        m.do_first()
+        m.do_format(None)
+        self.assertEqual(m.outbuf, None)
+        self.assertTrue(os.path.exists(m.outfile))
+        os.unlink(m.outfile)
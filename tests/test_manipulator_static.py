@@ -0,0 +1,133 @@
+"""Test code for iiif/manipulator_static.py."""
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from iiif.error import IIIFError
+from iiif.manipulator_pil import IIIFManipulatorPIL
+from iiif.manipulator_static import IIIFManipulatorStatic
+from iiif.request import IIIFRequest
+from iiif.static import IIIFStatic
+from iiif.static_pack import IIIFStaticPackReader
+from testfixtures import LogCapture
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Generate static files for test image in directory and pack."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(os.path.dirname(__file__), '../testimages/test1.png')
+        self.pack_file = os.path.join(self.tmpdir, 'test.pack')
+        with LogCapture('iiif.static'):
+            IIIFStatic(dst=self.tmpdir, tilesize=64).generate(
+                src=self.src, identifier='t1')
+            sg = IIIFStatic(dst=self.tmpdir, tilesize=64, pack=self.pack_file)
+            sg.generate(src=self.src, identifier='t1')
+            sg.close()
+        self.pack = IIIFStaticPackReader(self.pack_file)
+
+    def tearDown(self):
+        """Close pack and remove temporary directory."""
+        self.pack.close()
+        shutil.rmtree(self.tmpdir)
+
+    def request(self, path, identifier='t1'):
+        """IIIFRequest for path."""
+        r = IIIFRequest(identifier=identifier, api_version='2.1')
+        r.parse_url(path)
+        return r
+
+    def test01_init(self):
+        """Test initialization."""
+        m = IIIFManipulatorStatic()
+        self.assertEqual(m.compliance_level, 0)
+        self.assertEqual(m.fallback, None)
+        m = IIIFManipulatorStatic(static_dir=self.tmpdir, fallback_klass=IIIFManipulatorPIL,
+                                  api_version='3.0', in_memory=True)
+        self.assertEqual(m.static_dir, self.tmpdir)
+        self.assertEqual(m.compliance_level, 2)
+        self.assertEqual(m.fallback.api_version, '3.0')
+        self.assertTrue(m.fallback.in_memory)
+
+    def test02_identifiers_and_info(self):
+        """Test identifiers(), static_source() and static_info()."""
+        self.assertEqual(IIIFManipulatorStatic().identifiers(), [])
+        m = IIIFManipulatorStatic(static_dir=self.tmpdir)
+        self.assertEqual(m.identifiers(), ['t1'])
+        self.assertEqual(m.static_source('t1'),
+                         os.path.join(self.tmpdir, 't1', 'info.json'))
+        self.assertEqual(m.static_source('t2'), None)
+        self.assertEqual(m.static_source('..'), None)
+        info = m.static_info('t1')
+        self.assertEqual((info.width, info.height), (175, 131))
+        self.assertEqual(m.static_info('t2'), None)
+        m = IIIFManipulatorStatic(static_dir=self.tmpdir, api_version='3.0')
+        self.assertRaises(IIIFError, m.static_info, 't1')
+        m = IIIFManipulatorStatic(static_dir=self.tmpdir, static_pack=self.pack)
+        self.assertEqual(m.identifiers(), ['t1'])
+        self.assertEqual(m.static_source('t1'), self.pack_file)
+        self.assertEqual(m.static_info('t1').width, 175)
+
+    def test03_derive(self):
+        """Test derive() from directory and pack."""
+        with open(os.path.join(self.tmpdir, 't1', '64,64,64,64', '64,', '0', 'default.jpg'), 'rb') as fh:
+            tile = fh.read()
+        with open(os.path.join(self.tmpdir, 't1', 'full', '44,', '0', 'default.jpg'), 'rb') as fh:
+            full = fh.read()
+        for pack in (None, self.pack):
+            args = {'static_dir': self.tmpdir, 'static_pack': pack}
+            m = IIIFManipulatorStatic(**args)
+            (outbuf, mime_type) = m.derive(request=self.request('64,64,64,64/64,/0/default.jpg'))
+            self.assertEqual(mime_type, 'image/jpeg')
+            self.assertEqual(outbuf.getvalue(), tile)
+            m.cleanup()
+            self.assertEqual(m.outbuf, None)
+            # equivalent request in canonical form
+            m = IIIFManipulatorStatic(**args)
+            (outbuf, mime_type) = m.derive(request=self.request('64,64,64,64/full/360/default.jpg'))
+            self.assertEqual(outbuf.getvalue(), tile)
+            m = IIIFManipulatorStatic(**args)
+            (outbuf, mime_type) = m.derive(request=self.request('full/!44,44/0/default.jpg'))
+            self.assertEqual(outbuf.getvalue(), full)
+            # link
+            m = IIIFManipulatorStatic(**args)
+            (outbuf, mime_type) = m.derive(request=self.request('full/44,33/0/default.jpg'))
+            self.assertEqual(outbuf.getvalue(), full)
+            # not pregenerated and no fallback
+            m = IIIFManipulatorStatic(**args)
+            self.assertRaises(IIIFError, m.derive,
+                              request=self.request('full/50,/0/default.jpg'))
+            self.assertRaises(IIIFError, m.do_first)
+        # to outfile
+        outfile = os.path.join(self.tmpdir, 'out', 'tile.jpg')
+        m = IIIFManipulatorStatic(static_dir=self.tmpdir)
+        (out, mime_type) = m.derive(request=self.request('64,64,64,64/64,/0/default.jpg'),
+                                    outfile=outfile)
+        self.assertEqual(out, outfile)
+        with open(outfile, 'rb') as fh:
+            self.assertEqual(fh.read(), tile)
+
+    def test04_derive_fallback(self):
+        """Test derive() with fallback manipulator."""
+        m = IIIFManipulatorStatic(static_dir=self.tmpdir, fallback_klass=IIIFManipulatorPIL,
+                                  in_memory=True)
+        m.srcfile = self.src
+        m.do_first()
+        self.assertEqual((m.width, m.height), (175, 131))
+        self.assertFalse(m.uses_fallback(self.request('full/44,/0/default.jpg')))
+        self.assertTrue(m.uses_fallback(self.request('full/50,/0/default.png')))
+        (outbuf, mime_type) = m.derive(srcfile=self.src,
+                                       request=self.request('full/50,/0/default.png'))
+        self.assertEqual(mime_type, 'image/png')
+        self.assertEqual(outbuf.getvalue()[1:4], b'PNG')
+        m.cleanup()
+        self.assertEqual(m.outbuf, None)
+        # no source image
+        m = IIIFManipulatorStatic(static_dir=self.tmpdir, fallback_klass=IIIFManipulatorPIL,
+                                  in_memory=True)
+        self.assertRaises(IIIFError, m.derive, srcfile=m.static_source('t1'),
+                          request=self.request('full/50,/0/default.png'))
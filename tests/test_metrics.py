@@ -0,0 +1,105 @@
+"""Test code for iiif/metrics.py."""
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from iiif.metrics import IIIFMetrics, series_key, format_value
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def test01_series_key(self):
+        """Test series_key() and format_value()."""
+        self.assertEqual(series_key('a_total', None), 'a_total')
+        self.assertEqual(series_key('a_total', {'z': 1, 'b': 'x"y'}),
+                         'a_total{b="x\\"y",z="1"}')
+        self.assertEqual(format_value(3.0), '3')
+        self.assertEqual(format_value(0.25), '0.25')
+
+    def test02_render(self):
+        """Test counters, gauges and histograms in text format."""
+        m = IIIFMetrics()
+        self.assertEqual(m.render(), '\n')
+        m.request_started('p')
+        m.request_started('p')
+        m.request_finished('p', 'image', 200, 1000, 0.2)
+        m.observe_stages('pil', [('first', 0.001), ('format', 0.02)])
+        m.inc('other_total')
+        text = m.render()
+        lines = text.split('\n')
+        self.assertIn('# TYPE iiif_requests_total counter', lines)
+        self.assertIn('iiif_requests_total{code="200",prefix="p",type="image"} 1', lines)
+        self.assertIn('iiif_response_bytes_total{prefix="p",type="image"} 1000', lines)
+        self.assertIn('# TYPE iiif_requests_in_flight gauge', lines)
+        self.assertIn('iiif_requests_in_flight{prefix="p"} 1', lines)
+        self.assertIn('# TYPE iiif_request_duration_seconds histogram', lines)
+        self.assertIn('iiif_request_duration_seconds_bucket{prefix="p",type="image",le="0.1"} 0', lines)
+        self.assertIn('iiif_request_duration_seconds_bucket{prefix="p",type="image",le="0.25"} 1', lines)
+        self.assertIn('iiif_request_duration_seconds_bucket{prefix="p",type="image",le="+Inf"} 1', lines)
+        self.assertIn('iiif_request_duration_seconds_sum{prefix="p",type="image"} 0.2', lines)
+        self.assertIn('iiif_request_duration_seconds_count{prefix="p",type="image"} 1', lines)
+        self.assertIn('iiif_stage_duration_seconds_bucket{manipulator="pil",stage="first",le="0.005"} 1', lines)
+        self.assertIn('iiif_stage_duration_seconds_count{manipulator="pil",stage="format"} 1', lines)
+        self.assertIn('# TYPE other_total untyped', lines)
+        self.assertIn('other_total 1', lines)
+        # histogram without labels
+        m.observe('h', None, 1.0, buckets=(1.0, 2.0))
+        lines = m.render().split('\n')
+        self.assertIn('h_bucket{le="1"} 1', lines)
+        self.assertIn('h_bucket{le="+Inf"} 1', lines)
+        self.assertIn('h_sum 1', lines)
+
+    def test03_collectors(self):
+        """Test add_collector()."""
+        m = IIIFMetrics()
+        stats = {'hits': 1}
+        m.add_collector(lambda: [('c_total', {'event': 'hits'}, stats['hits'])])
+        self.assertIn('c_total{event="hits"} 1\n', m.render())
+        stats['hits'] = 5
+        self.assertIn('c_total{event="hits"} 5\n', m.render())
+
+    def test04_multiprocess(self):
+        """Test aggregation over processes with shared directory."""
+        metrics_dir = os.path.join(self.tmpdir, 'metrics')
+        m1 = IIIFMetrics(metrics_dir)
+        m2 = IIIFMetrics(metrics_dir)
+        self.assertTrue(os.path.isdir(metrics_dir))
+        m1.request_started('p')
+        m1.request_finished('p', 'info', 200, 10, 0.01)
+        m2.request_started('p')
+        m2.request_finished('p', 'info', 200, 20, 0.02)
+        m2.request_started('p')
+        m2.flush()
+        self.assertEqual(len(os.listdir(metrics_dir)), 1)
+        lines = m1.render().split('\n')
+        self.assertEqual(len(os.listdir(metrics_dir)), 2)
+        self.assertIn('iiif_requests_total{code="200",prefix="p",type="info"} 2', lines)
+        self.assertIn('iiif_response_bytes_total{prefix="p",type="info"} 30', lines)
+        self.assertIn('iiif_request_duration_seconds_count{prefix="p",type="info"} 2', lines)
+        self.assertIn('iiif_requests_in_flight{prefix="p"} 1', lines)
+        # snapshot of process that has exited, gauges ignored
+        p = subprocess.Popen([sys.executable, '-c', 'pass'])
+        p.wait()
+        snapshot = m2.snapshot()
+        snapshot['pid'] = p.pid
+        with open(os.path.join(metrics_dir, 'metrics_%d_0.json' % (p.pid)), 'w') as fh:
+            json.dump(snapshot, fh)
+        with open(os.path.join(metrics_dir, 'metrics_1_1.json'), 'w') as fh:
+            fh.write('not json')
+        lines = m1.render().split('\n')
+        self.assertIn('iiif_requests_total{code="200",prefix="p",type="info"} 3', lines)
+        self.assertIn('iiif_requests_in_flight{prefix="p"} 1', lines)
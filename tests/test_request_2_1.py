@@ -399,3 +399,20 @@ class TestAll(TestRequests):
         """Caret for upscaling not allowed in 2.1."""
         r = IIIFRequest(api_version='2.1')
         self.assertRaises(IIIFError, r.parse_size, '^100,100')
+
+    def test22_canonicalize(self):
+        """Canonical form of requests."""
+        for (path, canonical) in [
+                ("full/full/0/default.jpg", "a/full/full/0/default.jpg"),
+                ("0,0,300,400/max/360/default.jpg", "a/full/full/0/default.jpg"),
+                ("pct:0,0,100,100/pct:100/0/default.jpg", "a/full/full/0/default.jpg"),
+                ("pct:10,10,50,50/pct:25/!22.50/default.png", "a/30,40,150,200/38,50/!22.5/default.png"),
+                ("square/100,100/90/gray.jpg", "a/0,50,300,300/100,/90/gray.jpg"),
+                ("full/!100,100/0/default.jpg", "a/full/75,/0/default.jpg"),
+                ("full/,200/0/default.jpg", "a/full/150,/0/default.jpg"),
+                ("full/100,200/0/default.jpg", "a/full/100,200/0/default.jpg")]:
+            r = IIIFRequest(api_version='2.1', identifier='a').parse_url(path)
+            self.assertEqual(r.canonicalize(300, 400).url(), canonical)
+        # bad for image size
+        r = IIIFRequest(api_version='2.1', identifier='a').parse_url('500,0,10,10/full/0/default.jpg')
+        self.assertRaises(IIIFError, r.canonicalize, 300, 400)
@@ -358,6 +358,12 @@ class TestAll(TestRequests):
         r.size_max = True
         self.assertEqual(r.url(identifier='abc5'),
                          'abc5/full/max/0/default')
+        # mirroring and upscaling are kept after parsing
+        r = IIIFRequest(api_version='3.0', identifier='abc6')
+        r.parse_url('full/^200,/!90/default.png')
+        self.assertTrue(r.size_caret)
+        self.assertTrue(r.rotation_mirror)
+        self.assertEqual(r.url(), 'abc6/full/%5E200,/!90/default.png')
 
     def test19_split_url(self):
         """Test split_url() method.
@@ -396,3 +402,19 @@ class TestAll(TestRequests):
             self.assertEqual(got_code, code,
                              "Bad code %s, expected %d, for path %s" %
                              (str(got_code), code, path))
+
+    def test21_canonicalize(self):
+        """Canonical form of requests."""
+        for (path, canonical) in [
+                ("full/max/0/default.jpg", "a/full/max/0/default.jpg"),
+                ("0,0,300,400/300,400/360/default.jpg", "a/full/max/0/default.jpg"),
+                ("pct:0,0,100,100/pct:100/0/default.jpg", "a/full/max/0/default.jpg"),
+                ("square/100,100/90/gray.jpg", "a/0,50,300,300/100,100/90/gray.jpg"),
+                ("full/!100,100/0/default.jpg", "a/full/75,100/0/default.jpg"),
+                ("full/,200/!0/default.jpg", "a/full/150,200/!0/default.jpg"),
+                ("full/^600,/0/default.jpg", "a/full/%5E600,800/0/default.jpg")]:
+            r = IIIFRequest(api_version='3.0', identifier='a').parse_url(path)
+            self.assertEqual(r.canonicalize(300, 400).url(), canonical)
+        # upscaling without caret
+        r = IIIFRequest(api_version='3.0', identifier='a').parse_url('full/600,/0/default.jpg')
+        self.assertRaises(IIIFError, r.canonicalize, 300, 400)
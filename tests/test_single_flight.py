@@ -0,0 +1,104 @@
+"""Test code for iiif/single_flight.py."""
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from iiif.single_flight import IIIFSingleFlight, fcntl
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def run_concurrent(self, sf, key, fn, n=5):
+        """Call sf.do(key, fn) in n threads while fn blocks, return results."""
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.call(sf, key, fn)))
+                   for j in range(n)]
+        for t in threads:
+            t.start()
+        # wait until all but the leader are waiting
+        for j in range(100):
+            if (sf.stats()['followers'] >= n - 1):
+                break
+            time.sleep(0.01)
+        self.release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def call(self, sf, key, fn):
+        """sf.do(key, fn) returning exception instead of raising it."""
+        try:
+            return sf.do(key, fn)
+        except Exception as e:
+            return e
+
+    def test01_init(self):
+        """Test initialization."""
+        sf = IIIFSingleFlight()
+        self.assertFalse(sf.locking)
+        self.assertEqual(sf.stats(), {'leaders': 0, 'followers': 0, 'in_flight': 0})
+        lock_dir = os.path.join(self.tmpdir, 'locks')
+        sf = IIIFSingleFlight(lock_dir=lock_dir)
+        self.assertTrue(os.path.isdir(lock_dir))
+        self.assertEqual(sf.locking, fcntl is not None)
+
+    def test02_do(self):
+        """Test concurrent calls share one computation."""
+        sf = IIIFSingleFlight()
+        self.assertEqual(sf.do('a', lambda: 1), 1)
+        self.assertEqual(sf.do('a', lambda: 2), 2)
+        self.release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            self.release.wait()
+            return 'data'
+        results = self.run_concurrent(sf, 'b', fn)
+        self.assertEqual(results, ['data'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sf.stats(), {'leaders': 3, 'followers': 4, 'in_flight': 0})
+
+    def test03_do_error(self):
+        """Test exception is raised for leader and followers."""
+        sf = IIIFSingleFlight()
+        self.release = threading.Event()
+
+        def fn():
+            self.release.wait()
+            raise ValueError('bad')
+        results = self.run_concurrent(sf, 'c', fn, n=3)
+        self.assertEqual(len(results), 3)
+        for e in results:
+            self.assertTrue(isinstance(e, ValueError))
+        # key is not left in flight
+        self.assertEqual(sf.do('c', lambda: 'ok'), 'ok')
+
+    @unittest.skipIf(fcntl is None, "Requires fcntl")
+    def test04_lock_files(self):
+        """Test lock file acquire and release."""
+        sf = IIIFSingleFlight(lock_dir=self.tmpdir)
+        path = sf.lock_path('k')
+        self.assertEqual(os.path.dirname(path), self.tmpdir)
+        self.assertTrue(path.endswith('.lock'))
+        lock = sf.acquire('k')
+        self.assertEqual(lock[1], path)
+        self.assertTrue(os.path.exists(path))
+        sf.release(lock)
+        self.assertFalse(os.path.exists(path))
+        # lock held during computation
+        self.assertEqual(sf.do('k', lambda: os.path.exists(path)), True)
+        self.assertFalse(os.path.exists(path))
@@ -7,6 +7,9 @@ import tempfile
 import unittest
 import sys
 import contextlib
+import json
+import mock
+from PIL import Image
 from testfixtures import LogCapture
 try:  # python2
     # Must try this first as io also exists in python2
@@ -16,8 +19,10 @@ except ImportError:  # python3
     import io
 
 from iiif.request import IIIFRequestError
-from iiif.static import IIIFStatic, IIIFStaticError, static_partial_tile_sizes, static_full_sizes
+from iiif.static import (IIIFStatic, IIIFStaticError, static_partial_tile_sizes, static_full_sizes,
+                         halve_image, static_dir_sources, static_list_sources)
 from iiif.manipulator_gen import IIIFManipulatorGen
+from iiif.static_pack import IIIFStaticPackReader
 
 
 class MyLogCapture(LogCapture):
@@ -35,6 +40,20 @@ class MyLogCapture(LogCapture):
 class TestAll(unittest.TestCase):
     """Tests."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Make 1500x2000 source image in temporary directory."""
+        cls.srcdir = tempfile.mkdtemp()
+        cls.src = os.path.join(cls.srcdir, 'starfish_1500x2000.png')
+        with Image.open('testimages/starfish.jpg') as image:
+            image.draft('RGB', (1500, 2000))
+            image.save(cls.src, compress_level=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove temporary directory."""
+        shutil.rmtree(cls.srcdir)
+
     def test01_init(self):
         """Test initialization."""
         s = IIIFStatic()
@@ -53,6 +72,8 @@ class TestAll(unittest.TestCase):
         # Test passing generator flag
         s = IIIFStatic(generator=True)
         self.assertEqual(s.manipulator_klass, IIIFManipulatorGen)
+        s = IIIFStatic(generator=True, generator_workers=3)
+        self.assertEqual(s.manipulator_args, {'workers': 3})
         # Test extra
         s = IIIFStatic(extras=['/full/full/0/default.png'])
         self.assertEqual(len(s.extras), 1)
@@ -86,7 +107,7 @@ class TestAll(unittest.TestCase):
             s = IIIFStatic(dst=tmp1, tilesize=512,
                            api_version='1.1', osd_version='1.0.0', dryrun=True)
             with MyLogCapture('iiif.static') as lc:
-                s.generate(src='testimages/starfish_1500x2000.png',
+                s.generate(src=self.src,
                            identifier='a')
             self.assertTrue(re.search(' / a/info.json', lc.all_msgs))
             self.assertTrue(
@@ -101,7 +122,7 @@ class TestAll(unittest.TestCase):
             s = IIIFStatic(dst=tmp1, tilesize=512,
                            api_version='2.0', dryrun=True)
             with MyLogCapture('iiif.static') as lc:
-                s.generate(src='testimages/starfish_1500x2000.png',
+                s.generate(src=self.src,
                            identifier='a')
             self.assertTrue(re.search(' / a/info.json', lc.all_msgs))
             self.assertTrue(
@@ -122,7 +143,7 @@ class TestAll(unittest.TestCase):
                                    'full/150,200/0/default.jpg'],
                            dryrun=True)
             with MyLogCapture('iiif.static') as lc:
-                s.generate(src='testimages/starfish_1500x2000.png',
+                s.generate(src=self.src,
                            identifier='a')
             self.assertTrue(re.search(' / a/info.json', lc.all_msgs))
             self.assertTrue(
@@ -137,7 +158,7 @@ class TestAll(unittest.TestCase):
         try:
             s = IIIFStatic(dst=tmp2, tilesize=1024, api_version='2.0')
             with MyLogCapture('iiif.static') as lc:
-                s.generate(src='testimages/starfish_1500x2000.png',
+                s.generate(src=self.src,
                            identifier='b')
             self.assertTrue(os.path.isfile(os.path.join(tmp2, 'b/info.json')))
             self.assertTrue(os.path.isfile(os.path.join(
@@ -155,7 +176,7 @@ class TestAll(unittest.TestCase):
         try:
             s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0')
             s.identifier = 'fgh'
-            s.src = 'testimages/starfish_1500x2000.png'
+            s.src = self.src
             with MyLogCapture('iiif.static') as lc:
                 s.generate_tile(region='full', size=[0, 1])
             self.assertTrue(re.search(r'zero size, skipped', lc.all_msgs))
@@ -423,3 +444,209 @@ class TestAll(unittest.TestCase):
         open(tmp2, 'w').close()
         s.identifier = 'abc4'
         self.assertRaises(Exception, s.write_html, tmp2)
+
+    def test10_generate_decode_once(self):
+        """Test that source image is opened and decoded just once."""
+        tmp1 = tempfile.mkdtemp()
+        try:
+            s = IIIFStatic(dst=tmp1, tilesize=1024, api_version='2.0',
+                           extras=['full/99,/0/default.png'])
+            with mock.patch('iiif.manipulator_pil.Image.open',
+                            wraps=Image.open) as mock_open:
+                s.generate(src=self.src,
+                           identifier='c')
+            self.assertEqual(mock_open.call_count, 1)
+            self.assertEqual(s.image_cache, None)
+            # full image for scale factor 2 from level made by halving
+            tile = Image.open(os.path.join(tmp1, 'c/full/750,/0/default.jpg'))
+            self.assertEqual(tile.size, (750, 1000))
+            self.assertTrue(os.path.isfile(os.path.join(
+                tmp1, 'c/1024,1024,476,976/476,/0/default.jpg')))
+            self.assertTrue(os.path.isfile(os.path.join(
+                tmp1, 'c/full/99,/0/default.png')))
+        finally:
+            shutil.rmtree(tmp1)
+
+    def test11_halve_image(self):
+        """Test halve_image."""
+        image = Image.new('RGB', (5, 3), (10, 20, 30))
+        half = halve_image(image)
+        self.assertEqual(half.size, (3, 2))
+        self.assertEqual(half.getpixel((0, 0)), (10, 20, 30))
+        # fallback with resize
+        with mock.patch.object(Image.Image, 'reduce', side_effect=ValueError):
+            half = halve_image(image)
+        self.assertEqual(half.size, (3, 2))
+        self.assertEqual(half.getpixel((2, 1)), (10, 20, 30))
+
+    def test12_generate_jobs(self):
+        """Test generation with worker processes gives same files."""
+        tmp1 = tempfile.mkdtemp()
+        try:
+            trees = []
+            for jobs in (0, 2):
+                dst = os.path.join(tmp1, str(jobs))
+                os.mkdir(dst)
+                s = IIIFStatic(dst=dst, tilesize=512, api_version='2.0', jobs=jobs,
+                               extras=['full/99,/0/default.png'])
+                s.generate(src=self.src, identifier='d')
+                tree = {}
+                for (dirpath, dirnames, filenames) in os.walk(dst):
+                    for name in dirnames + filenames:
+                        path = os.path.join(dirpath, name)
+                        if (os.path.islink(path)):
+                            tree[os.path.relpath(path, dst)] = os.readlink(path)
+                        elif (name == 'manifest.json'):
+                            # same apart from modification times
+                            with open(path, 'r') as fh:
+                                manifest = json.load(fh)
+                            for entry in manifest['files'].values():
+                                del entry['mtime']
+                            tree[os.path.relpath(path, dst)] = manifest['files']
+                        elif (os.path.isfile(path)):
+                            with open(path, 'rb') as fh:
+                                tree[os.path.relpath(path, dst)] = fh.read()
+                trees.append(tree)
+                self.assertEqual(s.files_written, 27)
+                self.assertGreater(s.bytes_written, 0)
+            self.assertEqual(trees[0], trees[1])
+            # no executor without fork
+            s = IIIFStatic(dst=tmp1, jobs=2)
+            with mock.patch('multiprocessing.get_all_start_methods',
+                            return_value=['spawn']):
+                self.assertEqual(s.executor(), None)
+            self.assertEqual(IIIFStatic(dst=tmp1, jobs=1).executor(), None)
+        finally:
+            shutil.rmtree(tmp1)
+
+    def test13_generate_manifest(self):
+        """Test incremental and resumed generation using manifest."""
+        tmp1 = tempfile.mkdtemp()
+        try:
+            src = self.src
+            s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0')
+            s.generate(src=src, identifier='e')
+            self.assertEqual((s.files_written, s.files_skipped), (26, 0))
+            self.assertTrue(os.path.isfile(os.path.join(tmp1, 'e/manifest.json')))
+            # nothing to do second time, source not decoded and files
+            # not checksummed
+            s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0')
+            with mock.patch('iiif.static.halve_image') as mock_halve:
+                with mock.patch('iiif.static_manifest.file_sha1') as mock_sha1:
+                    s.generate(src=src, identifier='e')
+                    self.assertFalse(mock_sha1.called)
+                self.assertFalse(mock_halve.called)
+            self.assertEqual((s.files_written, s.files_skipped), (0, 26))
+            # missing and changed files generated again
+            os.remove(os.path.join(tmp1, 'e/0,0,512,512/512,/0/default.jpg'))
+            with open(os.path.join(tmp1, 'e/full/375,/0/default.jpg'), 'wb') as fh:
+                fh.write(b'bad')
+            s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0')
+            s.generate(src=src, identifier='e')
+            self.assertEqual((s.files_written, s.files_skipped), (2, 24))
+            # force
+            s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0', force=True)
+            s.generate(src=src, identifier='e')
+            self.assertEqual((s.files_written, s.files_skipped), (26, 0))
+            # change of parameters
+            s = IIIFStatic(dst=tmp1, tilesize=1024, api_version='2.0')
+            s.generate(src=src, identifier='e')
+            self.assertEqual((s.files_written, s.files_skipped), (15, 0))
+            # interrupted run then resumed, manifest saved every 5 files
+            # and when interrupted
+            s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0')
+            s.manifest_interval = 5
+            generate_file = s.generate_file
+            calls = []
+
+            def interrupt(r, undistorted=False):
+                calls.append(r)
+                if (len(calls) > 12):
+                    raise KeyboardInterrupt()
+                return generate_file(r, undistorted)
+            with mock.patch.object(s, 'generate_file', side_effect=interrupt):
+                self.assertRaises(KeyboardInterrupt, s.generate, src=src, identifier='e')
+            s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0')
+            s.generate(src=src, identifier='e')
+            self.assertEqual((s.files_written, s.files_skipped), (14, 12))
+        finally:
+            shutil.rmtree(tmp1)
+
+    def test14_static_dir_list_sources(self):
+        """Test static_dir_sources and static_list_sources."""
+        tmp1 = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(tmp1, 'src', 'a', 'b'))
+            for name in ('a/one.jpg', 'a/b/two.PNG', 'three.tif', 'notes.txt'):
+                open(os.path.join(tmp1, 'src', name), 'w').close()
+            src_dir = os.path.join(tmp1, 'src')
+            self.assertEqual(list(static_dir_sources(src_dir)),
+                             [(os.path.join(src_dir, 'three.tif'), 'three'),
+                              (os.path.join(src_dir, 'a', 'one.jpg'), 'a_one'),
+                              (os.path.join(src_dir, 'a', 'b', 'two.PNG'), 'a_b_two')])
+            list_file = os.path.join(tmp1, 'list.txt')
+            with open(list_file, 'w') as fh:
+                fh.write("# comment\nsrc/three.tif\n\nsrc/a\n")
+            self.assertEqual(list(static_list_sources(list_file)),
+                             [(os.path.join(src_dir, 'three.tif'), 'three'),
+                              (os.path.join(src_dir, 'a', 'one.jpg'), 'one'),
+                              (os.path.join(src_dir, 'a', 'b', 'two.PNG'), 'b_two')])
+        finally:
+            shutil.rmtree(tmp1)
+
+    def test15_generate_batch(self):
+        """Test generate_batch with and without worker processes."""
+        tmp1 = tempfile.mkdtemp()
+        try:
+            sources = [('testimages/test1.png', 'a'),
+                       ('testimages/starfish.jpg', 'b'),
+                       ('testimages/test1.png', 'a'),
+                       (os.path.join(tmp1, 'none.png'), 'c')]
+            for jobs in (0, 2):
+                dst = os.path.join(tmp1, str(jobs))
+                s = IIIFStatic(dst=dst, tilesize=256, api_version='2.0', jobs=jobs)
+                with MyLogCapture('iiif.static') as lc:
+                    summary = s.generate_batch(iter(sources))
+                self.assertEqual(summary['images'], 2)
+                self.assertEqual(summary['failed'], 1)
+                self.assertEqual(summary['errors'][0][0:2],
+                                 (os.path.join(tmp1, 'none.png'), 'c'))
+                self.assertTrue(re.search(r'identifier a already used', lc.all_msgs))
+                self.assertEqual(s.files_written, 274)
+                self.assertEqual(s.files_skipped, 0)
+                self.assertTrue(os.path.isfile(os.path.join(dst, 'a', 'info.json')))
+                self.assertTrue(os.path.isfile(os.path.join(dst, 'b', 'info.json')))
+            # again, all up to date, with html
+            s = IIIFStatic(dst=dst, tilesize=256, api_version='2.0', jobs=2)
+            summary = s.generate_batch(sources[0:2], html_args={'html_dir': tmp1})
+            self.assertEqual((summary['images'], s.files_written, s.files_skipped), (2, 0, 274))
+            self.assertTrue(os.path.isfile(os.path.join(tmp1, 'b.html')))
+        finally:
+            shutil.rmtree(tmp1)
+
+    def test16_generate_pack(self):
+        """Test generation into a pack file."""
+        tmp1 = tempfile.mkdtemp()
+        try:
+            pack_file = os.path.join(tmp1, 'images.pack')
+            s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0', pack=pack_file)
+            s.generate(src=self.src, identifier='f')
+            s.close()
+            self.assertEqual(s.files_written, 26)
+            # no image files or info.json written, just manifest
+            self.assertEqual(os.listdir(os.path.join(tmp1, 'f')), ['manifest.json'])
+            reader = IIIFStaticPackReader(pack_file)
+            self.assertTrue(reader.get('f/info.json').startswith(b'{'))
+            # JPEG start of image marker
+            self.assertEqual(reader.get('f/0,0,512,512/512,/0/default.jpg')[0:2], b'\xff\xd8')
+            # link in place of symlink
+            self.assertEqual(reader.get('f/full/375,500/0/default.jpg'),
+                             reader.get('f/full/375,/0/default.jpg'))
+            reader.close()
+            # up to date second time
+            s = IIIFStatic(dst=tmp1, tilesize=512, api_version='2.0', pack=pack_file)
+            s.generate(src=self.src, identifier='f')
+            s.close()
+            self.assertEqual((s.files_written, s.files_skipped), (0, 26))
+        finally:
+            shutil.rmtree(tmp1)
@@ -0,0 +1,148 @@
+"""Test code for iiif/static_manifest.py."""
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from iiif.static_manifest import IIIFStaticManifest, file_sha1
+from iiif.static_pack import IIIFStaticPack
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory with a source and an output file."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, 'src.png')
+        with open(self.src, 'wb') as fh:
+            fh.write(b'source data')
+        os.makedirs(os.path.join(self.tmpdir, 'dst', 'a'))
+        with open(os.path.join(self.tmpdir, 'dst', 'a', 'tile.jpg'), 'wb') as fh:
+            fh.write(b'tile data')
+        self.manifest_file = os.path.join(self.tmpdir, 'dst', 'a', 'manifest.json')
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def test01_file_sha1(self):
+        """Test file_sha1."""
+        self.assertEqual(file_sha1(self.src),
+                         hashlib.sha1(b'source data').hexdigest())
+
+    def test02_init_load_save(self):
+        """Test initialization, load and save."""
+        m = IIIFStaticManifest(self.manifest_file)
+        self.assertEqual(m.params, None)
+        self.assertEqual(m.files, {})
+        m.set_params({'tilesize': 256})
+        m.add('a/tile.jpg', 9, 'abc')
+        m.save()
+        with open(self.manifest_file, 'r') as fh:
+            data = json.load(fh)
+        self.assertEqual(data['params'], {'tilesize': 256})
+        self.assertEqual(data['files'], {'a/tile.jpg': {'size': 9, 'sha1': 'abc'}})
+        m = IIIFStaticManifest(self.manifest_file)
+        self.assertEqual(m.params, {'tilesize': 256})
+        self.assertEqual(len(m.files), 1)
+        # bad manifest ignored
+        with open(self.manifest_file, 'w') as fh:
+            fh.write('not json')
+        m = IIIFStaticManifest(self.manifest_file)
+        self.assertEqual(m.params, None)
+        self.assertEqual(m.files, {})
+        # failure to write leaves no temporary file
+        with mock.patch('os.rename', side_effect=OSError):
+            self.assertRaises(OSError, m.save)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.manifest_file))),
+                         ['manifest.json', 'tile.jpg'])
+
+    def test03_source_info(self):
+        """Test source_info."""
+        m = IIIFStaticManifest(self.manifest_file)
+        info = m.source_info(self.src)
+        self.assertEqual(info['size'], 11)
+        self.assertEqual(info['sha1'], hashlib.sha1(b'source data').hexdigest())
+        # checksum reused if file details unchanged
+        m.set_params({'source': info})
+        with mock.patch('iiif.static_manifest.file_sha1') as mock_sha1:
+            self.assertEqual(m.source_info(self.src), info)
+            self.assertFalse(mock_sha1.called)
+        # but not if changed
+        os.utime(self.src, (1000, 1000))
+        with mock.patch('iiif.static_manifest.file_sha1', return_value='xyz'):
+            self.assertEqual(m.source_info(self.src)['sha1'], 'xyz')
+
+    def test04_set_params(self):
+        """Test set_params."""
+        m = IIIFStaticManifest(self.manifest_file)
+        self.assertFalse(m.set_params({'tilesize': 256}))
+        m.add('a/tile.jpg', 9, 'abc')
+        self.assertTrue(m.set_params({'tilesize': 256}))
+        self.assertEqual(len(m.files), 1)
+        self.assertFalse(m.set_params({'tilesize': 512}))
+        self.assertEqual(m.files, {})
+
+    def test05_is_current(self):
+        """Test is_current."""
+        dst = os.path.join(self.tmpdir, 'dst')
+        m = IIIFStaticManifest(self.manifest_file)
+        self.assertFalse(m.is_current('a/tile.jpg', dst))
+        m.add('a/tile.jpg', 9, hashlib.sha1(b'tile data').hexdigest())
+        self.assertTrue(m.is_current('a/tile.jpg', dst))
+        # wrong size, wrong checksum, missing
+        m.add('a/tile.jpg', 8, hashlib.sha1(b'tile data').hexdigest())
+        self.assertFalse(m.is_current('a/tile.jpg', dst))
+        m.add('a/tile.jpg', 9, 'abc')
+        self.assertFalse(m.is_current('a/tile.jpg', dst))
+        m.add('a/none.jpg', 9, 'abc')
+        self.assertFalse(m.is_current('a/none.jpg', dst))
+        # checksum only needed if modification time changed, new
+        # time then recorded
+        mtime = os.stat(os.path.join(dst, 'a/tile.jpg')).st_mtime
+        m.add('a/tile.jpg', 9, 'abc', mtime=mtime)
+        with mock.patch('iiif.static_manifest.file_sha1') as mock_sha1:
+            self.assertTrue(m.is_current('a/tile.jpg', dst))
+            self.assertFalse(mock_sha1.called)
+        m.add('a/tile.jpg', 9, hashlib.sha1(b'tile data').hexdigest(), mtime=mtime - 10)
+        self.assertTrue(m.is_current('a/tile.jpg', dst))
+        self.assertEqual(m.files['a/tile.jpg']['mtime'], mtime)
+
+    def test06_prune(self):
+        """Test prune."""
+        m = IIIFStaticManifest(self.manifest_file)
+        m.add('a/1.jpg', 1, 'a')
+        m.add('a/2.jpg', 2, 'b')
+        m.prune(['a/2.jpg', 'a/3.jpg'])
+        self.assertEqual(list(m.files.keys()), ['a/2.jpg'])
+
+    def test07_is_current_pack(self):
+        """Test is_current with pack."""
+        pack = IIIFStaticPack(os.path.join(self.tmpdir, 'images.pack'))
+        pack.add('a/x.jpg', b'some data')
+        pack.add('a/tile.jpg', b'tile data')
+        offset = pack.index['a/tile.jpg'][0]
+        m = IIIFStaticManifest(self.manifest_file)
+        sha1 = hashlib.sha1(b'tile data').hexdigest()
+        m.add('a/tile.jpg', 9, 'abc', offset=offset)
+        with mock.patch.object(pack, 'get') as mock_get:
+            self.assertTrue(m.is_current('a/tile.jpg', None, pack))
+            self.assertFalse(mock_get.called)
+        # different offset, checksum checked and new offset recorded
+        m.add('a/tile.jpg', 9, 'abc', offset=0)
+        self.assertFalse(m.is_current('a/tile.jpg', None, pack))
+        m.add('a/tile.jpg', 9, sha1, offset=0)
+        self.assertTrue(m.is_current('a/tile.jpg', None, pack))
+        self.assertEqual(m.files['a/tile.jpg']['offset'], offset)
+        # wrong size, not in pack
+        m.add('a/tile.jpg', 8, sha1, offset=offset)
+        self.assertFalse(m.is_current('a/tile.jpg', None, pack))
+        m.add('a/none.jpg', 9, sha1, offset=offset)
+        self.assertFalse(m.is_current('a/none.jpg', None, pack))
+        pack.close()
@@ -0,0 +1,113 @@
+"""Test code for iiif/static_pack.py."""
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from iiif.static_pack import (IIIFStaticPack, IIIFStaticPackReader,
+                              IIIFStaticPackError, scan_pack)
+
+
+class TestAll(unittest.TestCase):
+    """Tests."""
+
+    def setUp(self):
+        """Make temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.pack_file = os.path.join(self.tmpdir, 'test.pack')
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def test01_write_read(self):
+        """Test writing and reading pack."""
+        pack = IIIFStaticPack(self.pack_file)
+        pack.add('a/info.json', b'{}')
+        pack.add('a/full/4,/0/default.jpg', b'1234')
+        pack.add_link('a/full/4,3/0/default.jpg', 'a/full/4,/0/default.jpg')
+        pack.add_link('a/none', 'a/missing')
+        self.assertEqual(pack.get('a/full/4,/0/default.jpg'), b'1234')
+        self.assertEqual(pack.get('a/full/4,3/0/default.jpg'), b'1234')
+        self.assertEqual(pack.get('b/info.json'), None)
+        index = pack.close()
+        self.assertEqual(len(index), 3)
+        with open(self.pack_file + '.idx', 'r') as fh:
+            data = json.load(fh)
+        self.assertEqual(data['size'], os.path.getsize(self.pack_file))
+        self.assertEqual(len(data['files']), 3)
+        reader = IIIFStaticPackReader(self.pack_file)
+        self.assertEqual(len(reader), 3)
+        self.assertTrue('a/info.json' in reader)
+        self.assertFalse('a/none' in reader)
+        self.assertEqual(reader.get('a/info.json'), b'{}')
+        self.assertEqual(reader.get('a/full/4,3/0/default.jpg'), b'1234')
+        self.assertEqual(reader.get('a/none'), None)
+        reader.close()
+
+    def test02_append_replace(self):
+        """Test adding to existing pack and replacing files."""
+        pack = IIIFStaticPack(self.pack_file)
+        pack.add('a/info.json', b'old')
+        pack.close()
+        pack = IIIFStaticPack(self.pack_file)
+        self.assertEqual(pack.get('a/info.json'), b'old')
+        pack.add('a/info.json', b'new')
+        pack.add('b/info.json', b'bbb')
+        pack.close()
+        reader = IIIFStaticPackReader(self.pack_file)
+        self.assertEqual(reader.get('a/info.json'), b'new')
+        self.assertEqual(reader.get('b/info.json'), b'bbb')
+        reader.close()
+
+    def test03_scan_without_index(self):
+        """Test reader rebuilds index if missing or out of date."""
+        pack = IIIFStaticPack(self.pack_file)
+        pack.add('a/info.json', b'aaa')
+        pack.close()
+        # more added without closing, index out of date
+        pack = IIIFStaticPack(self.pack_file)
+        pack.add('b/info.json', b'bbb')
+        reader = IIIFStaticPackReader(self.pack_file)
+        self.assertEqual(reader.get('b/info.json'), b'bbb')
+        reader.close()
+        os.remove(self.pack_file + '.idx')
+        reader = IIIFStaticPackReader(self.pack_file)
+        self.assertEqual(reader.get('a/info.json'), b'aaa')
+        reader.close()
+        # empty pack
+        empty_file = os.path.join(self.tmpdir, 'empty.pack')
+        IIIFStaticPack(empty_file).close()
+        reader = IIIFStaticPackReader(empty_file)
+        self.assertEqual(len(reader), 0)
+        self.assertEqual(reader.get('a/info.json'), None)
+        reader.close()
+
+    def test04_incomplete_and_bad(self):
+        """Test handling of incomplete last record and bad pack."""
+        pack = IIIFStaticPack(self.pack_file)
+        pack.add('a/info.json', b'aaa')
+        pack.add('b/info.json', b'bbb')
+        pack.close()
+        size = os.path.getsize(self.pack_file)
+        with open(self.pack_file, 'rb+') as fh:
+            fh.truncate(size - 2)
+        with open(self.pack_file, 'rb') as fh:
+            (index, end) = scan_pack(fh)
+        self.assertEqual(list(index.keys()), ['a/info.json'])
+        self.assertLess(end, size - 2)
+        # writer removes incomplete record
+        pack = IIIFStaticPack(self.pack_file)
+        self.assertEqual(os.path.getsize(self.pack_file), end)
+        pack.add('c/info.json', b'ccc')
+        pack.close()
+        reader = IIIFStaticPackReader(self.pack_file)
+        self.assertEqual(reader.get('c/info.json'), b'ccc')
+        self.assertEqual(reader.get('b/info.json'), None)
+        reader.close()
+        # not a pack
+        with open(self.pack_file, 'wb') as fh:
+            fh.write(b'not a pack file at all')
+        self.assertRaises(IIIFStaticPackError, IIIFStaticPack, self.pack_file)